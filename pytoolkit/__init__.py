@@ -2,6 +2,7 @@ from . import (
     applications,
     autoaugment,
     backend,
+    boxes,
     cache,
     callbacks,
     cli,
@@ -25,6 +26,7 @@ from . import (
     optimizers,
     pipeline,
     preprocessing,
+    serving,
     table,
     threading,
     typing,
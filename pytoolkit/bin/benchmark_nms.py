@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""tk.boxes.batched_nmsの速度チェック用コード。"""
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+try:
+    import pytoolkit as tk
+except ImportError:
+    sys.path.append(str(pathlib.Path(__file__).parent.parent.parent))
+    import pytoolkit as tk
+
+logger = tk.log.get(__name__)
+
+
+def main():
+    tk.utils.better_exceptions()
+    tk.log.init(None)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default=64, type=int)
+    parser.add_argument("--boxes", default=2000, type=int)
+    parser.add_argument("--classes", default=20, type=int)
+    parser.add_argument("--conf-threshold", default=0.05, type=float)
+    parser.add_argument("--iou-threshold", default=0.5, type=float)
+    parser.add_argument("--iterations", default=3, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(123)
+    xy = rng.uniform(0, 0.9, size=(args.images, args.boxes, 2))
+    wh = rng.uniform(0.01, 0.3, size=(args.images, args.boxes, 2))
+    bboxes = np.concatenate([xy, xy + wh], axis=-1).astype(np.float32)
+    scores = rng.uniform(0, 1, size=(args.images, args.boxes, args.classes))
+    scores = (scores ** 8).astype(np.float32)  # 検出器っぽく大半を低確信度にする
+
+    kwargs = {
+        "conf_threshold": args.conf_threshold,
+        "iou_threshold": args.iou_threshold,
+    }
+    # numbaのコンパイル分を除くため1回空打ちする
+    tk.boxes.batched_nms(bboxes[:1], scores[:1], **kwargs)
+    for name, fn in [("naive", _naive_nms), ("batched", _batched_nms)]:
+        start_time = time.perf_counter()
+        for _ in range(args.iterations):
+            num_objects = fn(bboxes, scores, **kwargs)
+        elapsed = (time.perf_counter() - start_time) / args.iterations
+        logger.info(
+            f"{name:<8s}: {elapsed * 1000:.1f}ms/batch"
+            f" ({args.images / elapsed:.1f} images/s, {num_objects} objects)"
+        )
+
+
+def _batched_nms(bboxes, scores, conf_threshold, iou_threshold):
+    """tk.boxes.batched_nmsによる処理。"""
+    pred = tk.boxes.batched_nms(
+        bboxes,
+        scores,
+        conf_threshold=conf_threshold,
+        iou_threshold=iou_threshold,
+        max_detections=None,
+    )
+    return pred.num_objects
+
+
+def _naive_nms(bboxes, scores, conf_threshold, iou_threshold):
+    """画像毎・クラス毎にPythonでループする処理。"""
+    num_objects = 0
+    for image_bboxes, image_scores in zip(bboxes, scores):
+        for c in range(image_scores.shape[-1]):
+            ix = np.where(image_scores[:, c] >= conf_threshold)[0]
+            ix = ix[np.argsort(-image_scores[ix, c])]
+            while len(ix) > 0:
+                num_objects += 1
+                if len(ix) == 1:
+                    break
+                iou = tk.od.compute_iou(image_bboxes[ix[:1]], image_bboxes[ix[1:]])[0]
+                ix = ix[1:][iou <= iou_threshold]
+    return num_objects
+
+
+if __name__ == "__main__":
+    main()
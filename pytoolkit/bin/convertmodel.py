@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 """*.h5 を読んでONNXなどに変換するスクリプト。"""
 import argparse
+import importlib
 import os
 import pathlib
 import sys
+import time
 
+import numpy as np
 import tensorflow as tf
 
 try:
@@ -23,9 +26,27 @@ def main():
         description="hdf5/saved_model を読んでONNXなどに変換するスクリプト。"
     )
     parser.add_argument(
-        "mode", choices=("hdf5", "saved_model", "onnx", "tflite"), help="変換先の形式"
+        "mode",
+        choices=("hdf5", "saved_model", "onnx", "tflite", "tflite_int8"),
+        help="変換先の形式",
     )
     parser.add_argument("model_path", type=pathlib.Path, help="対象ファイルのパス(*.h5)")
+    parser.add_argument(
+        "--dataset",
+        type=pathlib.Path,
+        help="tflite_int8用。tk.utils.dumpしたtk.data.Datasetのパス。キャリブレーションと比較評価に使う。",
+    )
+    parser.add_argument(
+        "--data-loader",
+        default=None,
+        help="tflite_int8用。DataLoaderを返す関数またはクラスの名前。(例: mymodule:create_data_loader)",
+    )
+    parser.add_argument(
+        "--calibration-size", default=200, type=int, help="キャリブレーションに使う件数"
+    )
+    parser.add_argument(
+        "--eval-size", default=200, type=int, help="比較評価に使う件数 (キャリブレーションに使わなかったもの)"
+    )
     args = parser.parse_args()
 
     os.environ["CUDA_VISIBLE_DEVICES"] = "none"
@@ -42,14 +63,100 @@ def main():
         save_path = args.model_path.with_suffix(".onnx")
     elif args.mode == "tflite":
         save_path = args.model_path.with_suffix(".tflite")
+    elif args.mode == "tflite_int8":
+        save_path = args.model_path.with_suffix(".int8.tflite")
     else:
         raise ValueError(f"Invalid mode: {args.mode}")
 
-    tk.log.get(__name__).info(f"{save_path} Saving...")
-    tk.models.save(model, save_path, mode=args.mode)
+    if args.mode == "tflite_int8":
+        if args.dataset is None:
+            parser.error("--dataset is required for tflite_int8")
+        dataset = tk.utils.load(args.dataset)
+        data_loader = _create_data_loader(args.data_loader)
+        # キャリブレーション用と比較評価用に重複しないように分ける
+        indices = np.random.RandomState(123).permutation(len(dataset))
+        calibration_set = dataset.slice(indices[: args.calibration_size])
+        eval_set = dataset.slice(
+            indices[args.calibration_size : args.calibration_size + args.eval_size]
+        )
+
+        tk.log.get(__name__).info(f"{save_path} Saving...")
+        tk.models.save(
+            model,
+            save_path,
+            mode=args.mode,
+            representative_set=calibration_set,
+            representative_data_loader=data_loader,
+        )
+        if len(eval_set) > 1:
+            _report_quantization(model, save_path, eval_set, data_loader)
+    else:
+        tk.log.get(__name__).info(f"{save_path} Saving...")
+        tk.models.save(model, save_path, mode=args.mode)
 
     tk.log.get(__name__).info("Finished!")
 
 
+def _create_data_loader(name):
+    """--data-loaderの指定からDataLoaderを作る。"""
+    if name is None:
+        return tk.data.DataLoader()
+    module_name, attr_name = name.split(":", 1)
+    sys.path.insert(0, os.getcwd())
+    factory = getattr(importlib.import_module(module_name), attr_name)
+    return factory()
+
+
+def _report_quantization(model, tflite_path, eval_set, data_loader):
+    """floatのモデルと量子化したモデルの推論結果と1件あたりのレイテンシを比較してログ出力する。"""
+    X_list = list(
+        tk.models._representative_dataset(  # pylint: disable=protected-access
+            model, eval_set, data_loader
+        )
+    )
+    predictor = tk.models.load_predictor(tflite_path)
+
+    def _run_keras(X):
+        return np.asarray(model.predict_on_batch(X if len(X) > 1 else X[0]))
+
+    def _run_tflite(X):
+        pred = predictor.predict_on_batch(X)
+        assert isinstance(pred, np.ndarray), "multiple output is not supported"
+        return pred
+
+    results = {}
+    for name, fn in [("float", _run_keras), ("int8", _run_tflite)]:
+        fn(X_list[0])  # 初回の準備処理を除くため1回空打ちする
+        preds = []
+        start_time = time.perf_counter()
+        for X in X_list:
+            preds.append(fn(X))
+        elapsed = (time.perf_counter() - start_time) / len(X_list)
+        results[name] = (np.concatenate(preds, axis=0).astype(np.float32), elapsed)
+
+    pred_float, latency_float = results["float"]
+    pred_int8, latency_int8 = results["int8"]
+    abs_diff = np.abs(pred_float - pred_int8)
+    logger.info(f"samples:           {len(X_list)}")
+    logger.info(
+        f"latency:           float={latency_float * 1000:.2f}ms int8={latency_int8 * 1000:.2f}ms"
+        f" ({latency_int8 / latency_float - 1:+.1%})"
+    )
+    logger.info(
+        f"abs diff:          mean={abs_diff.mean():.4f} max={abs_diff.max():.4f}"
+    )
+    if pred_float.ndim == 2 and pred_float.shape[-1] > 1:
+        agreement = np.mean(pred_float.argmax(axis=-1) == pred_int8.argmax(axis=-1))
+        logger.info(f"argmax agreement:  {agreement:.1%}")
+        labels = eval_set.labels
+        if isinstance(labels, np.ndarray) and labels.shape == (len(X_list),):
+            acc_float = np.mean(pred_float.argmax(axis=-1) == labels)
+            acc_int8 = np.mean(pred_int8.argmax(axis=-1) == labels)
+            logger.info(
+                f"accuracy:          float={acc_float:.1%} int8={acc_int8:.1%}"
+                f" ({(acc_int8 - acc_float) * 100:+.2f}pt)"
+            )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,362 @@
+"""物体検出のbounding boxの後処理 (NMSなど)。
+
+いずれも全画像・全クラス分をまとめて処理し、tk.od.ObjectsPredictionsを返す。
+
+"""
+from __future__ import annotations
+
+import typing
+
+import numba
+import numpy as np
+
+import pytoolkit as tk
+
+
+def batched_nms(
+    bboxes: np.ndarray,
+    scores: np.ndarray,
+    conf_threshold: float = 0.01,
+    iou_threshold: float = 0.5,
+    max_detections: typing.Optional[int] = 100,
+    pre_nms_top_k: typing.Optional[int] = None,
+    class_agnostic: bool = False,
+) -> tk.od.ObjectsPredictions:
+    """検出器の出力(アンカー毎のbboxとクラス毎のスコア)からNMS済みの予測結果を作る。
+
+    Args:
+        bboxes: bounding box(x1, y1, x2, y2)。shapeは(画像数, box数, 4)
+        scores: クラス毎のスコア。shapeは(画像数, box数, クラス数)
+        conf_threshold: この値未満のスコアは候補にしない
+        iou_threshold: NMSのIoUの閾値
+        max_detections: 画像毎の最大検出数 (Noneなら無制限)
+        pre_nms_top_k: NMS前に画像毎にスコア上位何件に絞るか (Noneなら絞らない)
+        class_agnostic: クラスを区別せずにNMSするならTrue
+
+    Returns:
+        予測結果
+
+    """
+    predictions = select_candidates(bboxes, scores, conf_threshold)
+    if pre_nms_top_k is not None:
+        predictions = top_k(predictions, pre_nms_top_k)
+    predictions = nms(predictions, iou_threshold, class_agnostic=class_agnostic)
+    if max_detections is not None:
+        predictions = top_k(predictions, max_detections)
+    return predictions
+
+
+def select_candidates(
+    bboxes: np.ndarray, scores: np.ndarray, conf_threshold: float = 0.01
+) -> tk.od.ObjectsPredictions:
+    """検出器の出力から、スコアが閾値以上の(box, クラス)の組を取り出す。
+
+    Args:
+        bboxes: bounding box(x1, y1, x2, y2)。shapeは(画像数, box数, 4)
+        scores: クラス毎のスコア。shapeは(画像数, box数, クラス数)
+        conf_threshold: この値未満のスコアは候補にしない
+
+    """
+    bboxes = np.asarray(bboxes)
+    scores = np.asarray(scores)
+    assert bboxes.ndim == 3 and bboxes.shape[-1] == 4
+    assert scores.shape[:2] == bboxes.shape[:2]
+    images, boxes, classes = np.nonzero(scores >= conf_threshold)
+    counts = np.bincount(images, minlength=len(bboxes))
+    return tk.od.ObjectsPredictions(
+        offsets=np.concatenate([[0], np.cumsum(counts)]),
+        classes=classes.astype(np.int32),
+        confs=scores[images, boxes, classes],
+        bboxes=bboxes[images, boxes],
+    )
+
+
+def nms(
+    predictions: tk.od.ObjectsPredictions,
+    iou_threshold: float = 0.5,
+    class_agnostic: bool = False,
+) -> tk.od.ObjectsPredictions:
+    """全画像・全クラス分をまとめてNMSする。
+
+    Args:
+        predictions: 予測結果
+        iou_threshold: IoUがこの値より大きいboxを抑制する
+        class_agnostic: クラスを区別せずにNMSするならTrue
+
+    Returns:
+        予測結果 (画像毎に確信度の降順)
+
+    """
+    order, group_offsets = _sort_groups(predictions, class_agnostic)
+    keep = _nms_kernel(
+        np.ascontiguousarray(predictions.bboxes[order], dtype=np.float32),
+        group_offsets,
+        iou_threshold,
+    )
+    return _gather(predictions, order[keep])
+
+
+def soft_nms(
+    predictions: tk.od.ObjectsPredictions,
+    sigma: float = 0.5,
+    iou_threshold: float = 0.3,
+    method: str = "gaussian",
+    conf_threshold: float = 0.001,
+    class_agnostic: bool = False,
+) -> tk.od.ObjectsPredictions:
+    """Soft-NMS <https://arxiv.org/abs/1704.04503>
+
+    Args:
+        predictions: 予測結果
+        sigma: method="gaussian"のときの減衰の強さ
+        iou_threshold: method="linear"のとき、IoUがこの値より大きいboxの確信度を減衰させる
+        method: "gaussian" or "linear"
+        conf_threshold: 減衰後の確信度がこの値未満になったら除外する
+        class_agnostic: クラスを区別せずに処理するならTrue
+
+    Returns:
+        確信度を減衰させた予測結果 (画像毎に確信度の降順)
+
+    """
+    assert method in ("gaussian", "linear")
+    order, group_offsets = _sort_groups(predictions, class_agnostic)
+    confs = np.asarray(predictions.confs, dtype=np.float32)[order]
+    keep = _soft_nms_kernel(
+        np.ascontiguousarray(predictions.bboxes[order], dtype=np.float32),
+        confs,
+        group_offsets,
+        sigma,
+        iou_threshold,
+        method == "gaussian",
+        conf_threshold,
+    )
+    return _gather(predictions, order[keep], confs=confs[keep])
+
+
+def weighted_boxes_fusion(
+    predictions_list: typing.Sequence[tk.od.ObjectsPredictions],
+    weights: typing.Sequence[float] = None,
+    iou_threshold: float = 0.55,
+    conf_threshold: float = 0.0,
+    conf_type: str = "avg",
+) -> tk.od.ObjectsPredictions:
+    """Weighted Boxes Fusion <https://arxiv.org/abs/1910.13302>
+
+    複数モデルの予測結果を画像・クラス毎にクラスタリングし、確信度で重み付き平均したboxにする。
+
+    Args:
+        predictions_list: モデル毎の予測結果 (画像数は全て同じであること)
+        weights: モデル毎の重み (Noneなら全て1)
+        iou_threshold: 融合後のboxとのIoUがこの値より大きければ同じクラスタにする
+        conf_threshold: この値未満の確信度のboxは使わない
+        conf_type: 融合後の確信度の算出方法。
+                   "avg"ならクラスタ内の平均×min(クラスタ内のbox数, モデル数)÷重みの合計。
+                   "max"ならクラスタ内の最大÷重みの最大。
+
+    Returns:
+        予測結果 (画像毎に確信度の降順)
+
+    """
+    assert conf_type in ("avg", "max")
+    assert len(predictions_list) >= 1
+    num_images = len(predictions_list[0])
+    assert all(len(p) == num_images for p in predictions_list)
+    weights = np.ones((len(predictions_list),)) if weights is None else weights
+    weights = np.asarray(weights, dtype=np.float32)
+    assert weights.shape == (len(predictions_list),)
+
+    # 全モデル分を連結して、画像・クラス毎に確信度の降順に並べる
+    images = np.concatenate([p.image_indices for p in predictions_list])
+    classes = np.concatenate([p.classes for p in predictions_list])
+    confs = np.concatenate(
+        [np.asarray(p.confs, dtype=np.float32) for p in predictions_list]
+    )
+    bboxes = np.concatenate(
+        [np.asarray(p.bboxes, dtype=np.float32) for p in predictions_list]
+    ).reshape((-1, 4))
+    mask = confs >= conf_threshold
+    confs *= np.repeat(weights, [p.num_objects for p in predictions_list])
+    images, classes = images[mask], classes[mask]
+    confs, bboxes = confs[mask], bboxes[mask]
+    order = np.lexsort((-confs, classes, images))
+    group_offsets = _group_offsets(images[order], classes[order])
+
+    fused_bboxes, fused_confs, cluster_groups = _wbf_kernel(
+        np.ascontiguousarray(bboxes[order]),
+        np.ascontiguousarray(confs[order]),
+        group_offsets,
+        iou_threshold,
+        conf_type == "avg",
+        len(predictions_list),
+        float(weights.sum()),
+        float(weights.max()),
+    )
+    group_first = order[group_offsets[:-1][cluster_groups]]
+    result = tk.od.ObjectsPredictions(
+        offsets=np.searchsorted(images[group_first], np.arange(num_images + 1)),
+        classes=classes[group_first],
+        confs=fused_confs,
+        bboxes=fused_bboxes,
+    )
+    return _gather(result, _sort_by_conf(result))
+
+
+def top_k(predictions: tk.od.ObjectsPredictions, k: int) -> tk.od.ObjectsPredictions:
+    """画像毎に確信度の上位k件に絞る。
+
+    Returns:
+        予測結果 (画像毎に確信度の降順)
+
+    """
+    order = _sort_by_conf(predictions)
+    images = predictions.image_indices[order]
+    ranks = np.arange(len(order)) - predictions.offsets[images]
+    return _gather(predictions, order[ranks < k])
+
+
+def _sort_by_conf(predictions):
+    """画像毎に確信度の降順にするindexを返す。"""
+    return np.lexsort((-np.asarray(predictions.confs), predictions.image_indices))
+
+
+def _sort_groups(predictions, class_agnostic):
+    """(画像, クラス)毎に確信度の降順に並べるindexと、グループ毎の開始位置を返す。"""
+    images = predictions.image_indices
+    classes = (
+        np.zeros_like(images) if class_agnostic else np.asarray(predictions.classes)
+    )
+    order = np.lexsort((-np.asarray(predictions.confs), classes, images))
+    return order, _group_offsets(images[order], classes[order])
+
+
+def _group_offsets(images, classes):
+    """(画像, クラス)順に並んだ配列から、グループ毎の開始位置(末尾に終端を含む)を返す。"""
+    changed = (images[1:] != images[:-1]) | (classes[1:] != classes[:-1])
+    return np.concatenate([[0], np.where(changed)[0] + 1, [len(images)]]).astype(
+        np.int64
+    )
+
+
+def _gather(predictions, index, confs=None):
+    """indexの物体だけを残し、画像毎に確信度の降順に並べたObjectsPredictionsを返す。"""
+    images = predictions.image_indices[index]
+    confs = np.asarray(predictions.confs)[index] if confs is None else confs
+    order = np.lexsort((-confs, images))
+    return tk.od.ObjectsPredictions(
+        offsets=np.searchsorted(images[order], np.arange(len(predictions) + 1)),
+        classes=np.asarray(predictions.classes)[index][order],
+        confs=confs[order],
+        bboxes=np.asarray(predictions.bboxes)[index][order],
+    )
+
+
+@numba.njit(fastmath=True, nogil=True)
+def _iou(a, b):
+    """2個のboxのIoU。"""
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter)
+
+
+@numba.njit(fastmath=True, nogil=True)
+def _nms_kernel(bboxes, group_offsets, iou_threshold):
+    """グループ毎(確信度の降順)の貪欲NMS。"""
+    keep = np.ones(len(bboxes), dtype=np.bool_)
+    for g in range(len(group_offsets) - 1):
+        for i in range(group_offsets[g], group_offsets[g + 1]):
+            if not keep[i]:
+                continue
+            for j in range(i + 1, group_offsets[g + 1]):
+                if keep[j] and _iou(bboxes[i], bboxes[j]) > iou_threshold:
+                    keep[j] = False
+    return keep
+
+
+@numba.njit(fastmath=True, nogil=True)
+def _soft_nms_kernel(
+    bboxes, confs, group_offsets, sigma, iou_threshold, gaussian, conf_threshold
+):
+    """グループ毎のSoft-NMS。confsは減衰後の値に更新される。"""
+    keep = np.zeros(len(bboxes), dtype=np.bool_)
+    active = np.ones(len(bboxes), dtype=np.bool_)
+    for g in range(len(group_offsets) - 1):
+        start, end = group_offsets[g], group_offsets[g + 1]
+        for _ in range(end - start):
+            # 残っている中で確信度最大のものを確定
+            best = -1
+            for i in range(start, end):
+                if active[i] and (best < 0 or confs[i] > confs[best]):
+                    best = i
+            if best < 0:
+                break
+            active[best] = False
+            keep[best] = True
+            # 残りを減衰
+            for i in range(start, end):
+                if not active[i]:
+                    continue
+                iou = _iou(bboxes[best], bboxes[i])
+                if gaussian:
+                    confs[i] *= np.exp(-(iou * iou) / sigma)
+                elif iou > iou_threshold:
+                    confs[i] *= 1 - iou
+                if confs[i] < conf_threshold:
+                    active[i] = False
+    return keep
+
+
+@numba.njit(fastmath=True, nogil=True)
+def _wbf_kernel(
+    bboxes,
+    confs,
+    group_offsets,
+    iou_threshold,
+    conf_avg,
+    num_models,
+    weights_sum,
+    weights_max,
+):
+    """グループ毎(確信度の降順)のWeighted Boxes Fusion。"""
+    n = len(bboxes)
+    fused = np.zeros((n, 4), dtype=np.float32)
+    coord_sums = np.zeros((n, 4), dtype=np.float32)
+    conf_sums = np.zeros(n, dtype=np.float32)
+    conf_maxs = np.zeros(n, dtype=np.float32)
+    counts = np.zeros(n, dtype=np.int64)
+    cluster_groups = np.zeros(n, dtype=np.int64)
+    num_clusters = 0
+    for g in range(len(group_offsets) - 1):
+        first_cluster = num_clusters
+        for i in range(group_offsets[g], group_offsets[g + 1]):
+            best = -1
+            best_iou = iou_threshold
+            for c in range(first_cluster, num_clusters):
+                iou = _iou(fused[c], bboxes[i])
+                if iou > best_iou:
+                    best = c
+                    best_iou = iou
+            if best < 0:
+                best = num_clusters
+                cluster_groups[best] = g
+                num_clusters += 1
+            coord_sums[best] += confs[i] * bboxes[i]
+            conf_sums[best] += confs[i]
+            conf_maxs[best] = max(conf_maxs[best], confs[i])
+            counts[best] += 1
+            if conf_sums[best] > 0:
+                fused[best] = coord_sums[best] / conf_sums[best]
+            else:
+                fused[best] = bboxes[i]
+    result_confs = np.zeros(num_clusters, dtype=np.float32)
+    for c in range(num_clusters):
+        if conf_avg:
+            conf = conf_sums[c] / counts[c]
+            result_confs[c] = conf * min(counts[c], num_models) / weights_sum
+        else:
+            result_confs[c] = conf_maxs[c] / weights_max
+    return fused[:num_clusters], result_confs, cluster_groups[:num_clusters]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import pytoolkit as tk
+
+
+def _naive_nms(bboxes, scores, conf_threshold, iou_threshold):
+    """画像毎・クラス毎にループする素朴なNMS。"""
+    results = []
+    for image_bboxes, image_scores in zip(bboxes, scores):
+        classes, confs, boxes = [], [], []
+        for c in range(image_scores.shape[-1]):
+            ix = np.where(image_scores[:, c] >= conf_threshold)[0]
+            ix = ix[np.argsort(-image_scores[ix, c], kind="mergesort")]
+            while len(ix) > 0:
+                classes.append(c)
+                confs.append(image_scores[ix[0], c])
+                boxes.append(image_bboxes[ix[0]])
+                if len(ix) == 1:
+                    break
+                iou = tk.od.compute_iou(image_bboxes[ix[:1]], image_bboxes[ix[1:]])[0]
+                ix = ix[1:][iou <= iou_threshold]
+        results.append((np.array(classes), np.array(confs), np.array(boxes)))
+    return results
+
+
+def test_batched_nms():
+    rng = np.random.RandomState(123)
+    xy = rng.uniform(0, 0.8, size=(8, 200, 2))
+    wh = rng.uniform(0.05, 0.2, size=(8, 200, 2))
+    bboxes = np.concatenate([xy, xy + wh], axis=-1).astype(np.float32)
+    scores = rng.uniform(0, 1, size=(8, 200, 3)).astype(np.float32)
+
+    pred = tk.boxes.batched_nms(
+        bboxes, scores, conf_threshold=0.5, iou_threshold=0.45, max_detections=None
+    )
+    expected = _naive_nms(bboxes, scores, conf_threshold=0.5, iou_threshold=0.45)
+    assert len(pred) == 8
+    for p, (classes, confs, boxes) in zip(pred, expected):
+        order = np.lexsort((classes, -confs))
+        assert p.classes == pytest.approx(classes[order])
+        assert p.confs == pytest.approx(confs[order])
+        assert p.bboxes == pytest.approx(boxes[order])
+
+    pred = tk.boxes.batched_nms(bboxes, scores, max_detections=10)
+    assert (np.diff(pred.offsets) == 10).all()
+
+
+def test_soft_nms():
+    pred = tk.od.ObjectsPredictions(
+        offsets=[0, 3],
+        classes=[0, 0, 0],
+        confs=[0.9, 0.8, 0.7],
+        bboxes=[[0, 0, 0.5, 0.5], [0, 0, 0.5, 0.5], [0.6, 0.6, 1, 1]],
+    )
+    result = tk.boxes.soft_nms(pred, method="linear", iou_threshold=0.3)
+    assert result.confs == pytest.approx([0.9, 0.7])  # 完全一致は0まで減衰
+    result = tk.boxes.soft_nms(pred, sigma=0.5)
+    assert result.confs == pytest.approx([0.9, 0.7, 0.8 * np.exp(-2)])
+
+
+def test_weighted_boxes_fusion():
+    pred1 = tk.od.ObjectsPredictions(
+        offsets=[0, 2], classes=[0, 1], confs=[0.8, 0.5], bboxes=[[0, 0, 0.4, 0.4]] * 2
+    )
+    pred2 = tk.od.ObjectsPredictions(
+        offsets=[0, 1], classes=[0], confs=[0.4], bboxes=[[0.02, 0.02, 0.42, 0.42]]
+    )
+    result = tk.boxes.weighted_boxes_fusion([pred1, pred2])
+    assert (result.classes == [0, 1]).all()
+    assert result.confs == pytest.approx([0.6, 0.25])
+    assert result.bboxes[0] == pytest.approx(
+        [0.02 / 3, 0.02 / 3, 0.4 + 0.02 / 3, 0.4 + 0.02 / 3]
+    )
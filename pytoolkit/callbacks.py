@@ -1,6 +1,11 @@
 """DeepLearning(主にKeras)関連。"""
+import concurrent.futures
+import os
 import pathlib
+import random
+import shutil
 import time
+import zlib
 
 import numpy as np
 import tensorflow as tf
@@ -128,22 +133,134 @@ class EpochLogger(tf.keras.callbacks.Callback):
             )
 
 
+class Validation(tf.keras.callbacks.Callback):
+    """model.fitの代わりに検証を行うcallback。
+
+    検証結果はlogsに追加するので、他のcallbackより前に置く必要がある。
+    (tk.models.fitのvalidation_freq="adaptive"やexact_validation=Trueで使われる)
+
+    Args:
+        evaluate_fn: 検証を行い、"val_"付きのメトリクス名と値のdictを返す関数
+        validation_freq: 検証を行うエポック数の間隔、またはエポック数のリスト。最後のエポックは常に検証する。
+
+    """
+
+    def __init__(self, evaluate_fn, validation_freq=1):
+        super().__init__()
+        self.evaluate_fn = evaluate_fn
+        self.validation_freq = validation_freq
+        self.val_time = 0.0
+        self.val_cost = None
+        self.validated_epochs = []
+
+    def on_train_begin(self, logs=None):
+        del logs
+        self.val_time = 0.0
+        self.val_cost = None
+        self.validated_epochs = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self._should_validate(epoch):
+            return
+        start_time = time.perf_counter()
+        evals = self.evaluate_fn()
+        self.val_cost = time.perf_counter() - start_time
+        self.val_time += self.val_cost
+        self.validated_epochs.append(epoch + 1)
+        if logs is not None:
+            logs.update(evals)
+
+    def _should_validate(self, epoch):
+        """検証するか否かを返す。"""
+        if epoch + 1 >= self.params["epochs"]:
+            return True  # 最後は常に検証
+        if isinstance(self.validation_freq, int):
+            return (epoch + 1) % self.validation_freq == 0
+        return epoch + 1 in self.validation_freq
+
+
+class AdaptiveValidation(Validation):
+    """実測した時間に応じて検証するエポックを決めるcallback。
+
+    最初のエポックで検証して時間を測り、以降は検証にかかる時間が全体のmax_time_ratio以下に
+    収まるエポックだけ検証する。最後のエポックは常に検証する。
+    (tk.models.fitのvalidation_freq="adaptive"で使われる)
+
+    Args:
+        evaluate_fn: 検証を行い、"val_"付きのメトリクス名と値のdictを返す関数
+        max_time_ratio: 学習全体の時間に対する検証の時間の割合の上限
+
+    """
+
+    def __init__(self, evaluate_fn, max_time_ratio=0.1):
+        super().__init__(evaluate_fn)
+        self.max_time_ratio = max_time_ratio
+        self.train_time = 0.0
+        self.epoch_start_time = None
+
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        self.train_time = 0.0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        del epoch, logs
+        self.epoch_start_time = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        assert self.epoch_start_time is not None
+        self.train_time += time.perf_counter() - self.epoch_start_time
+        super().on_epoch_end(epoch, logs)
+
+    def _should_validate(self, epoch):
+        # Horovod使用時は全ワーカーで揃える必要があるのでrank 0の判断に従う
+        return tk.hvd.bcast(self._should_validate_local(epoch))
+
+    def _should_validate_local(self, epoch):
+        if epoch + 1 >= self.params["epochs"]:
+            return True  # 最後は常に検証
+        if self.val_cost is None:
+            return True  # 時間の計測のために検証
+        val_time = self.val_time + self.val_cost
+        return val_time <= self.max_time_ratio * (self.train_time + val_time)
+
+
 class Checkpoint(tf.keras.callbacks.Callback):
     """学習中に定期的に保存する。
 
-    速度重視でinclude_optimizerはFalse固定。
+    速度重視でinclude_optimizerはFalse固定。(tk.models.loadなどで読み込める)
+    async_save=Trueの場合は重みをホストメモリにコピーし、バックグラウンドのスレッドで
+    tf.keras.models.clone_model()で作った複製に設定してから保存するので、保存中も学習は止まらない。
+    (複製の分だけメモリを余分に使う。複製できないモデルの場合は同期で保存する)
+    書き込みは一時ファイルに書いてからrenameするので、途中で強制終了しても中途半端なファイルは残らない。
 
     Args:
         checkpoint_path: 保存先パス
         checkpoints: 保存する回数。epochs % (checkpoints + 1) == 0だとキリのいい感じになる。
+        keep: 残すチェックポイントの数。2以上なら古いものを"{stem}.1{suffix}"、"{stem}.2{suffix}"…として残す。
+        async_save: バックグラウンドで書き込むならTrue
+        weights_only: 重みのみ(HDF5形式)を保存するならTrue。(tk.models.load_weightsなどで読み込む)
 
     """
 
-    def __init__(self, checkpoint_path, checkpoints=3):
+    def __init__(
+        self,
+        checkpoint_path,
+        checkpoints=3,
+        keep=1,
+        async_save=True,
+        weights_only=False,
+    ):
         super().__init__()
+        assert keep >= 1
         self.checkpoint_path = pathlib.Path(checkpoint_path)
         self.checkpoints = checkpoints
+        self.keep = keep
+        self.async_save = async_save
+        self.weights_only = weights_only
         self.target_epochs = {}
+        self._executor = None
+        self._future = None
+        self._shadow_model = None
 
     def on_train_begin(self, logs=None):
         del logs
@@ -152,14 +269,200 @@ class Checkpoint(tf.keras.callbacks.Callback):
 
     def on_epoch_begin(self, epoch, logs=None):
         del logs
-        if epoch in self.target_epochs:
-            if tk.hvd.is_master():
-                tk.log.get(__name__).info(
-                    f"Epoch {epoch}: Saving model to {self.checkpoint_path}"
+        if epoch in self.target_epochs and tk.hvd.is_master():
+            tk.log.get(__name__).info(
+                f"Epoch {epoch}: Saving model to {self.checkpoint_path}"
+            )
+            self.save()
+
+    def on_train_end(self, logs=None):
+        del logs
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._shadow_model = None
+        tk.hvd.barrier()
+
+    def save(self):
+        """保存する。(async_save=Trueなら重みをホストメモリにコピーしてバックグラウンドで書き込む)"""
+        # 前回の書き込みが終わっていなければ待つ (メモリ上のコピーは最大2世代まで)
+        self.wait()
+        if self.async_save and self._get_shadow_model() is not None:
+            weights = self.model.get_weights()
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(1)
+            self._future = self._executor.submit(self._write, weights)
+        else:
+            self._write(None)
+
+    def wait(self):
+        """バックグラウンドの書き込みの完了を待つ。(失敗していたら例外を投げる)"""
+        if self._future is not None:
+            future, self._future = self._future, None
+            future.result()
+
+    def _get_shadow_model(self):
+        """バックグラウンドでの保存用のモデルの複製を返す。(複製できなければNone)"""
+        if self._shadow_model is None:
+            try:
+                self._shadow_model = tf.keras.models.clone_model(self.model)
+            except Exception:  # pylint: disable=broad-except
+                tk.log.get(__name__).warning(
+                    "Failed to clone the model. Checkpoints are saved synchronously.",
+                    exc_info=True,
                 )
-                self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
-                self.model.save(str(self.checkpoint_path))
-            tk.hvd.barrier()
+                self.async_save = False
+        return self._shadow_model
+
+    def _write(self, weights):
+        """一時ファイルに保存してから、古いものをずらしてrenameする。
+
+        保存先パスのファイルは常に存在するように、現在のものはハードリンク(不可ならコピー)で
+        ".1"にしてから一時ファイルをrenameする。
+
+        Args:
+            weights: model.get_weights()の結果。Noneならself.modelをそのまま保存する。
+
+        """
+        path = self.checkpoint_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 拡張子で保存形式が決まるので拡張子は残す
+        temp_path = path.with_name(f".{path.stem}.tmp{path.suffix}")
+        _remove(temp_path)
+        if weights is None:
+            model = self.model
+        else:
+            model = self._shadow_model
+            model.set_weights(weights)
+        if self.weights_only:
+            model.save_weights(str(temp_path), save_format="h5")
+        else:
+            model.save(str(temp_path), include_optimizer=False)
+        if path.exists() and self.keep >= 2:
+            for i in range(self.keep - 1, 1, -1):
+                src = path.with_name(f"{path.stem}.{i - 1}{path.suffix}")
+                if src.exists():
+                    _replace(src, path.with_name(f"{path.stem}.{i}{path.suffix}"))
+            prev_path = path.with_name(f".{path.stem}.prev.tmp{path.suffix}")
+            _remove(prev_path)
+            if path.is_dir():
+                shutil.copytree(path, prev_path)  # SavedModel形式
+            else:
+                try:
+                    os.link(path, prev_path)
+                except OSError:
+                    shutil.copy2(path, prev_path)
+            _replace(prev_path, path.with_name(f"{path.stem}.1{path.suffix}"))
+        _replace(temp_path, path)
+
+
+def _remove(path):
+    """ファイルまたはディレクトリがあれば削除する。"""
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def _replace(src, dst):
+    """os.replaceのディレクトリ(SavedModel形式)対応版。"""
+    if src.is_dir():
+        _remove(dst)
+    os.replace(src, dst)
+
+
+class ResumeCheckpoint(tf.keras.callbacks.Callback):
+    """途中再開用に学習の全状態を定期的に保存する。(プリエンプション対策)
+
+    モデル・optimizerの状態・エポック数・乱数の状態をtf.train.CheckpointManagerで保存し、
+    restore()で最新のものを読み込む。データの読み込み位置は、
+    seed(保存先から決まる固定値)と再開エポック数からtk.data.DataLoader.iterで再現する。
+    (tk.models.fitのresume_dirを指定すると自動的に使われる)
+
+    Horovod使用時は全ワーカーから読み込める場所を保存先にする必要がある。
+
+    Args:
+        resume_dir: 保存先ディレクトリ
+        freq: 保存するエポック数の間隔
+        max_to_keep: 残す数
+
+    """
+
+    def __init__(self, resume_dir, freq=1, max_to_keep=2):
+        super().__init__()
+        self.resume_dir = pathlib.Path(resume_dir)
+        self.freq = freq
+        self.max_to_keep = max_to_keep
+        # データのシャッフル用のseed (再開時も同じ並び順にするため保存先から決める)
+        self.seed = zlib.crc32(str(self.resume_dir.resolve()).encode("utf-8")) % (
+            2 ** 31
+        )
+        self._epoch = None
+        self._manager = None
+
+    def restore(self, model) -> int:
+        """最新の保存状態を読み込む。
+
+        Args:
+            model: 対象のモデル (compile済みのもの)
+
+        Returns:
+            保存時点のエポック数 (保存されたものが無ければ0)
+
+        """
+        self._epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        checkpoint = tf.train.Checkpoint(
+            model=model,
+            optimizer=model.optimizer,
+            epoch=self._epoch,
+            rng=tf.random.experimental.get_global_generator(),
+        )
+        self._manager = tf.train.CheckpointManager(
+            checkpoint, str(self.resume_dir), max_to_keep=self.max_to_keep
+        )
+        latest = self._manager.latest_checkpoint
+        if latest is None:
+            return 0
+        with tk.log.trace_scope(f"resume({latest})"):
+            checkpoint.restore(latest).expect_partial()
+            state = tk.utils.load(f"{latest}.state.pkl", skip_not_exist=True)
+            if state is not None:
+                np.random.set_state(state["numpy"])
+                random.setstate(state["random"])
+        epoch = int(K.get_value(self._epoch))
+        tk.log.get(__name__).info(f"Resuming from epoch {epoch}")
+        return epoch
+
+    def on_epoch_end(self, epoch, logs=None):
+        del logs
+        if (epoch + 1) % self.freq == 0 and tk.hvd.is_master():
+            self.save(epoch + 1)
+
+    def save(self, epoch: int):
+        """全状態の保存。
+
+        Args:
+            epoch: 完了したエポック数
+
+        """
+        assert self._manager is not None, "restore() has not been called"
+        self.resume_dir.mkdir(parents=True, exist_ok=True)
+        # tf.train.Checkpointで保存できない乱数の状態は、チェックポイントの保存前に別途保存する
+        # (チェックポイントの保存中に中断しても、前回のものが使われるだけになるように)
+        state_path = self.resume_dir / f"ckpt-{epoch}.state.pkl"
+        temp_path = state_path.with_name(f".{state_path.name}.tmp")
+        tk.utils.dump(
+            {"numpy": np.random.get_state(), "random": random.getstate()}, temp_path
+        )
+        os.replace(temp_path, state_path)
+        self._epoch.assign(epoch)
+        self._manager.save(checkpoint_number=epoch)
+        # 消されたチェックポイントの分を消す
+        alive = {f"{c}.state.pkl" for c in self._manager.checkpoints}
+        for p in self.resume_dir.glob("ckpt-*.state.pkl"):
+            if str(p) not in alive and p != state_path:
+                p.unlink()
 
 
 class ErrorOnNaN(tf.keras.callbacks.Callback):
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import pytoolkit as tk
+
+
+@pytest.mark.parametrize("async_save", [True, False])
+def test_checkpoint(tmpdir, async_save):
+    checkpoint_path = tmpdir / "checkpoint.h5"
+    X = np.random.uniform(size=(16, 3)).astype(np.float32)
+    y = X.sum(axis=-1, keepdims=True)
+
+    inputs = x = tf.keras.layers.Input((3,))
+    x = tf.keras.layers.Dense(4)(x)
+    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.Dense(1)(x)
+    model = tf.keras.models.Model(inputs, x)
+    model.compile("sgd", "mse")
+    checkpoint = tk.callbacks.Checkpoint(
+        checkpoint_path, checkpoints=3, keep=2, async_save=async_save
+    )
+    model.fit(X, y, epochs=8, verbose=0, callbacks=[checkpoint])
+
+    # 最後の2回分だけ残る
+    assert checkpoint_path.exists()
+    assert (tmpdir / "checkpoint.1.h5").exists()
+    assert not (tmpdir / "checkpoint.2.h5").exists()
+    assert not (tmpdir / ".checkpoint.tmp.h5").exists()
+    assert not (tmpdir / ".checkpoint.prev.tmp.h5").exists()
+
+    # model.saveしたものと同様に読み込める
+    checkpoint.save()
+    checkpoint.wait()
+    expected = model.predict(X)
+    model2 = tk.models.load(checkpoint_path)
+    assert model2.predict(X) == pytest.approx(expected, abs=1e-6)
+
+
+@pytest.mark.parametrize("weights_only", [False, True])
+def test_checkpoint_nested(tmpdir, weights_only):
+    checkpoint_path = tmpdir / "checkpoint.h5"
+    X = np.random.uniform(size=(16, 3)).astype(np.float32)
+    y = X.sum(axis=-1, keepdims=True)
+
+    def create_model():
+        # BatchNormalizationを含むサブモデルを入れ子にする (重みの並び順の確認用)
+        sub_inputs = x = tf.keras.layers.Input((3,))
+        x = tf.keras.layers.Dense(4)(x)
+        x = tf.keras.layers.BatchNormalization()(x)
+        sub_model = tf.keras.models.Model(sub_inputs, x, name="sub")
+        inputs = x = tf.keras.layers.Input((3,))
+        x = sub_model(x)
+        x = tf.keras.layers.BatchNormalization()(x)
+        x = tf.keras.layers.Dense(1)(x)
+        return tf.keras.models.Model(inputs, x)
+
+    model = create_model()
+    model.compile("sgd", "mse")
+    checkpoint = tk.callbacks.Checkpoint(
+        checkpoint_path, checkpoints=1, weights_only=weights_only
+    )
+    model.fit(X, y, epochs=2, verbose=0, callbacks=[checkpoint])
+    checkpoint.save()
+    checkpoint.wait()
+    expected = model.predict(X)
+
+    if weights_only:
+        model2 = create_model()
+        tk.models.load_weights(model2, checkpoint_path)
+    else:
+        model2 = tk.models.load(checkpoint_path)
+    assert model2.predict(X) == pytest.approx(expected, abs=1e-6)
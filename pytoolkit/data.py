@@ -143,7 +143,17 @@ class Dataset:
             return None
         elif isinstance(d, dict):
             return {k: cls.copy_field(v) for k, v in d.items()}
-        assert isinstance(d, (list, np.ndarray, pd.Series, pd.DataFrame))
+        assert isinstance(
+            d,
+            (
+                list,
+                np.ndarray,
+                pd.Series,
+                pd.DataFrame,
+                tk.od.ObjectsAnnotations,
+                tk.od.ObjectsPredictions,
+            ),
+        )
         return d.copy()
 
     @classmethod
@@ -164,6 +174,9 @@ class Dataset:
                 # pd.concatでdtype=categoryが外れる列があるので再設定
                 c[category_columns] = c[category_columns].astype("category")
             return c
+        elif isinstance(a, (tk.od.ObjectsAnnotations, tk.od.ObjectsPredictions)):
+            assert isinstance(b, type(a))
+            return type(a).concat(a, b)
         assert isinstance(a, np.ndarray) and isinstance(b, np.ndarray)
         return np.concatenate([a, b], axis=0)
 
@@ -206,6 +219,9 @@ class DataLoader:
         without_label: bool = False,
         use_horovod: bool = False,
         num_replicas_in_sync: int = 1,
+        seed: int = None,
+        initial_epoch: int = 0,
+        with_weights: bool = False,
     ) -> Iterator:
         """Iteratorを作成する。
 
@@ -215,19 +231,37 @@ class DataLoader:
             without_label: ラベルを使わない場合(predict)、Trueを指定する。
             use_horovod: 1エポックあたりのミニバッチ数(__len__の戻り値)の算出にHorovodを考慮するか否か。
             num_replicas_in_sync: tf.distribute使用時の並列数(バッチサイズに掛け算する)
+            seed: シャッフルの乱数のseed。(同じseedなら同じ並び順になる)
+            initial_epoch: シャッフル時、このエポック数分のデータを読み飛ばした位置から開始する。
+                           (途中再開用。seedと合わせて指定すると中断前の続きのデータになる)
+            with_weights: Trueならdataset.weightsをsample_weightとして(X, y, sample_weight)を返す。
+                          (評価用。shuffleとdata_per_sample=2には未対応)
 
         Returns:
             Iterator
 
         """
         assert len(dataset) > 1
-        ds = self.get_ds(dataset, shuffle, without_label, num_replicas_in_sync)
         bs = (
             self.batch_size
             * (tk.hvd.size() if use_horovod else 1)
             * num_replicas_in_sync
         )
         steps = -(-len(dataset) // bs)
+        kwargs: dict = {}
+        if seed is not None:
+            kwargs["seed"] = seed
+        if initial_epoch > 0:
+            assert shuffle
+            kwargs["skip"] = (
+                initial_epoch * steps * self.batch_size * num_replicas_in_sync
+            )
+        if with_weights:
+            assert dataset.weights is not None
+            kwargs["weights"] = dataset.weights
+        ds = self.get_ds(
+            dataset, shuffle, without_label, num_replicas_in_sync, **kwargs
+        )
         return Iterator(ds=ds, data_size=len(dataset), steps=steps)
 
     def get_ds(
@@ -236,8 +270,22 @@ class DataLoader:
         shuffle: bool,
         without_label: bool,
         num_replicas_in_sync: int,
+        seed: int = None,
+        skip: int = 0,
+        weights: np.ndarray = None,
     ) -> tf.data.Dataset:
-        """tf.data.Datasetを作る。"""
+        """tf.data.Datasetを作る。
+
+        Args:
+            dataset: データセット
+            shuffle: シャッフルするのか否か
+            without_label: ラベルを使わない場合(predict)、Trueを指定する。
+            num_replicas_in_sync: tf.distribute使用時の並列数(バッチサイズに掛け算する)
+            seed: シャッフルの乱数のseed
+            skip: シャッフル時に先頭から読み飛ばすサンプル数 (get_dataなどは呼ばずにindexの段階で読み飛ばす)
+            weights: サンプル毎のsample_weight。指定した場合は(X, y, sample_weight)を返す。
+
+        """
         # 試しに1件呼び出してdtypeやshapeを推定 (ダサいが…)
         exsample_data = self.get_data(dataset, 0)
         exsample_sample = self.get_sample(
@@ -311,24 +359,41 @@ class DataLoader:
                 return sample[0]
             return sample
 
+        def shuffle_indices(ds, i):
+            # シャッフル時はバッチサイズを固定するため先にrepeat
+            # (途中再開用の読み飛ばしもget_dataなどを呼ばずに済むようにindexの段階で行う)
+            ds = ds.shuffle(
+                buffer_size=len(dataset), seed=None if seed is None else seed + i
+            )
+            ds = ds.repeat()
+            return ds.skip(skip) if skip > 0 else ds
+
         ds = tf.data.Dataset.from_tensor_slices(np.arange(len(dataset)))
         num_parallel_calls = tf.data.experimental.AUTOTUNE if self.parallel else None
         if self.data_per_sample == 2:  # 挙動が複雑なので2のみ許可
             ds = tf.data.Dataset.zip(
                 tuple(
-                    (ds.shuffle(buffer_size=len(dataset)) if shuffle else ds).map(
+                    (shuffle_indices(ds, i) if shuffle else ds).map(
                         process1, num_parallel_calls=num_parallel_calls,
                     )
-                    for _ in range(self.data_per_sample)
+                    for i in range(self.data_per_sample)
                 )
             )
             ds = ds.map(process2_2)
         else:
             assert self.data_per_sample == 1  # 挙動が複雑なので1のみ許可
-            ds = ds.shuffle(buffer_size=len(dataset)) if shuffle else ds
+            ds = shuffle_indices(ds, 0) if shuffle else ds
             ds = ds.map(process1, num_parallel_calls=num_parallel_calls)
             ds = ds.map(process2_1)
-        ds = ds.repeat() if shuffle else ds  # シャッフル時はバッチサイズを固定するため先にrepeat
+        if weights is not None:
+            # 並び順を変えない場合のみなので、そのままzipする
+            assert not shuffle and not without_label and self.data_per_sample == 1
+            assert len(weights) == len(dataset)
+            weights_ds = tf.data.Dataset.from_tensor_slices(
+                np.asarray(weights, dtype=np.float32)
+            )
+            ds = tf.data.Dataset.zip((ds, weights_ds))
+            ds = ds.map(lambda sample, w: (sample[0], sample[1], w))
         ds = ds.batch(self.batch_size * num_replicas_in_sync)
         ds = ds.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
         return ds
@@ -1,6 +1,7 @@
 """結果の評価関連。"""
 # pylint: skip-file
 
+from .bootstrap import *
 from .classification import *
 from .core import *
 from .od import *
@@ -0,0 +1,272 @@
+"""ブートストラップ法による評価指標の信頼区間。"""
+from __future__ import annotations
+
+import typing
+
+import joblib
+import numpy as np
+import scipy.sparse
+import sklearn.utils.multiclass
+
+import pytoolkit as tk
+
+from .core import _safe_div
+
+
+def evaluate_bootstrap(
+    y_true: np.ndarray,
+    y_pred: np.ndarray,
+    metrics: typing.Union[
+        str, typing.Callable[[np.ndarray, np.ndarray], tk.evaluations.EvalsType]
+    ] = "classification",
+    n_bootstrap: int = 1000,
+    confidence: float = 0.95,
+    average: str = "macro",
+    random_state: int = None,
+    n_jobs: int = -1,
+) -> tk.evaluations.EvalsType:
+    """ブートストラップ法で評価指標の信頼区間を算出する。
+
+    リサンプリングはサンプル毎の出現回数の行列としてまとめて作り、
+    "classification"と"regression"の主な指標はリサンプリングの軸で一括計算する。
+    それ以外(多クラス分類のAUC・APや任意の評価関数)はプロセスプールで並列に計算する。
+
+    Args:
+        y_true: ラベル
+        y_pred: 推論結果
+        metrics: "classification"、"regression"、または評価関数。
+                 評価関数はy_trueとy_predを受け取ってevalsを返すもの。
+                 (例: tk.evaluations.evaluate_classification。ただし要pickle化)
+        n_bootstrap: リサンプリング回数
+        confidence: 信頼係数
+        average: 多クラス分類の場合の平均の取り方。("macro", "weighted")
+        random_state: 乱数のseed
+        n_jobs: プロセスプールの並列数
+
+    Returns:
+        指標毎の信頼区間の下限と上限のndarray。tk.evaluations.to_strなどで表示できる。
+
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    assert len(y_true) == len(y_pred)
+    if metrics == "classification":
+        vectorized_fn, expensive_fn = _classification_fns(y_true, y_pred, average)
+    elif metrics == "regression":
+        vectorized_fn, expensive_fn = _regression_fns(y_true, y_pred)
+    else:
+        assert callable(metrics)
+        vectorized_fn, expensive_fn = None, metrics
+
+    values: typing.Dict[str, list] = {}
+    with joblib.Parallel(n_jobs=n_jobs) as parallel:
+        for counts in _bootstrap_counts(len(y_true), n_bootstrap, random_state):
+            if vectorized_fn is not None:
+                for k, v in vectorized_fn(counts).items():
+                    values.setdefault(k, []).extend(v)
+            if expensive_fn is not None:
+                evals_list = parallel(
+                    joblib.delayed(_evaluate_resampled)(expensive_fn, y_true, y_pred, c)
+                    for c in counts
+                )
+                for evals in evals_list:
+                    for k, v in evals.items():
+                        values.setdefault(k, []).append(v)
+
+    alpha = (1 - confidence) / 2
+    return {
+        k: np.nanquantile(np.asarray(v, dtype=np.float64), [alpha, 1 - alpha], axis=0)
+        for k, v in values.items()
+    }
+
+
+def _bootstrap_counts(
+    num_samples: int, n_bootstrap: int, random_state: typing.Optional[int]
+) -> typing.Iterator[np.ndarray]:
+    """リサンプリング結果をサンプル毎の出現回数の行列(リサンプリング回数, サンプル数)で返す。
+
+    メモリを使いすぎないように、ある程度の回数ずつまとめて返す。
+
+    """
+    random_state = np.random.RandomState(random_state)
+    batch_size = max(1, min(n_bootstrap, 2 ** 24 // max(num_samples, 1)))
+    for start in range(0, n_bootstrap, batch_size):
+        size = min(batch_size, n_bootstrap - start)
+        indices = random_state.randint(0, num_samples, size=(size, num_samples))
+        indices += np.arange(size)[:, np.newaxis] * num_samples
+        yield np.bincount(indices.ravel(), minlength=size * num_samples).reshape(
+            (size, num_samples)
+        )
+
+
+def _evaluate_resampled(metrics_fn, y_true, y_pred, counts):
+    """出現回数に従ってリサンプリングして評価する。(プロセスプール用)"""
+    indices = np.repeat(np.arange(len(counts)), counts)
+    evals = metrics_fn(y_true[indices], y_pred[indices])
+    return {
+        k: v
+        for k, v in evals.items()
+        if isinstance(v, (int, float, np.number, np.ndarray))
+    }
+
+
+def _classification_fns(y_true, proba_pred, average):
+    """分類の一括計算用関数と、プロセスプールで計算する関数を返す。"""
+    assert average in ("macro", "weighted")
+    true_type = sklearn.utils.multiclass.type_of_target(y_true)
+    epsilon = 1e-15
+    if true_type == "binary":
+        if proba_pred.ndim == 2:
+            assert proba_pred.shape == (len(proba_pred), 2)
+            proba_pred = proba_pred[:, 1]
+        positives = y_true == 1
+        pred_positives = proba_pred >= 0.5
+        p = np.clip(proba_pred, epsilon, 1 - epsilon)
+        logloss = -np.where(positives, np.log(p), np.log(1 - p))
+        # AUC・AP用に1回だけ確信度の降順に並べて、同じ値のグループの開始位置を求める
+        order = np.argsort(proba_pred)[::-1]
+        sorted_scores = proba_pred[order]
+        starts = np.append(0, np.nonzero(np.diff(sorted_scores))[0] + 1)
+        sorted_positives = positives[order]
+
+        def _vectorized(counts):
+            counts = counts.astype(np.float64)
+            n = counts.sum(axis=1)
+            tp = counts @ (positives & pred_positives)
+            fp = counts @ (~positives & pred_positives)
+            fn = counts @ (positives & ~pred_positives)
+            prec = _safe_div(tp, tp + fp)
+            rec = _safe_div(tp, tp + fn)
+            sorted_counts = counts[:, order]
+            pos_hist = np.add.reduceat(sorted_counts * sorted_positives, starts, axis=1)
+            neg_hist = np.add.reduceat(
+                sorted_counts * ~sorted_positives, starts, axis=1
+            )
+            auc, ap = _weighted_auc_ap(pos_hist, neg_hist)
+            return {
+                "acc": (counts @ (positives == pred_positives)) / n,
+                "f1": _safe_div(2 * prec * rec, prec + rec),
+                "auc": auc,
+                "ap": ap,
+                "prec": prec,
+                "rec": rec,
+                "logloss": (counts @ logloss) / n,
+            }
+
+        return _vectorized, None
+    else:
+        assert true_type == "multiclass"
+        num_samples = len(y_true)
+        num_classes = proba_pred.shape[-1]
+        assert proba_pred.shape == (
+            num_samples,
+            num_classes,
+        ), f"Shape error: {proba_pred.shape}"
+        assert np.max(y_true) < num_classes, f"Label error: {np.max(y_true)}"
+        y_pred = np.argmax(proba_pred, axis=-1)
+        p = np.clip(proba_pred, epsilon, 1 - epsilon)
+        logloss = -np.log(p[np.arange(num_samples), y_true] / p.sum(axis=-1))
+        # クラス毎の件数はサンプル→クラスの疎行列との積で求める
+        rows = np.arange(num_samples)
+        true_onehot = scipy.sparse.csr_matrix(
+            (np.ones(num_samples), (rows, y_true)), shape=(num_samples, num_classes)
+        )
+        pred_onehot = scipy.sparse.csr_matrix(
+            (np.ones(num_samples), (rows, y_pred)), shape=(num_samples, num_classes)
+        )
+        tp_onehot = true_onehot.multiply(pred_onehot).tocsr()
+
+        def _vectorized(counts):
+            counts = counts.astype(np.float64)
+            n = counts.sum(axis=1)
+            tp = np.asarray((tp_onehot.T @ counts.T).T)  # (B, C)
+            support = np.asarray((true_onehot.T @ counts.T).T)  # (B, C)
+            pred_count = np.asarray((pred_onehot.T @ counts.T).T)  # (B, C)
+            prec = _safe_div(tp, pred_count)
+            rec = _safe_div(tp, support)
+            f1 = _safe_div(2 * prec * rec, prec + rec)
+            if average == "weighted":
+                weights = support / support.sum(axis=1, keepdims=True)
+            else:
+                weights = np.full(support.shape, 1 / num_classes)
+            return {
+                "acc": tp.sum(axis=1) / n,
+                "f1": np.sum(f1 * weights, axis=1),
+                "prec": np.sum(prec * weights, axis=1),
+                "rec": np.sum(rec * weights, axis=1),
+                "logloss": (counts @ logloss) / n,
+            }
+
+        return _vectorized, _MulticlassRankMetrics(average)
+
+
+class _MulticlassRankMetrics:
+    """多クラス分類のAUC・AP。(プロセスプールに渡すためpickle可能なクラスにしている)"""
+
+    def __init__(self, average):
+        self.average = average
+
+    def __call__(self, y_true, proba_pred):
+        from .classification import _multiclass_auc_ap
+
+        auc, ap = _multiclass_auc_ap(y_true, proba_pred, self.average, n_jobs=1)
+        return {"auc": auc, "ap": ap}
+
+
+def _regression_fns(y_true, y_pred):
+    """回帰の一括計算用関数と、プロセスプールで計算する関数を返す。"""
+    if y_true.ndim > 1 and np.prod(y_true.shape[1:]) > 1:
+        # 多出力は一括計算未対応
+        return None, tk.evaluations.evaluate_regression
+    y_true = y_true.astype(np.float64).ravel()
+    y_pred = y_pred.astype(np.float64).ravel()
+    errors = y_true - y_pred
+
+    def _vectorized(counts):
+        counts = counts.astype(np.float64)
+        n = counts.sum(axis=1)
+        sse = counts @ errors ** 2
+        sae = counts @ np.abs(errors)
+        true_sum = counts @ y_true
+        sst = counts @ y_true ** 2 - true_sum ** 2 / n
+        pred_mean = (counts @ y_pred) / n
+        base_errors = y_true[np.newaxis, :] - pred_mean[:, np.newaxis]
+        rmse = np.sqrt(sse / n)
+        mae = sae / n
+        return {
+            "r2": np.where(
+                sst > 0,
+                1 - sse / np.where(sst > 0, sst, 1),
+                np.where(sse == 0, 1.0, 0.0),
+            ),
+            "rmse": rmse,
+            "rmse_base": np.sqrt(np.sum(counts * base_errors ** 2, axis=1) / n),
+            "mae": mae,
+            "mae_base": np.sum(counts * np.abs(base_errors), axis=1) / n,
+            "rmse/mae": rmse / mae,
+        }
+
+    return _vectorized, None
+
+
+def _weighted_auc_ap(pos_hist: np.ndarray, neg_hist: np.ndarray):
+    """確信度の降順に並べた値毎の正例・負例の件数(重み)からAUCとAPを算出する。
+
+    Args:
+        pos_hist: 正例の件数 (リサンプリング回数, 値の種類数)
+        neg_hist: 負例の件数 (リサンプリング回数, 値の種類数)
+
+    """
+    tps = np.cumsum(pos_hist, axis=1)
+    fps = np.cumsum(neg_hist, axis=1)
+    num_pos, num_neg = tps[:, -1], fps[:, -1]
+    prev_tps = tps - pos_hist
+    prev_fps = fps - neg_hist
+    auc = _safe_div(
+        np.sum((fps - prev_fps) * (tps + prev_tps), axis=1), 2 * num_pos * num_neg
+    )
+    ap = _safe_div(np.sum(pos_hist * _safe_div(tps, tps + fps), axis=1), num_pos)
+    # 正例・負例が無い場合は算出できない
+    auc[(num_pos == 0) | (num_neg == 0)] = np.nan
+    ap[num_pos == 0] = np.nan
+    return auc, ap
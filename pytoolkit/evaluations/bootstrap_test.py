@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import pytoolkit as tk
+from pytoolkit.evaluations import bootstrap
+
+
+@pytest.mark.parametrize("task", ["binary", "multiclass", "regression"])
+def test_evaluate_bootstrap(task):
+    rng = np.random.RandomState(123)
+    if task == "regression":
+        y_true = rng.normal(size=200)
+        y_pred = y_true + rng.normal(scale=0.5, size=200)
+        metrics = "regression"
+        evaluate_fn = tk.evaluations.evaluate_regression
+    else:
+        num_classes = 2 if task == "binary" else 3
+        y_true = np.arange(200) % num_classes
+        y_pred = np.round(rng.dirichlet(np.ones(num_classes), size=200), 1)
+        y_pred[np.arange(200), y_true] += 0.3
+        y_pred /= y_pred.sum(axis=-1, keepdims=True)
+        metrics = "classification"
+        evaluate_fn = tk.evaluations.evaluate_classification
+
+    ci = tk.evaluations.evaluate_bootstrap(
+        y_true, y_pred, metrics, n_bootstrap=50, random_state=1, n_jobs=1
+    )
+    evals = evaluate_fn(y_true, y_pred)
+    for key, (low, high) in ci.items():
+        assert low <= high, key
+        if np.ndim(evals[key]) == 0:
+            assert low - 0.1 <= evals[key] <= high + 0.1, key
+
+    # 一括計算の結果とリサンプリングしたデータでの評価結果が一致すること
+    counts = next(bootstrap._bootstrap_counts(len(y_true), 3, 1))
+    vectorized_fn, _ = (
+        bootstrap._regression_fns(y_true, y_pred)
+        if task == "regression"
+        else bootstrap._classification_fns(y_true, y_pred, "macro")
+    )
+    values = vectorized_fn(counts)
+    for i, c in enumerate(counts):
+        expected = bootstrap._evaluate_resampled(evaluate_fn, y_true, y_pred, c)
+        for key, v in values.items():
+            e = expected[key][1] if np.ndim(expected[key]) == 1 else expected[key]
+            assert v[i] == pytest.approx(e), (task, key)
+
+
+def test_evaluate_bootstrap_extra_class():
+    # 予測側にだけ存在するクラスがある場合もevaluate_classificationと同じ扱いにする
+    rng = np.random.RandomState(0)
+    y_true = rng.randint(0, 3, size=300)
+    y_pred = rng.dirichlet(np.ones(4), size=300)
+
+    ci = tk.evaluations.evaluate_bootstrap(
+        y_true, y_pred, n_bootstrap=100, random_state=1, n_jobs=1
+    )
+    evals = tk.evaluations.evaluate_classification(y_true, y_pred)
+    for key in ("acc", "f1", "prec", "rec", "logloss"):
+        low, high = ci[key]
+        assert low <= evals[key] <= high, key
+
+    counts = next(bootstrap._bootstrap_counts(len(y_true), 3, 1))
+    vectorized_fn, _ = bootstrap._classification_fns(y_true, y_pred, "macro")
+    values = vectorized_fn(counts)
+    for i, c in enumerate(counts):
+        expected = bootstrap._evaluate_resampled(
+            tk.evaluations.evaluate_classification, y_true, y_pred, c
+        )
+        for key, v in values.items():
+            assert v[i] == pytest.approx(expected[key]), key
@@ -1,13 +1,17 @@
 """分類の評価。"""
 from __future__ import annotations
 
+import os
 import typing
 
+import joblib
 import numpy as np
 import sklearn.metrics
 
 import pytoolkit as tk
 
+from .core import Accumulator, _safe_div
+
 
 def print_classification_metrics(
     y_true: np.ndarray,
@@ -44,9 +48,20 @@ def print_classification_metrics(
 
 
 def evaluate_classification(
-    y_true: np.ndarray, proba_pred: np.ndarray, average: str = "macro"
+    y_true: np.ndarray, proba_pred: np.ndarray, average: str = "macro", n_jobs: int = 1,
 ) -> tk.evaluations.EvalsType:
-    """分類の評価。"""
+    """分類の評価。
+
+    多クラス分類のAUC・AP・loglossはone-hot化せずにクラス毎に算出する。
+    (正例または負例が無いクラスはAUC・APの平均から除外する)
+
+    Args:
+        y_true: ラベル
+        proba_pred: 推論結果 (確率。多クラス分類の場合はshape=(サンプル数, クラス数))
+        average: 多クラス分類の場合の平均の取り方。("macro", "weighted", "micro")
+        n_jobs: 多クラス分類のAUC・APの並列数。(joblibと同様に-1ならCPU数。既定では並列化しない)
+
+    """
     true_type = sklearn.utils.multiclass.type_of_target(y_true)
     pred_type = sklearn.utils.multiclass.type_of_target(proba_pred)
     if true_type == "binary":  # binary
@@ -78,19 +93,23 @@ def evaluate_classification(
     else:  # multiclass
         assert true_type == "multiclass"
         assert pred_type == "continuous-multioutput"
-        num_classes = np.max(y_true) + 1
+        assert average in ("macro", "weighted", "micro")
+        y_true = np.asarray(y_true)
+        proba_pred = np.asarray(proba_pred)
+        num_classes = proba_pred.shape[-1]
+        assert proba_pred.shape == (
+            len(y_true),
+            num_classes,
+        ), f"Shape error: {proba_pred.shape}"
+        assert np.max(y_true) < num_classes, f"Label error: {np.max(y_true)}"
         labels = list(range(num_classes))
-        ohe_true = tk.ml.to_categorical(num_classes)(np.asarray(y_true))
         y_pred = np.argmax(proba_pred, axis=-1)
         acc = sklearn.metrics.accuracy_score(y_true, y_pred)
         prec, rec, f1, _ = sklearn.metrics.precision_recall_fscore_support(
             y_true, y_pred, labels=labels, average=average
         )
-        auc = sklearn.metrics.roc_auc_score(ohe_true, proba_pred, average=average)
-        ap = sklearn.metrics.average_precision_score(
-            ohe_true, proba_pred, average=average
-        )
-        logloss = sklearn.metrics.log_loss(ohe_true, proba_pred)
+        auc, ap = _multiclass_auc_ap(y_true, proba_pred, average, n_jobs)
+        logloss = np.mean(_multiclass_log_loss(y_true, proba_pred))
         return {
             "type": "multiclass",
             "acc": acc,
@@ -101,3 +120,254 @@ def evaluate_classification(
             "rec": rec,
             "logloss": logloss,
         }
+
+
+def _multiclass_auc_ap(y_true, proba_pred, average, n_jobs):
+    """多クラス分類のAUC・APをクラス毎にスコアの順位から算出して平均する。"""
+    num_classes = proba_pred.shape[-1]
+    if average == "micro":
+        return _micro_auc_ap(y_true, proba_pred, n_jobs)
+
+    results = [
+        r
+        for rs in _map_classes(
+            lambda c: _rank_auc_ap(proba_pred[:, c], y_true == c), num_classes, n_jobs
+        )
+        for r in rs
+    ]
+    auc, ap = np.array(results).T
+    support = np.bincount(y_true, minlength=num_classes)
+    mask = np.isfinite(auc)
+    if not mask.any():
+        return np.nan, np.nan
+    weights = support[mask] if average == "weighted" else None
+    return np.average(auc[mask], weights=weights), np.average(ap[mask], weights=weights)
+
+
+def _micro_auc_ap(y_true, proba_pred, n_jobs):
+    """全クラス分をまとめて1つの2クラス分類として扱ったAUC・AP。
+
+    (N, C)のone-hotや全スコアのソートは作らずに、クラス毎にソートしたスコア上での
+    正例のスコアの順位(より小さいスコア・同じスコアの件数)を合計して算出する。
+
+    """
+    num_samples, num_classes = proba_pred.shape
+    pos_scores = proba_pred[np.arange(num_samples), y_true]
+
+    def _count(c):
+        # クラスcの列で、各正例のスコアより小さいもの・同じものの件数
+        sorted_scores = np.sort(proba_pred[:, c])
+        lower = np.searchsorted(sorted_scores, pos_scores, side="left")
+        upper = np.searchsorted(sorted_scores, pos_scores, side="right")
+        return lower, upper - lower
+
+    below = np.zeros(num_samples, dtype=np.int64)
+    ties = np.zeros(num_samples, dtype=np.int64)
+    for rs in _map_classes(_count, num_classes, n_jobs):
+        for lower, same in rs:
+            below += lower
+            ties += same
+
+    # 正例同士の分を除いて負例の件数にする
+    sorted_pos = np.sort(pos_scores)
+    pos_below = np.searchsorted(sorted_pos, pos_scores, side="left")
+    pos_ties = np.searchsorted(sorted_pos, pos_scores, side="right") - pos_below
+    num_pos, num_neg = num_samples, num_samples * (num_classes - 1)
+    if num_pos == 0 or num_neg == 0:
+        return np.nan, np.nan
+    # 同率を0.5としたMann-Whitney U
+    neg_below = below - pos_below
+    neg_ties = ties - pos_ties
+    auc = np.sum(neg_below + neg_ties / 2) / (num_pos * num_neg)
+    # 各正例のスコアを閾値としたprecisionの平均 (同率の正例は同じ閾値になる)
+    tps = num_pos - pos_below
+    counts = num_samples * num_classes - below
+    ap = np.mean(tps / counts)
+    return auc, ap
+
+
+def _map_classes(fn, num_classes, n_jobs):
+    """クラス毎の処理をチャンク単位でスレッドに投げて、チャンク毎の結果のリストを返す。"""
+
+    @joblib.delayed
+    def _process(classes):
+        return [fn(c) for c in classes]
+
+    # 1クラスあたりの処理が軽いこともあるので、ある程度まとめてスレッドに投げる
+    chunks = np.array_split(
+        np.arange(num_classes), min(num_classes, (os.cpu_count() or 1) * 4)
+    )
+    with joblib.Parallel(n_jobs=n_jobs, backend="threading") as parallel:
+        return parallel(_process(c) for c in chunks)
+
+
+def _rank_auc_ap(scores: np.ndarray, positives: np.ndarray):
+    """1クラス分のROC AUCとAverage Precisionを算出する。(sklearnと同じ値)
+
+    スコアの降順に1回ソートし、同じスコアをまとめた閾値毎の件数から算出する。
+    正例または負例が無い場合はnanを返す。
+
+    """
+    # 同じスコアはまとめて扱うので、同率内の順序は問わない
+    order = np.argsort(scores)[::-1]
+    sorted_scores = scores[order]
+    # 同じスコアの末尾の位置
+    ends = np.append(np.nonzero(np.diff(sorted_scores))[0], len(scores) - 1)
+    tps = np.cumsum(positives[order])[ends]
+    fps = ends + 1 - tps
+    num_pos, num_neg = tps[-1], fps[-1]
+    if num_pos == 0 or num_neg == 0:
+        return np.nan, np.nan
+    # ROC曲線の台形の面積 (同率の順位を平均したMann-Whitney Uと等価)
+    prev_tps = np.append(0, tps[:-1])
+    prev_fps = np.append(0, fps[:-1])
+    auc = np.sum((fps - prev_fps) * (tps + prev_tps)) / (2 * num_pos * num_neg)
+    # 閾値毎のprecisionをrecallの増分で重み付けした和
+    ap = np.sum((tps - prev_tps) / num_pos * (tps / (tps + fps)))
+    return auc, ap
+
+
+def _multiclass_log_loss(y_true, proba_pred, epsilon=1e-15):
+    """サンプル毎のlogloss。(sklearn.metrics.log_lossと同様にクリップして正規化する)"""
+    p = np.clip(proba_pred, epsilon, 1 - epsilon)
+    p_true = p[np.arange(len(p)), y_true] / p.sum(axis=-1)
+    return -np.log(p_true)
+
+
+class ClassificationAccumulator(Accumulator):
+    """evaluate_classificationの逐次集計版。
+
+    AUCとAPは確信度をnum_bins個のビンに分けたヒストグラムから近似的に算出する。
+    (同じビンに入った値は同率として扱う)
+
+    Args:
+        average: 多クラス分類の場合の平均の取り方。("macro", "weighted", "micro")
+        num_bins: AUC・AP用のヒストグラムのビン数
+
+    """
+
+    def __init__(self, average: str = "macro", num_bins: int = 1000):
+        assert average in ("macro", "weighted", "micro")
+        self.average = average
+        self.num_bins = num_bins
+        self.num_classes: typing.Optional[int] = None
+        self.cm: typing.Optional[np.ndarray] = None
+        self.hist: typing.Optional[np.ndarray] = None
+        self.logloss_sum = 0.0
+        super().__init__()
+
+    def reset(self) -> None:
+        self.num_classes = None
+        self.cm = None  # shape=(C, C)
+        self.hist = None  # shape=(クラス数(2クラス分類なら1), 負例/正例, num_bins)
+        self.logloss_sum = 0.0
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray) -> None:
+        y_true = np.asarray(y_true).astype(np.int64).reshape((-1,))
+        proba_pred = np.asarray(y_pred, dtype=np.float64)
+        if proba_pred.ndim == 2 and proba_pred.shape[-1] in (1, 2):
+            proba_pred = proba_pred[:, -1]  # 2クラス分類
+        num_classes = 2 if proba_pred.ndim == 1 else proba_pred.shape[-1]
+        assert len(proba_pred) == len(y_true)
+        if self.num_classes is None:
+            self.num_classes = num_classes
+            self.cm = np.zeros((num_classes, num_classes), dtype=np.int64)
+            self.hist = np.zeros(
+                (1 if num_classes == 2 else num_classes, 2, self.num_bins),
+                dtype=np.int64,
+            )
+        assert self.num_classes == num_classes, "クラス数が一致しない"
+        assert self.cm is not None and self.hist is not None
+
+        epsilon = 1e-15
+        if num_classes == 2:
+            y_pred_c = (proba_pred >= 0.5).astype(np.int64)
+            scores = proba_pred[:, np.newaxis]
+            positives = (y_true == 1)[:, np.newaxis]
+            p = np.clip(proba_pred, epsilon, 1 - epsilon)
+            logloss = -np.where(y_true == 1, np.log(p), np.log(1 - p))
+        else:
+            y_pred_c = proba_pred.argmax(axis=-1)
+            scores = proba_pred
+            positives = y_true[:, np.newaxis] == np.arange(num_classes)
+            logloss = _multiclass_log_loss(y_true, proba_pred, epsilon)
+        self.cm += np.bincount(
+            y_true * num_classes + y_pred_c, minlength=num_classes ** 2
+        ).reshape((num_classes, num_classes))
+        bins = np.clip(
+            (np.clip(scores, 0, 1) * self.num_bins).astype(np.int64),
+            0,
+            self.num_bins - 1,
+        )
+        index = (np.arange(scores.shape[1]) * 2 + positives) * self.num_bins + bins
+        self.hist += np.bincount(index.ravel(), minlength=self.hist.size).reshape(
+            self.hist.shape
+        )
+        self.logloss_sum += float(np.sum(logloss))
+
+    def result(self) -> tk.evaluations.EvalsType:
+        assert self.cm is not None and self.hist is not None, "未集計"
+        cm = self.cm
+        tp = np.diag(cm)
+        support = cm.sum(axis=1)
+        prec = _safe_div(tp, cm.sum(axis=0))
+        rec = _safe_div(tp, support)
+        f1 = _safe_div(2 * prec * rec, prec + rec)
+        auc = np.array([_hist_auc(h[0], h[1]) for h in self.hist])
+        ap = np.array([_hist_ap(h[0], h[1]) for h in self.hist])
+        evals = {
+            "type": "binary" if self.num_classes == 2 else "multiclass",
+            "acc": np.sum(tp) / np.sum(cm),
+        }
+        if self.num_classes == 2:
+            # 正例のみ
+            evals.update(f1=f1[1], auc=auc[0], ap=ap[0], prec=prec[1], rec=rec[1])
+        elif self.average == "micro":
+            hist = self.hist.sum(axis=0)
+            evals.update(
+                f1=evals["acc"],
+                auc=_hist_auc(hist[0], hist[1]),
+                ap=_hist_ap(hist[0], hist[1]),
+                prec=evals["acc"],
+                rec=evals["acc"],
+            )
+        else:
+            weights = support if self.average == "weighted" else None
+            # AUC・APは算出できないクラス(正例または負例が無い)を除いて平均する
+            mask = np.isfinite(auc)
+            if mask.any():
+                rank_weights = weights[mask] if weights is not None else None
+                auc_avg = np.average(auc[mask], weights=rank_weights)
+                ap_avg = np.average(ap[mask], weights=rank_weights)
+            else:
+                auc_avg, ap_avg = np.nan, np.nan
+            evals.update(
+                f1=np.average(f1, weights=weights),
+                auc=auc_avg,
+                ap=ap_avg,
+                prec=np.average(prec, weights=weights),
+                rec=np.average(rec, weights=weights),
+            )
+        evals["logloss"] = self.logloss_sum / np.sum(cm)
+        return evals
+
+
+def _hist_auc(neg_hist: np.ndarray, pos_hist: np.ndarray) -> float:
+    """ヒストグラムからROC AUCを算出する。(同じビン内は同率扱い)"""
+    num_pos, num_neg = pos_hist.sum(), neg_hist.sum()
+    if num_pos == 0 or num_neg == 0:
+        return np.nan
+    neg_below = np.cumsum(neg_hist) - neg_hist
+    score = np.sum(pos_hist * (neg_below + neg_hist / 2))
+    return score / (num_pos * num_neg)
+
+
+def _hist_ap(neg_hist: np.ndarray, pos_hist: np.ndarray) -> float:
+    """ヒストグラムからAverage Precisionを算出する。(同じビン内は同率扱い)"""
+    num_pos = pos_hist.sum()
+    if num_pos == 0:
+        return np.nan
+    tp = np.cumsum(pos_hist[::-1])
+    fp = np.cumsum(neg_hist[::-1])
+    precision = _safe_div(tp, tp + fp)
+    return np.sum(pos_hist[::-1] / num_pos * precision)
@@ -1,4 +1,6 @@
 import numpy as np
+import pytest
+import sklearn.metrics
 
 import pytoolkit as tk
 
@@ -27,3 +29,67 @@ def test_print_classification_metrics_binary_multi():
     y_true = np.array([0, 1, 1, 0])
     prob_pred = np.array([[0.25, 0.75], [0.25, 0.75], [0.75, 0.25], [0.25, 0.75]])
     tk.evaluations.print_classification_metrics(y_true, prob_pred)
+
+
+@pytest.mark.parametrize("num_classes", [2, 3])
+def test_classification_accumulator(num_classes):
+    rng = np.random.RandomState(123)
+    y_true = rng.randint(0, num_classes, size=1000)
+    proba_pred = rng.dirichlet(np.ones(num_classes), size=1000)
+    proba_pred[np.arange(1000), y_true] += 0.5
+    proba_pred /= proba_pred.sum(axis=-1, keepdims=True)
+    if num_classes == 2:
+        proba_pred = proba_pred[:, 1]
+
+    expected = tk.evaluations.evaluate_classification(y_true, proba_pred)
+    accumulator = tk.evaluations.ClassificationAccumulator()
+    evals = accumulator.update_flow(y_true, proba_pred, batch_size=64)
+    assert evals["type"] == expected["type"]
+    for key in ("acc", "logloss"):
+        assert evals[key] == pytest.approx(expected[key])
+    for key in ("f1", "prec", "rec"):
+        # 2クラス分類のevaluate_classificationはクラス毎の値なので正例の値と比較
+        value = expected[key][1] if num_classes == 2 else expected[key]
+        assert evals[key] == pytest.approx(value)
+    for key in ("auc", "ap"):
+        assert evals[key] == pytest.approx(expected[key], abs=1e-2)
+
+
+@pytest.mark.parametrize("average", ["macro", "weighted"])
+def test_classification_accumulator_missing_class(average):
+    # 正例が無いクラス(3)はAUC・APの平均から除外する
+    rng = np.random.RandomState(123)
+    y_true = rng.randint(0, 3, size=300)
+    proba_pred = rng.dirichlet(np.ones(4), size=300)
+    expected = tk.evaluations.evaluate_classification(y_true, proba_pred, average)
+    accumulator = tk.evaluations.ClassificationAccumulator(average)
+    evals = accumulator.update_flow(y_true, proba_pred, batch_size=64)
+    for key in ("auc", "ap"):
+        assert np.isfinite(evals[key])
+        assert evals[key] == pytest.approx(expected[key], abs=1e-2)
+
+    # 全件同じクラスだとどのクラスもAUC・APが算出できないのでnan
+    accumulator.reset()
+    evals = accumulator.update_flow(np.zeros_like(y_true), proba_pred, batch_size=64)
+    assert np.isnan(evals["auc"])
+    assert np.isnan(evals["ap"])
+
+
+@pytest.mark.parametrize("n_jobs", [1, -1])
+@pytest.mark.parametrize("average", ["macro", "weighted", "micro"])
+def test_evaluate_classification_multi_rank(average, n_jobs):
+    rng = np.random.RandomState(123)
+    y_true = rng.randint(0, 5, size=300)
+    # 同率を含むスコア
+    proba_pred = np.round(rng.dirichlet(np.ones(5), size=300), 1)
+    ohe_true = np.eye(5)[y_true]
+
+    evals = tk.evaluations.evaluate_classification(
+        y_true, proba_pred, average, n_jobs=n_jobs
+    )
+    assert evals["auc"] == pytest.approx(
+        sklearn.metrics.roc_auc_score(ohe_true, proba_pred, average=average)
+    )
+    assert evals["ap"] == pytest.approx(
+        sklearn.metrics.average_precision_score(ohe_true, proba_pred, average=average)
+    )
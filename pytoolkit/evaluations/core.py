@@ -49,3 +49,78 @@ def mean(
         k: np.average([evals[k] for evals in evals_list], axis=0, weights=weights)
         for k in evals_list[0]
     }
+
+
+class Accumulator:
+    """評価指標を逐次集計するもののインターフェース。
+
+    update()でミニバッチ毎に集計して、result()で評価指標を返す。
+    推論結果全体をメモリに載せずに評価するためのもの。
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """集計結果をクリアする。"""
+        raise NotImplementedError()
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray) -> None:
+        """ミニバッチ分を集計する。
+
+        Args:
+            y_true: ラベル
+            y_pred: 推論結果
+
+        """
+        raise NotImplementedError()
+
+    def result(self) -> EvalsType:
+        """集計結果から評価指標を算出して返す。"""
+        raise NotImplementedError()
+
+    def update_flow(
+        self,
+        y_true: typing.Iterable[typing.Any],
+        y_pred: typing.Iterable[typing.Any],
+        batch_size: int = 1024,
+    ) -> EvalsType:
+        """サンプル毎のiterableから集計して評価指標を返す。
+
+        tk.models.predict_flow()の戻り値をそのまま渡せる。
+
+        Args:
+            y_true: サンプル毎のラベル
+            y_pred: サンプル毎の推論結果
+            batch_size: update()にまとめて渡すサンプル数
+
+        Returns:
+            評価指標
+
+        Examples:
+            ::
+
+                evals = tk.evaluations.ClassificationAccumulator().update_flow(
+                    val_set.labels,
+                    tk.models.predict_flow(model, val_set, data_loader),
+                )
+
+        """
+        y_true_batch: list = []
+        y_pred_batch: list = []
+        for yt, yp in zip(y_true, y_pred):
+            y_true_batch.append(yt)
+            y_pred_batch.append(yp)
+            if len(y_true_batch) >= batch_size:
+                self.update(np.array(y_true_batch), np.array(y_pred_batch))
+                y_true_batch.clear()
+                y_pred_batch.clear()
+        if len(y_true_batch) > 0:
+            self.update(np.array(y_true_batch), np.array(y_pred_batch))
+        return self.result()
+
+
+def _safe_div(a, b):
+    """0除算は0にする割り算。"""
+    return np.divide(a, b, out=np.zeros(np.shape(a), dtype=np.float64), where=b != 0)
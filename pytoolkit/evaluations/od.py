@@ -2,14 +2,17 @@
 from __future__ import annotations
 
 import typing
+
+import joblib
+import numba
 import numpy as np
 
 import pytoolkit as tk
 
 
 def print_od_metrics(
-    y_true: typing.Iterable[tk.od.ObjectsAnnotation],
-    y_pred: typing.Iterable[tk.od.ObjectsPrediction],
+    y_true: typing.Sequence[tk.od.ObjectsAnnotation],
+    y_pred: typing.Sequence[tk.od.ObjectsPrediction],
     print_fn: typing.Callable[[str], None] = None,
 ) -> tk.evaluations.EvalsType:
     """物体検出の各種metricsを算出してprintする。
@@ -36,27 +39,20 @@ def print_od_metrics(
 
 
 def evaluate_od(
-    y_true: typing.Iterable[tk.od.ObjectsAnnotation],
-    y_pred: typing.Iterable[tk.od.ObjectsPrediction],
+    y_true: typing.Sequence[tk.od.ObjectsAnnotation],
+    y_pred: typing.Sequence[tk.od.ObjectsPrediction],
+    n_jobs: int = 1,
 ) -> tk.evaluations.EvalsType:
     """物体検出の各種metricsを算出してdictで返す。
 
     Args:
         y_true: ラベル
         y_pred: 推論結果
+        n_jobs: クラス毎の処理の並列数。1以外ならプロセスプール(joblib)で並列に処理する。
+                (プロセスの起動などのコストがあるので、画像数・クラス数が多い場合のみ推奨)
 
-    Returns:
-        各種metrics
-
-        - "iou_score": IoUスコア (塩コンペのスコア)
-        - "dice": ダイス係数
-        - "fg_iou": 答えが空でないときのIoUの平均
-        - "bg_acc": 答えが空の場合の正解率
-        - "acc": Pixel Accuracy
-
-    ChainerCVを利用。
-    https://chainercv.readthedocs.io/en/stable/reference/evaluations.html?highlight=eval_detection_coco#chainercv.evaluations.eval_detection_coco
-    https://chainercv.readthedocs.io/en/stable/reference/evaluations.html?highlight=eval_detection_coco#eval-detection-voc
+    MS COCO (pycocotools)とPASCAL VOCの評価方法を独自に実装したもの。
+    (ChainerCVのeval_detection_coco/eval_detection_vocと同じ値になるようにしている)
 
     Returns:
         - "map/iou=0.50:0.95/area=all/max_dets=100"
@@ -69,49 +65,426 @@ def evaluate_od(
         - "voc07_map"
 
     """
-    import chainercv
-
-    gt_classes_list = np.array([y.classes for y in y_true])
-    gt_bboxes_list = np.array([y.real_bboxes for y in y_true])
-    gt_areas_list = np.array([y.areas for y in y_true])
-    gt_crowdeds_list = np.array([y.crowdeds for y in y_true])
-    gt_difficults_list = np.array([y.difficults for y in y_true])
-    pred_classes_list = np.array([p.classes for p in y_pred])
-    pred_confs_list = np.array([p.confs for p in y_pred])
-    pred_bboxes_list = np.array(
-        [p.get_real_bboxes(y.width, y.height) for (p, y) in zip(y_pred, y_true)]
-    )
-    evals = chainercv.evaluations.eval_detection_coco(
-        pred_bboxes_list,
-        pred_classes_list,
-        pred_confs_list,
-        gt_bboxes_list,
-        gt_classes_list,
-        gt_areas_list,
-        gt_crowdeds_list,
+    assert len(y_true) == len(y_pred)
+    if not isinstance(y_true, tk.od.ObjectsAnnotations):
+        y_true = tk.od.ObjectsAnnotations.from_list(y_true)
+    if not isinstance(y_pred, tk.od.ObjectsPredictions):
+        y_pred = tk.od.ObjectsPredictions.from_list(y_pred)
+    gt_bboxes = y_true.real_bboxes.astype(np.float64)
+    # 面積が無いものはbounding boxから算出
+    gt_areas = np.prod(gt_bboxes[:, 2:] - gt_bboxes[:, :2], axis=1)
+    if y_true.areas is not None:
+        gt_areas = np.where(np.isnan(y_true.areas), gt_areas, y_true.areas)
+    return evaluate_od_arrays(
+        gt_images=y_true.image_indices,
+        gt_classes=y_true.classes,
+        gt_bboxes=gt_bboxes,
+        gt_difficults=y_true.difficults,
+        gt_areas=gt_areas,
+        gt_crowdeds=(
+            np.zeros((y_true.num_objects,), dtype=bool)
+            if y_true.crowdeds is None
+            else y_true.crowdeds
+        ),
+        pred_images=y_pred.image_indices,
+        pred_classes=y_pred.classes,
+        pred_confs=y_pred.confs,
+        pred_bboxes=y_pred.get_real_bboxes(y_true.widths, y_true.heights),
+        num_images=len(y_true),
+        n_jobs=n_jobs,
     )
 
-    voc_evals1 = chainercv.evaluations.eval_detection_voc(
-        pred_bboxes_list,
-        pred_classes_list,
-        pred_confs_list,
-        gt_bboxes_list,
-        gt_classes_list,
-        gt_difficults_list,
-        use_07_metric=False,
+
+def evaluate_od_arrays(
+    gt_images: np.ndarray,
+    gt_classes: np.ndarray,
+    gt_bboxes: np.ndarray,
+    gt_difficults: np.ndarray,
+    gt_areas: np.ndarray,
+    gt_crowdeds: np.ndarray,
+    pred_images: np.ndarray,
+    pred_classes: np.ndarray,
+    pred_confs: np.ndarray,
+    pred_bboxes: np.ndarray,
+    num_images: int,
+    n_jobs: int = 1,
+) -> tk.evaluations.EvalsType:
+    """evaluate_odの本体。全画像分の物体を連結した配列で受け取る。
+
+    Args:
+        gt_images: 正解の物体毎の画像のindex。shapeは(物体数,)
+        gt_classes: 正解のクラスID。shapeは(物体数,)
+        gt_bboxes: 正解のbounding box(x1, y1, x2, y2)。値は実ピクセル数。shapeは(物体数, 4)
+        gt_difficults: difficultフラグ。shapeは(物体数,)
+        gt_areas: 面積。shapeは(物体数,)
+        gt_crowdeds: crowdフラグ。shapeは(物体数,)
+        pred_images: 予測結果の物体毎の画像のindex。shapeは(物体数,)
+        pred_classes: 予測結果のクラスID。shapeは(物体数,)
+        pred_confs: 予測結果の確信度。shapeは(物体数,)
+        pred_bboxes: 予測結果のbounding box(x1, y1, x2, y2)。値は実ピクセル数。shapeは(物体数, 4)
+        num_images: 画像数
+        n_jobs: クラス毎の処理の並列数。1以外ならプロセスプール(joblib)で並列に処理する。
+                (プロセスの起動などのコストがあるので、画像数・クラス数が多い場合のみ推奨)
+
+    Returns:
+        evaluate_odを参照
+
+    """
+    gt_images = np.asarray(gt_images)
+    gt_classes = np.asarray(gt_classes)
+    pred_images = np.asarray(pred_images)
+    pred_classes = np.asarray(pred_classes)
+    existent_labels = np.unique(np.concatenate([gt_classes, pred_classes]))
+    if len(existent_labels) == 0:
+        raise ValueError("No objects")
+
+    # 画像順→元の順で並べ替えておき、クラス毎に切り出して処理する
+    gt_order = np.lexsort((gt_images, gt_classes))
+    pred_order = np.lexsort((pred_images, pred_classes))
+    gt_class_offsets = np.searchsorted(
+        gt_classes[gt_order], np.append(existent_labels, existent_labels[-1] + 1)
     )
-    voc_evals2 = chainercv.evaluations.eval_detection_voc(
-        pred_bboxes_list,
-        pred_classes_list,
-        pred_confs_list,
-        gt_bboxes_list,
-        gt_classes_list,
-        gt_difficults_list,
-        use_07_metric=True,
+    pred_class_offsets = np.searchsorted(
+        pred_classes[pred_order], np.append(existent_labels, existent_labels[-1] + 1)
     )
-    evals["voc_ap"] = voc_evals1["ap"]
-    evals["voc_map"] = voc_evals1["map"]
-    evals["voc07_ap"] = voc_evals2["ap"]
-    evals["voc07_map"] = voc_evals2["map"]
+
+    gt_bboxes = np.asarray(gt_bboxes, dtype=np.float64)
+    gt_difficults = np.asarray(gt_difficults, dtype=bool)
+    gt_areas = np.asarray(gt_areas, dtype=np.float64)
+    gt_crowdeds = np.asarray(gt_crowdeds, dtype=bool)
+    pred_confs = np.asarray(pred_confs, dtype=np.float64)
+    pred_bboxes = np.asarray(pred_bboxes, dtype=np.float64)
+
+    def _task(i):
+        gt_ix = gt_order[gt_class_offsets[i] : gt_class_offsets[i + 1]]
+        pred_ix = pred_order[pred_class_offsets[i] : pred_class_offsets[i + 1]]
+        return joblib.delayed(_evaluate_class)(
+            gt_images[gt_ix],
+            gt_bboxes[gt_ix],
+            gt_difficults[gt_ix],
+            gt_areas[gt_ix],
+            gt_crowdeds[gt_ix],
+            pred_images[pred_ix],
+            pred_confs[pred_ix],
+            pred_bboxes[pred_ix],
+            num_images,
+        )
+
+    # n_jobs=1ならjoblibはプロセスプールを使わずに逐次処理する
+    with joblib.Parallel(n_jobs=n_jobs) as parallel:
+        class_results = parallel(_task(i) for i in range(len(existent_labels)))
+
+    evals: tk.evaluations.EvalsType = {}
+
+    # MS COCO
+    precision = np.stack([r["coco_precision"] for r in class_results], axis=2)
+    recall = np.stack([r["coco_recall"] for r in class_results], axis=1)
+    for key, (ap, iou_index, area_index, max_dets_index) in _COCO_KEYS.items():
+        value = precision if ap else recall
+        value = value[..., area_index, max_dets_index]
+        if iou_index is not None:
+            value = value[iou_index : iou_index + 1]
+        value = value.reshape((-1, len(existent_labels))).astype(np.float64)
+        value[value == -1] = np.nan
+        valid_classes = np.any(~np.isnan(value), axis=0)
+        class_values = np.full((len(existent_labels),), np.nan, dtype=np.float32)
+        class_values[valid_classes] = np.nanmean(value[:, valid_classes], axis=0)
+        evals[key] = np.full((existent_labels[-1] + 1,), np.nan)
+        evals[key][existent_labels] = class_values
+        evals["m" + key] = np.nanmean(class_values) if np.any(valid_classes) else np.nan
+    evals["existent_labels"] = existent_labels.tolist()
+
+    # PASCAL VOC
+    for key, ap_key in (("voc", "voc_ap"), ("voc07", "voc07_ap")):
+        ap = np.full((existent_labels[-1] + 1,), np.nan)
+        ap[existent_labels] = [r[ap_key] for r in class_results]
+        evals[f"{key}_ap"] = ap
+        evals[f"{key}_map"] = np.nanmean(ap)
 
     return evals
+
+
+# (AP or AR, IoUの閾値のindex, 面積の範囲のindex, max_detsのindex)
+_COCO_KEYS = {
+    "ap/iou=0.50:0.95/area=all/max_dets=100": (True, None, 0, 2),
+    "ap/iou=0.50/area=all/max_dets=100": (True, 0, 0, 2),
+    "ap/iou=0.75/area=all/max_dets=100": (True, 5, 0, 2),
+    "ar/iou=0.50:0.95/area=all/max_dets=1": (False, None, 0, 0),
+    "ar/iou=0.50:0.95/area=all/max_dets=10": (False, None, 0, 1),
+    "ar/iou=0.50:0.95/area=all/max_dets=100": (False, None, 0, 2),
+    "ap/iou=0.50:0.95/area=small/max_dets=100": (True, None, 1, 2),
+    "ap/iou=0.50:0.95/area=medium/max_dets=100": (True, None, 2, 2),
+    "ap/iou=0.50:0.95/area=large/max_dets=100": (True, None, 3, 2),
+    "ar/iou=0.50:0.95/area=small/max_dets=100": (False, None, 1, 2),
+    "ar/iou=0.50:0.95/area=medium/max_dets=100": (False, None, 2, 2),
+    "ar/iou=0.50:0.95/area=large/max_dets=100": (False, None, 3, 2),
+}
+_COCO_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+_COCO_RECALL_THRESHOLDS = np.linspace(0.0, 1.00, 101)
+_COCO_MAX_DETS = (1, 10, 100)
+_COCO_AREA_RANGES = np.array(
+    [[0, 1e5 ** 2], [0, 32 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]]
+)
+
+
+def _evaluate_class(
+    gt_images,
+    gt_bboxes,
+    gt_difficults,
+    gt_areas,
+    gt_crowdeds,
+    pred_images,
+    pred_confs,
+    pred_bboxes,
+    num_images,
+):
+    """1クラス分の評価。引数は画像順に並んでいる前提。"""
+    gt_offsets = _offsets(gt_images, num_images)
+    pred_index = np.arange(len(pred_images))
+    result = {}
+
+    # PASCAL VOC: 画像内は確信度の降順 (ChainerCVのargsort()[::-1]に合わせる)
+    order = _voc_order(pred_images, pred_confs)
+    match = _voc_match(
+        gt_bboxes + [0, 0, 1, 1],
+        gt_difficults,
+        gt_offsets,
+        pred_bboxes[order] + [0, 0, 1, 1],
+        _offsets(pred_images[order], num_images),
+        0.5,
+    )
+    scores = pred_confs[order]
+    match = match[scores.argsort()[::-1]]
+    tp = np.cumsum(match == 1)
+    fp = np.cumsum(match == 0)
+    n_pos = np.count_nonzero(~gt_difficults)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prec = tp / (fp + tp)
+    if n_pos > 0:
+        rec = tp / n_pos
+        result["voc_ap"] = _voc_ap(prec, rec, use_07_metric=False)
+        result["voc07_ap"] = _voc_ap(prec, rec, use_07_metric=True)
+    else:
+        result["voc_ap"] = result["voc07_ap"] = np.nan
+
+    # MS COCO: 画像内は確信度の降順 (同値は前が先。mergesort相当)、画像毎に上位max_dets個まで
+    order = np.lexsort((pred_index, -pred_confs, pred_images))
+    pred_offsets = _offsets(pred_images[order], num_images)
+    ranks = np.arange(len(order)) - np.repeat(pred_offsets[:-1], np.diff(pred_offsets))
+    order = order[ranks < _COCO_MAX_DETS[-1]]
+    ranks = ranks[ranks < _COCO_MAX_DETS[-1]]
+    dt_bboxes = pred_bboxes[order]
+    dt_matched, dt_ignore, gt_ignore = _coco_match(
+        _to_coco_bboxes(gt_bboxes),
+        gt_areas,
+        gt_crowdeds,
+        gt_offsets,
+        _to_coco_bboxes(dt_bboxes),
+        np.prod(dt_bboxes[:, 2:] - dt_bboxes[:, :2], axis=1),
+        _offsets(pred_images[order], num_images),
+        _COCO_IOU_THRESHOLDS,
+        _COCO_AREA_RANGES,
+    )
+    dt_scores = pred_confs[order]
+    T, R = len(_COCO_IOU_THRESHOLDS), len(_COCO_RECALL_THRESHOLDS)
+    A, M = len(_COCO_AREA_RANGES), len(_COCO_MAX_DETS)
+    precision = -np.ones((T, R, A, M))
+    recall = -np.ones((T, A, M))
+    for a in range(A):
+        npig = np.count_nonzero(~gt_ignore[a])
+        if npig == 0:
+            continue
+        for m, max_dets in enumerate(_COCO_MAX_DETS):
+            mask = ranks < max_dets
+            inds = np.argsort(-dt_scores[mask], kind="mergesort")
+            dtm = dt_matched[a][:, mask][:, inds]
+            dtig = dt_ignore[a][:, mask][:, inds]
+            tp_sum = np.cumsum(dtm & ~dtig, axis=1).astype(np.float64)
+            fp_sum = np.cumsum(~dtm & ~dtig, axis=1).astype(np.float64)
+            nd = tp_sum.shape[1]
+            rc = tp_sum / npig
+            pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+            recall[:, a, m] = rc[:, -1] if nd else 0
+            pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+            for t in range(T):
+                q = np.zeros((R,))
+                pi = np.searchsorted(rc[t], _COCO_RECALL_THRESHOLDS, side="left")
+                valid = pi < nd
+                q[valid] = pr[t, pi[valid]]
+                precision[t, :, a, m] = q
+    result["coco_precision"] = precision
+    result["coco_recall"] = recall
+    return result
+
+
+def _voc_order(pred_images, pred_confs):
+    """PASCAL VOC方式の画像内の並び順。
+
+    同値がある場合の順序はnumpyのソートの実装依存なので、同値を含む画像だけは個別にargsortする。
+    """
+    order = np.lexsort((-np.arange(len(pred_images)), -pred_confs, pred_images))
+    sorted_images, sorted_confs = pred_images[order], pred_confs[order]
+    tied = (sorted_images[1:] == sorted_images[:-1]) & (
+        sorted_confs[1:] == sorted_confs[:-1]
+    )
+    if tied.any():
+        offsets = _offsets(sorted_images, sorted_images[-1] + 1)
+        for i in np.unique(sorted_images[1:][tied]):
+            ix = np.arange(offsets[i], offsets[i + 1])
+            order[ix] = ix[pred_confs[ix].argsort()[::-1]]
+    return order
+
+
+def _voc_ap(prec, rec, use_07_metric):
+    """PASCAL VOCのAP。"""
+    prec = np.nan_to_num(prec)
+    if use_07_metric:
+        ap = 0.0
+        for t in np.arange(0.0, 1.1, 0.1):
+            p = np.max(prec[rec >= t]) if np.sum(rec >= t) > 0 else 0
+            ap += p / 11
+        return ap
+    mpre = np.concatenate(([0], prec, [0]))
+    mrec = np.concatenate(([0], rec, [1]))
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+    return np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
+
+
+@numba.njit(nogil=True)
+def _voc_match(
+    gt_bboxes, gt_difficults, gt_offsets, pred_bboxes, pred_offsets, iou_threshold
+):
+    """PASCAL VOC方式のマッチング。(1: 検出成功、0: 誤検出、-1: difficultなので無視)"""
+    match = np.zeros(len(pred_bboxes), dtype=np.int8)
+    for i in range(len(gt_offsets) - 1):
+        g0, g1 = gt_offsets[i], gt_offsets[i + 1]
+        p0, p1 = pred_offsets[i], pred_offsets[i + 1]
+        if g0 == g1:
+            continue
+        selected = np.zeros(g1 - g0, dtype=np.bool_)
+        for p in range(p0, p1):
+            best_ix = -1
+            best_iou = -1.0
+            for g in range(g0, g1):
+                x1 = max(pred_bboxes[p, 0], gt_bboxes[g, 0])
+                y1 = max(pred_bboxes[p, 1], gt_bboxes[g, 1])
+                x2 = min(pred_bboxes[p, 2], gt_bboxes[g, 2])
+                y2 = min(pred_bboxes[p, 3], gt_bboxes[g, 3])
+                iou = 0.0
+                if x1 < x2 and y1 < y2:
+                    area_i = (x2 - x1) * (y2 - y1)
+                    area_p = (pred_bboxes[p, 2] - pred_bboxes[p, 0]) * (
+                        pred_bboxes[p, 3] - pred_bboxes[p, 1]
+                    )
+                    area_g = (gt_bboxes[g, 2] - gt_bboxes[g, 0]) * (
+                        gt_bboxes[g, 3] - gt_bboxes[g, 1]
+                    )
+                    iou = area_i / (area_p + area_g - area_i)
+                if iou > best_iou:
+                    best_ix = g
+                    best_iou = iou
+            if best_iou < iou_threshold:
+                continue
+            if gt_difficults[best_ix]:
+                match[p] = -1
+            elif not selected[best_ix - g0]:
+                match[p] = 1
+            selected[best_ix - g0] = True
+    return match
+
+
+@numba.njit(nogil=True)
+def _coco_match(
+    gt_bboxes,
+    gt_areas,
+    gt_crowdeds,
+    gt_offsets,
+    dt_bboxes,
+    dt_areas,
+    dt_offsets,
+    iou_thresholds,
+    area_ranges,
+):
+    """MS COCO方式のマッチング。(pycocotoolsのCOCOeval.evaluateImg相当)
+
+    Returns:
+        予測結果がマッチしたか否か (面積の範囲, IoUの閾値, 予測結果)、
+        予測結果を無視するか否か (面積の範囲, IoUの閾値, 予測結果)、
+        正解を無視するか否か (面積の範囲, 正解)
+
+    """
+    A, T = len(area_ranges), len(iou_thresholds)
+    dt_matched = np.zeros((A, T, len(dt_bboxes)), dtype=np.bool_)
+    dt_ignore = np.zeros((A, T, len(dt_bboxes)), dtype=np.bool_)
+    gt_ignore = np.zeros((A, len(gt_bboxes)), dtype=np.bool_)
+    for i in range(len(gt_offsets) - 1):
+        g0, g1 = gt_offsets[i], gt_offsets[i + 1]
+        d0, d1 = dt_offsets[i], dt_offsets[i + 1]
+        # IoU (maskApi.cのbbIou相当。crowdの場合は予測結果の面積で割る)
+        ious = np.zeros((d1 - d0, g1 - g0))
+        for d in range(d0, d1):
+            dx, dy = dt_bboxes[d, 0], dt_bboxes[d, 1]
+            dw, dh = dt_bboxes[d, 2], dt_bboxes[d, 3]
+            for g in range(g0, g1):
+                gx, gy = gt_bboxes[g, 0], gt_bboxes[g, 1]
+                gw, gh = gt_bboxes[g, 2], gt_bboxes[g, 3]
+                w = min(dx + dw, gx + gw) - max(dx, gx)
+                h = min(dy + dh, gy + gh) - max(dy, gy)
+                if w <= 0 or h <= 0:
+                    continue
+                inter = w * h
+                union = dw * dh if gt_crowdeds[g] else dw * dh + gw * gh - inter
+                ious[d - d0, g - g0] = inter / union
+        for a in range(A):
+            # 無視する正解を後ろにした順序
+            ignore = np.zeros(g1 - g0, dtype=np.bool_)
+            for g in range(g0, g1):
+                ignore[g - g0] = (
+                    gt_crowdeds[g]
+                    or gt_areas[g] < area_ranges[a, 0]
+                    or gt_areas[g] > area_ranges[a, 1]
+                )
+                gt_ignore[a, g] = ignore[g - g0]
+            gind = np.concatenate((np.where(~ignore)[0], np.where(ignore)[0]))
+            for t in range(T):
+                gt_matched = np.zeros(g1 - g0, dtype=np.bool_)
+                for d in range(d1 - d0):
+                    iou = min(iou_thresholds[t], 1 - 1e-10)
+                    m = -1
+                    for gi in range(g1 - g0):
+                        g = gind[gi]
+                        # マッチ済みの正解はcrowdでなければスキップ
+                        if gt_matched[g] and not gt_crowdeds[g0 + g]:
+                            continue
+                        # 無視しない正解にマッチ済みなら、無視する正解は見ない
+                        if m > -1 and not ignore[m] and ignore[g]:
+                            break
+                        if ious[d, g] < iou:
+                            continue
+                        iou = ious[d, g]
+                        m = g
+                    if m == -1:
+                        continue
+                    dt_ignore[a, t, d0 + d] = ignore[m]
+                    dt_matched[a, t, d0 + d] = True
+                    gt_matched[m] = True
+            # 面積の範囲外でマッチしなかった予測結果は無視する
+            for d in range(d0, d1):
+                if dt_areas[d] < area_ranges[a, 0] or dt_areas[d] > area_ranges[a, 1]:
+                    for t in range(T):
+                        if not dt_matched[a, t, d]:
+                            dt_ignore[a, t, d] = True
+    return dt_matched, dt_ignore, gt_ignore
+
+
+def _to_coco_bboxes(bboxes):
+    """(x1, y1, x2, y2)を(x, y, w, h)に変換する。(pycocotoolsに合わせて小数点以下2桁に丸める)"""
+    return np.round(
+        np.concatenate([bboxes[:, :2], bboxes[:, 2:] - bboxes[:, :2]], axis=1), 2
+    )
+
+
+def _offsets(images, num_images):
+    """画像のindexの配列(昇順)から、画像毎の開始位置の配列(末尾に終端を含む)を作る。"""
+    return np.searchsorted(images, np.arange(num_images + 1))
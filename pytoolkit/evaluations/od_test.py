@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 
 import pytoolkit as tk
 
@@ -65,3 +66,10 @@ def test_print_od_metrics():
         ]
     )
     tk.evaluations.print_od_metrics(y_true, y_pred)
+
+    # ChainerCVのeval_detection_coco/eval_detection_vocで算出した値
+    evals = tk.evaluations.evaluate_od(y_true, y_pred, n_jobs=1)
+    assert evals["map/iou=0.50:0.95/area=all/max_dets=100"] == pytest.approx(0.71711457)
+    assert evals["map/iou=0.50/area=all/max_dets=100"] == pytest.approx(0.71711457)
+    assert evals["voc_ap"] == pytest.approx([0.3, 0.95238095])
+    assert evals["voc07_ap"] == pytest.approx([0.32727273, 0.94805195])
@@ -8,6 +8,8 @@ import sklearn.metrics
 
 import pytoolkit as tk
 
+from .core import Accumulator
+
 
 def print_regression_metrics(
     y_true: np.ndarray,
@@ -48,3 +50,71 @@ def evaluate_regression(
         # https://funatsu-lab.github.io/open-course-ware/basic-theory/accuracy-index/#how-to-check-rmse-mae-summary
         "rmse/mae": rmse / mae,
     }
+
+
+class RegressionAccumulator(Accumulator):
+    """evaluate_regressionの逐次集計版。
+
+    mae_baseのみ、その時点までのy_predの平均を基準にした近似値になる。
+
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.true_mean: typing.Any = 0.0
+        self.true_m2: typing.Any = 0.0
+        self.pred_sum = 0.0
+        self.se_sum: typing.Any = 0.0
+        self.ae_sum: typing.Any = 0.0
+        self.ae_base_sum: typing.Any = 0.0
+        super().__init__()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.true_mean = 0.0  # 出力毎のy_trueの平均
+        self.true_m2 = 0.0  # 出力毎のy_trueの偏差平方和
+        self.pred_sum = 0.0
+        self.se_sum = 0.0  # 出力毎の二乗誤差の和
+        self.ae_sum = 0.0  # 出力毎の絶対誤差の和
+        self.ae_base_sum = 0.0
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray) -> None:
+        y_true = np.asarray(y_true, dtype=np.float64).reshape((len(y_true), -1))
+        y_pred = np.asarray(y_pred, dtype=np.float64).reshape(y_true.shape)
+        n = len(y_true)
+        if n <= 0:
+            return
+        # 平均と偏差平方和はバッチ毎の値を合成する (Chan et al.)
+        batch_mean = y_true.mean(axis=0)
+        batch_m2 = np.sum((y_true - batch_mean) ** 2, axis=0)
+        delta = batch_mean - self.true_mean
+        total = self.count + n
+        self.true_mean = self.true_mean + delta * n / total
+        self.true_m2 = self.true_m2 + batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.pred_sum += float(np.sum(y_pred))
+        self.se_sum = self.se_sum + np.sum((y_true - y_pred) ** 2, axis=0)
+        self.ae_sum = self.ae_sum + np.sum(np.abs(y_true - y_pred), axis=0)
+        pred_mean = self.pred_sum / (self.count * y_pred.shape[1])
+        self.ae_base_sum = self.ae_base_sum + np.sum(np.abs(y_true - pred_mean), axis=0)
+
+    def result(self) -> tk.evaluations.EvalsType:
+        assert self.count > 0, "未集計"
+        pred_mean = self.pred_sum / (self.count * np.size(self.se_sum))
+        # y_predの平均を予測値とした場合の二乗誤差は平均と偏差平方和から求まる
+        se_base_sum = self.true_m2 + self.count * (self.true_mean - pred_mean) ** 2
+        r2 = np.where(
+            self.true_m2 > 0,
+            1 - self.se_sum / np.where(self.true_m2 > 0, self.true_m2, 1),
+            np.where(self.se_sum == 0, 1.0, 0.0),
+        )
+        rmse = np.sqrt(np.mean(self.se_sum) / self.count)
+        mae = np.mean(self.ae_sum) / self.count
+        return {
+            "r2": np.mean(r2),
+            "rmse": rmse,
+            "rmse_base": np.sqrt(np.mean(se_base_sum) / self.count),
+            "mae": mae,
+            "mae_base": np.mean(self.ae_base_sum) / self.count,
+            "rmse/mae": rmse / mae,
+        }
@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 
 import pytoolkit as tk
 
@@ -7,3 +8,18 @@ def test_print_regression_metrics():
     y_true = np.array([0, 1, 1, 0])
     prob_pred = np.array([0.25, 0.25, 0.75, 0.25])
     tk.evaluations.print_regression_metrics(y_true, prob_pred)
+
+
+def test_regression_accumulator():
+    rng = np.random.RandomState(123)
+    y_true = rng.normal(size=1000)
+    y_pred = y_true + rng.normal(scale=0.5, size=1000)
+
+    expected = tk.evaluations.evaluate_regression(y_true, y_pred)
+    accumulator = tk.evaluations.RegressionAccumulator()
+    for i in range(0, 1000, 64):
+        accumulator.update(y_true[i : i + 64], y_pred[i : i + 64])
+    evals = accumulator.result()
+    for key in ("r2", "rmse", "rmse_base", "mae", "rmse/mae"):
+        assert evals[key] == pytest.approx(expected[key])
+    assert evals["mae_base"] == pytest.approx(expected["mae_base"], rel=1e-2)
@@ -1,6 +1,9 @@
 """セマンティックセグメンテーションの評価。"""
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import os
 import typing
 import warnings
 
@@ -8,6 +11,8 @@ import numpy as np
 
 import pytoolkit as tk
 
+from .core import Accumulator
+
 
 def print_ss_metrics(
     y_true: typing.Iterable[np.ndarray],
@@ -44,16 +49,19 @@ def evaluate_ss(
     y_pred: typing.Iterable[np.ndarray],
     threshold: float = 0.5,
     multilabel: bool = False,
+    n_jobs: int = -1,
 ) -> tk.evaluations.EvalsType:
     """semantic segmentationの各種metricsを算出してdictで返す。
 
     y_true, y_predはgeneratorも可。(メモリ不足にならないように)
+    画像毎の処理はスレッドで並列に行い、集計結果のみを保持する。
 
     Args:
         y_true: ラベル (shape=(N, H, W) or (N, H, W, C))
         y_pred: 推論結果 (shape=(N, H, W) or (N, H, W, C))
         threshold: 閾値 (ラベルと推論結果と両方に適用)
         multilabel: マルチラベルならTrue、多クラスならFalse。
+        n_jobs: 並列数 (joblibと同様に、負の値ならCPU数 + 1 + n_jobs。-1ならCPU数)
 
     Returns:
         各種metrics
@@ -70,93 +78,150 @@ def evaluate_ss(
 
     """
 
-    def process_per_image(yt, yp):
-        if np.ndim(yt) == 2:
-            yt = np.expand_dims(yt, axis=-1)
-        if np.ndim(yp) == 2:
-            yp = np.expand_dims(yp, axis=-1)
-        assert np.ndim(yt) == 3  # (H, W, C)
-        assert np.ndim(yp) == 3  # (H, W, C)
-        if yt.shape[:2] != yp.shape[:2]:
-            warnings.warn(f"Predictions need resize.")  # リサイズ忘れちゃダメだぞ警告
-            yp = tk.ndimage.resize(yp, width=yt.shape[1], height=yt.shape[0])
-        assert yt.shape == yp.shape
-
-        if multilabel or yt.shape[-1] == 1:
-            # マルチラベルか2クラス分類の場合、閾値以上か否かを見る
-            p_true = yt >= threshold
-            p_pred = yp >= threshold
-        else:
-            # 多クラス分類の場合、argmaxしてonehot化
-            p_true = np.zeros(yt.shape, dtype=bool)
-            p_true[yt.argmax(axis=-1)] = True
-            p_pred = np.zeros(yp.shape, dtype=bool)
-            p_pred[yp.argmax(axis=-1)] = True
-        n_true = ~p_true
-        n_pred = ~p_pred
-        tp = np.sum(p_true & p_pred, axis=(0, 1))  # (C,)
-        fp = np.sum(n_true & p_pred, axis=(0, 1))  # (C,)
-        tn = np.sum(n_true & n_pred, axis=(0, 1))  # (C,)
-        fn = np.sum(p_true & n_pred, axis=(0, 1))  # (C,)
-        gp = np.sum(p_true, axis=(0, 1))  # (C,)
-        pp = np.sum(p_pred, axis=(0, 1))  # (C,)
-        if yt.shape[-1] == 1:
-            # class0=bg, class1=fg。(ひっくり返るので要注意)
-            cm = np.array(
-                [
-                    # negative,  positive
-                    [np.sum(tn), np.sum(fp)],  # gt negative
-                    [np.sum(fn), np.sum(tp)],  # gt positive
-                ]
+    # 画像は読み込んだ順にスレッドへ投げ、未処理分が溜まりすぎないようにしつつ逐次集計する
+    accumulator = SSAccumulator(threshold=threshold, multilabel=multilabel)
+    max_workers = max((os.cpu_count() or 1) + 1 + n_jobs, 1) if n_jobs < 0 else n_jobs
+    assert max_workers >= 1, f"Invalid n_jobs: {n_jobs}"
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures: typing.Deque[concurrent.futures.Future] = collections.deque()
+        for yt, yp in zip(y_true, y_pred):
+            futures.append(
+                executor.submit(_process_per_image, yt, yp, threshold, multilabel)
             )
-        else:
-            assert yt.shape[-1] >= 2
-            num_classes = yt.shape[-1]
-            cm = np.zeros((num_classes, num_classes), dtype=np.int64)
-            yt_c = yt.argmax(axis=-1)
-            yp_c = yp.argmax(axis=-1)
-            for i in range(num_classes):
-                for j in range(num_classes):
-                    cm[i, j] = np.sum((yt_c == i) & (yp_c == j))
-        return tp, fp, tn, fn, gp, pp, cm
-
-    r = [process_per_image(yt, yp) for yt, yp in zip(y_true, y_pred)]
-    tp, fp, tn, fn, gp, pp, cm = zip(*r)
-    tp = np.array(tp)  # (N, C), dtype=int
-    fp = np.array(fp)  # (N, C), dtype=int
-    tn = np.array(tn)  # (N, C), dtype=int
-    fn = np.array(fn)  # (N, C), dtype=int
-    gp = np.array(gp)  # (N, C), dtype=int
-    pp = np.array(pp)  # (N, C), dtype=int
-    cm = np.sum(cm, axis=0)  # (C, C), dtype=int
-    fg_mask = gp > 0  # (N, C), dtype=bool
-    bg_mask = ~fg_mask  # (N, C), dtype=bool
-    pred_bg_mask = pp <= 0  # (N, C), dtype=bool
-
-    epsilon = 1e-7
-    sample_iou = tp / (tp + fp + fn + epsilon)  # (N, C)
-    class_iou = np.diag(cm) / (
-        np.sum(cm, axis=1) + np.sum(cm, axis=0) - np.diag(cm) + epsilon
-    )  # (C,)
-    dice = 2 * np.mean(tp / (gp + pp + epsilon))
-
-    # 塩コンペのスコア
-    prec_list = []
-    for th in np.arange(0.5, 1.0, 0.05):
-        pred_fg_mask = sample_iou > th  # (N, C)
-        match = (fg_mask & pred_fg_mask) | (bg_mask & pred_bg_mask)
-        assert np.ndim(match) == 2  # (N, C)
-        prec_list.append(np.mean(match))
-    iou_score = np.mean(prec_list)
-
-    acc = np.sum(np.diag(cm)) / np.sum(cm)
-
-    return {
-        "iou": class_iou,
-        "miou": np.mean(class_iou),
-        "iou_score": iou_score,
-        "dice": dice,
-        "fg_iou": np.mean(sample_iou[fg_mask]),
-        "bg_acc": np.mean(pred_bg_mask[bg_mask]),
-        "acc": acc,
-    }
+            while len(futures) > max_workers * 2 or (
+                len(futures) > 0 and futures[0].done()
+            ):
+                accumulator._add(futures.popleft().result())
+        while len(futures) > 0:
+            accumulator._add(futures.popleft().result())
+    return accumulator.result()
+
+
+class SSAccumulator(Accumulator):
+    """evaluate_ssの逐次集計版。
+
+    画像毎の値は保持せず、クラス数に比例するメモリで集計する。
+
+    Args:
+        threshold: 閾値 (ラベルと推論結果と両方に適用)
+        multilabel: マルチラベルならTrue、多クラスならFalse。
+
+    """
+
+    # 塩コンペのスコアの閾値
+    IOU_THRESHOLDS = np.arange(0.5, 1.0, 0.05)
+
+    def __init__(self, threshold: float = 0.5, multilabel: bool = False):
+        self.threshold = threshold
+        self.multilabel = multilabel
+        self.cm: typing.Any = 0
+        self.num_cells = 0
+        self.dice_sum = 0.0
+        self.match_counts = np.zeros(len(self.IOU_THRESHOLDS), dtype=np.int64)
+        self.fg_iou_sum = 0.0
+        self.fg_count = 0
+        self.bg_correct = 0
+        self.bg_count = 0
+        super().__init__()
+
+    def reset(self) -> None:
+        self.cm = 0  # (C, C)
+        self.num_cells = 0  # 画像数×クラス数
+        self.dice_sum = 0.0
+        self.match_counts = np.zeros(len(self.IOU_THRESHOLDS), dtype=np.int64)
+        self.fg_iou_sum = 0.0
+        self.fg_count = 0
+        self.bg_correct = 0
+        self.bg_count = 0
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray) -> None:
+        for yt, yp in zip(y_true, y_pred):
+            self._add(_process_per_image(yt, yp, self.threshold, self.multilabel))
+
+    def _add(self, stats):
+        """画像1枚分の集計結果を加算する。"""
+        tp, fp, _, fn, gp, pp, cm = stats
+        epsilon = 1e-7
+        fg_mask = gp > 0  # (C,)
+        bg_mask = ~fg_mask  # (C,)
+        pred_bg_mask = pp <= 0  # (C,)
+        sample_iou = tp / (tp + fp + fn + epsilon)  # (C,)
+        self.cm = self.cm + cm
+        self.num_cells += len(tp)
+        self.dice_sum += np.sum(tp / (gp + pp + epsilon))
+        for i, th in enumerate(self.IOU_THRESHOLDS):
+            pred_fg_mask = sample_iou > th
+            match = (fg_mask & pred_fg_mask) | (bg_mask & pred_bg_mask)
+            self.match_counts[i] += np.sum(match)
+        self.fg_iou_sum += np.sum(sample_iou[fg_mask])
+        self.fg_count += np.sum(fg_mask)
+        self.bg_correct += np.sum(pred_bg_mask[bg_mask])
+        self.bg_count += np.sum(bg_mask)
+
+    def result(self) -> tk.evaluations.EvalsType:
+        assert self.num_cells > 0, "未集計"
+        epsilon = 1e-7
+        cm = np.asarray(self.cm)  # (C, C), dtype=int
+        class_iou = np.diag(cm) / (
+            np.sum(cm, axis=1) + np.sum(cm, axis=0) - np.diag(cm) + epsilon
+        )  # (C,)
+        return {
+            "iou": class_iou,
+            "miou": np.mean(class_iou),
+            "iou_score": np.mean(self.match_counts / self.num_cells),
+            "dice": 2 * self.dice_sum / self.num_cells,
+            "fg_iou": self.fg_iou_sum / self.fg_count if self.fg_count else np.nan,
+            "bg_acc": self.bg_correct / self.bg_count if self.bg_count else np.nan,
+            "acc": np.sum(np.diag(cm)) / np.sum(cm),
+        }
+
+
+def _process_per_image(yt, yp, threshold, multilabel):
+    """画像1枚分の集計。"""
+    if np.ndim(yt) == 2:
+        yt = np.expand_dims(yt, axis=-1)
+    if np.ndim(yp) == 2:
+        yp = np.expand_dims(yp, axis=-1)
+    assert np.ndim(yt) == 3  # (H, W, C)
+    assert np.ndim(yp) == 3  # (H, W, C)
+    if yt.shape[:2] != yp.shape[:2]:
+        warnings.warn(f"Predictions need resize.")  # リサイズ忘れちゃダメだぞ警告
+        yp = tk.ndimage.resize(yp, width=yt.shape[1], height=yt.shape[0])
+    assert yt.shape == yp.shape
+
+    if multilabel or yt.shape[-1] == 1:
+        # マルチラベルか2クラス分類の場合、閾値以上か否かを見る
+        p_true = yt >= threshold
+        p_pred = yp >= threshold
+    else:
+        # 多クラス分類の場合、argmaxしてonehot化
+        p_true = np.zeros(yt.shape, dtype=bool)
+        p_true[yt.argmax(axis=-1)] = True
+        p_pred = np.zeros(yp.shape, dtype=bool)
+        p_pred[yp.argmax(axis=-1)] = True
+    n_true = ~p_true
+    n_pred = ~p_pred
+    tp = np.sum(p_true & p_pred, axis=(0, 1))  # (C,)
+    fp = np.sum(n_true & p_pred, axis=(0, 1))  # (C,)
+    tn = np.sum(n_true & n_pred, axis=(0, 1))  # (C,)
+    fn = np.sum(p_true & n_pred, axis=(0, 1))  # (C,)
+    gp = np.sum(p_true, axis=(0, 1))  # (C,)
+    pp = np.sum(p_pred, axis=(0, 1))  # (C,)
+    if yt.shape[-1] == 1:
+        # class0=bg, class1=fg。(ひっくり返るので要注意)
+        cm = np.array(
+            [
+                # negative,  positive
+                [np.sum(tn), np.sum(fp)],  # gt negative
+                [np.sum(fn), np.sum(tp)],  # gt positive
+            ]
+        )
+    else:
+        assert yt.shape[-1] >= 2
+        num_classes = yt.shape[-1]
+        yt_c = yt.argmax(axis=-1).astype(np.int64)
+        yp_c = yp.argmax(axis=-1).astype(np.int64)
+        cm = np.bincount(
+            (yt_c * num_classes + yp_c).ravel(), minlength=num_classes ** 2
+        ).reshape((num_classes, num_classes))
+    return tp, fp, tn, fn, gp, pp, cm
@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 
 import pytoolkit as tk
 
@@ -17,3 +18,59 @@ def test_print_ss_metrics_multi():
     y_pred = np.zeros((2, 32, 32, 3))
     y_pred[:, :16, :16, :] = 1  # iou=0.25
     tk.evaluations.print_ss_metrics(y_true, y_pred)
+
+
+@pytest.mark.parametrize("n_jobs", [-1, -2, -1000, 1])
+def test_evaluate_ss_multi(n_jobs):
+    rng = np.random.RandomState(123)
+    y_true = rng.uniform(size=(4, 16, 16, 3))
+    y_pred = rng.uniform(size=(4, 16, 16, 3))
+    evals = tk.evaluations.evaluate_ss(
+        (y for y in y_true), (y for y in y_pred), n_jobs=n_jobs
+    )
+    yt_c = y_true.argmax(axis=-1)
+    yp_c = y_pred.argmax(axis=-1)
+    inter = [np.sum((yt_c == c) & (yp_c == c)) for c in range(3)]
+    union = [np.sum((yt_c == c) | (yp_c == c)) for c in range(3)]
+    assert evals["iou"] == pytest.approx(np.array(inter) / union)
+    assert evals["acc"] == pytest.approx(np.mean(yt_c == yp_c))
+
+
+def test_ss_accumulator():
+    rng = np.random.RandomState(123)
+    y_true = rng.uniform(size=(6, 16, 16, 3)) ** 4
+    y_pred = rng.uniform(size=(6, 16, 16, 3)) ** 4
+    y_true[:3, :, :, 0] = 0  # 答えが空のケース
+    y_pred[:2, :, :, 0] = 0
+
+    accumulator = tk.evaluations.SSAccumulator(multilabel=True)
+    for i in range(0, 6, 4):
+        accumulator.update(y_true[i : i + 4], y_pred[i : i + 4])
+    evals = accumulator.result()
+
+    # 画像毎・クラス毎の値から定義通りに算出したものと比較する
+    p_true = y_true >= 0.5
+    p_pred = y_pred >= 0.5
+    tp = np.sum(p_true & p_pred, axis=(1, 2))  # (N, C)
+    fp = np.sum(~p_true & p_pred, axis=(1, 2))  # (N, C)
+    fn = np.sum(p_true & ~p_pred, axis=(1, 2))  # (N, C)
+    gp = np.sum(p_true, axis=(1, 2))  # (N, C)
+    pp = np.sum(p_pred, axis=(1, 2))  # (N, C)
+    fg_mask = gp > 0
+    assert 0 < np.sum(fg_mask) < fg_mask.size  # 空のケースとそうでないケースが両方ある
+    sample_iou = tp / (tp + fp + fn + 1e-7)
+    iou_score = np.mean(
+        [
+            np.mean((fg_mask & (sample_iou > th)) | (~fg_mask & (pp <= 0)))
+            for th in np.arange(0.5, 1.0, 0.05)
+        ]
+    )
+    assert evals["iou_score"] == pytest.approx(iou_score)
+    assert evals["dice"] == pytest.approx(2 * np.mean(tp / (gp + pp + 1e-7)))
+    assert evals["fg_iou"] == pytest.approx(np.mean(sample_iou[fg_mask]))
+    assert evals["bg_acc"] == pytest.approx(np.mean(pp[~fg_mask] <= 0))
+
+    # evaluate_ssとも一致する
+    expected = tk.evaluations.evaluate_ss(y_true, y_pred, multilabel=True)
+    for key, value in expected.items():
+        assert evals[key] == pytest.approx(value), key
@@ -7,7 +7,11 @@ Horovodに対応した簡単なwrapperなど。
 """
 from __future__ import annotations
 
+import functools
+import inspect
+import itertools
 import pathlib
+import threading
 import typing
 
 import numpy as np
@@ -77,22 +81,240 @@ def load_weights(
         raise RuntimeError(f"{path} is not found.")
 
 
+def load_predictor(path: tk.typing.PathLike, num_threads: int = None) -> Predictor:
+    """変換済みのモデル(*.tflite, *.onnx)の読み込み。
+
+    戻り値はpredict・predict_on_batchを持つので、
+    tk.models.predictやpredict_flowなどにtf.kerasのモデルの代わりに渡せる。
+
+    Args:
+        path: モデルのパス
+        num_threads: 推論に使うスレッド数 (Noneならランタイムの既定値)
+
+    Returns:
+        TFLitePredictorまたはONNXPredictor
+
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".tflite":
+        return TFLitePredictor(path, num_threads=num_threads)
+    elif path.suffix == ".onnx":
+        return ONNXPredictor(path, num_threads=num_threads)
+    raise ValueError(f"Invalid model format: {path}")
+
+
+class Predictor:
+    """変換済みのモデルをtf.kerasのモデルと同様に推論に使うためのクラスのインターフェース。"""
+
+    def predict_on_batch(self, X: ModelIOType) -> ModelIOType:
+        """ミニバッチ1個分の推論。
+
+        Args:
+            X: 入力データ (ndarray or list or dict)
+
+        Returns:
+            推論結果 (出力が複数の場合はlist)
+
+        """
+        raise NotImplementedError()
+
+    def predict(
+        self,
+        x,
+        batch_size: int = 32,
+        verbose: int = 0,
+        steps: int = None,
+        callbacks: list = None,
+    ) -> ModelIOType:
+        """推論。(tf.keras.models.Model.predictの主な引数に対応)
+
+        Args:
+            x: 入力データ。ndarray or list or dictか、ミニバッチのiterable(tf.data.Datasetなど)。
+            batch_size: xがiterableでない場合のバッチサイズ
+            verbose: プログレスバーを表示するか否か
+            steps: 処理するミニバッチ数 (Noneなら全部)
+            callbacks: コールバック
+
+        Returns:
+            推論結果
+
+        """
+        callbacks = callbacks or []
+        if isinstance(x, (np.ndarray, list, dict)):
+            data_size = len(_first_output(x))
+            batches: typing.Iterable = (
+                _slice_outputs(x, i, i + batch_size)
+                for i in range(0, data_size, batch_size)
+            )
+            total: typing.Optional[int] = -(-data_size // batch_size)
+        else:
+            batches = x
+            total = steps
+        if steps is not None:
+            batches = itertools.islice(batches, steps)
+
+        for cb in callbacks:
+            cb.on_predict_begin()
+        pred_list = []
+        for batch, X in enumerate(
+            tk.utils.tqdm(batches, desc="predict", total=total, disable=verbose < 1)
+        ):
+            for cb in callbacks:
+                cb.on_predict_batch_begin(batch)
+            pred_list.append(self.predict_on_batch(_to_numpy(X)))
+            for cb in callbacks:
+                cb.on_predict_batch_end(batch)
+        for cb in callbacks:
+            cb.on_predict_end()
+        return _map_outputs(lambda *p: np.concatenate(p, axis=0), *pred_list)
+
+
+class TFLitePredictor(Predictor):
+    """TensorFlow Liteのモデルによる推論。
+
+    バッチサイズが変わった場合は入力テンソルをリサイズする。
+    INT8などの量子化された入出力はfloatとの間で変換する。
+
+    Args:
+        path: モデルのパス
+        num_threads: 推論に使うスレッド数 (Noneならランタイムの既定値)
+
+    """
+
+    def __init__(self, path: tk.typing.PathLike, num_threads: int = None):
+        kwargs = {} if num_threads is None else {"num_threads": num_threads}
+        self.interpreter = tf.lite.Interpreter(model_path=str(path), **kwargs)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        # Interpreterはスレッドセーフではないので排他する
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, X: ModelIOType) -> ModelIOType:
+        X_list = _to_input_list(X, [d["name"] for d in self.input_details])
+        with self._lock:
+            resized = False
+            for detail, x in zip(self.input_details, X_list):
+                if tuple(detail["shape"]) != x.shape:
+                    self.interpreter.resize_tensor_input(detail["index"], x.shape)
+                    resized = True
+            if resized:
+                self.interpreter.allocate_tensors()
+                self.input_details = self.interpreter.get_input_details()
+                self.output_details = self.interpreter.get_output_details()
+            for detail, x in zip(self.input_details, X_list):
+                self.interpreter.set_tensor(detail["index"], _quantize(x, detail))
+            self.interpreter.invoke()
+            outputs = [
+                _dequantize(self.interpreter.get_tensor(detail["index"]), detail)
+                for detail in self.output_details
+            ]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+class ONNXPredictor(Predictor):
+    """ONNX Runtimeによる推論。
+
+    Args:
+        path: モデルのパス
+        num_threads: 推論に使うスレッド数 (Noneならランタイムの既定値)
+
+    """
+
+    def __init__(self, path: tk.typing.PathLike, num_threads: int = None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(str(path), options)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.input_types = [
+            np.float16 if i.type == "tensor(float16)" else np.float32
+            for i in self.session.get_inputs()
+        ]
+
+    def predict_on_batch(self, X: ModelIOType) -> ModelIOType:
+        X_list = _to_input_list(X, self.input_names)
+        feed = {
+            name: x.astype(t, copy=False)
+            for name, x, t in zip(self.input_names, X_list, self.input_types)
+        }
+        outputs = self.session.run(None, feed)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+def _to_numpy(X):
+    """tf.data.Datasetなどから得たミニバッチをndarray(のlist or dict)にする。"""
+    if isinstance(X, tuple):
+        X = list(X)
+    return _map_outputs(np.asarray, X)
+
+
+def _to_input_list(X: ModelIOType, input_names: typing.List[str]) -> list:
+    """入力データを変換済みモデルの入力順のリストにする。
+
+    dictの場合はキーと一致する名前(無ければ":"より前がキーで終わる名前)の入力に対応付ける。
+
+    """
+    if isinstance(X, dict):
+        X_list = []
+        for name in input_names:
+            key = name if name in X else None
+            if key is None:
+                key = next((k for k in X if name.split(":")[0].endswith(k)), None)
+            assert key is not None, f"Input not found: {name} (keys={list(X)})"
+            X_list.append(X[key])
+    elif isinstance(X, (list, tuple)):
+        X_list = list(X)
+    else:
+        X_list = [X]
+    assert len(X_list) == len(
+        input_names
+    ), f"Invalid input count: {len(X_list)} != {len(input_names)}"
+    return [np.asarray(x) for x in X_list]
+
+
+def _quantize(x: np.ndarray, detail: dict) -> np.ndarray:
+    """TFLiteの量子化された入力への変換。"""
+    dtype = detail["dtype"]
+    scale, zero_point = detail.get("quantization", (0.0, 0))
+    if np.issubdtype(dtype, np.integer) and scale != 0:
+        info = np.iinfo(dtype)
+        x = np.clip(np.round(x / scale + zero_point), info.min, info.max)
+    return x.astype(dtype, copy=False)
+
+
+def _dequantize(x: np.ndarray, detail: dict) -> np.ndarray:
+    """TFLiteの量子化された出力からの変換。"""
+    scale, zero_point = detail.get("quantization", (0.0, 0))
+    if np.issubdtype(x.dtype, np.integer) and scale != 0:
+        return (x.astype(np.float32) - zero_point) * np.float32(scale)
+    return x
+
+
 def save(
     model: tf.keras.models.Model,
     path: tk.typing.PathLike,
     mode: str = "hdf5",
     include_optimizer: bool = False,
+    representative_set: tk.data.Dataset = None,
+    representative_data_loader: tk.data.DataLoader = None,
 ):
     """モデルの保存。
 
     Args:
         model: モデル
         path: 保存先。saved_modelの場合はディレクトリ
-        mode: "hdf5", "saved_model", "onnx", "tflite"のいずれか
+        mode: "hdf5", "saved_model", "onnx", "tflite", "tflite_int8"のいずれか
         include_optimizer: HDF5形式で保存する場合にoptimizerを含めるか否か
+        representative_set: "tflite_int8"の場合の量子化のキャリブレーション用データ
+        representative_data_loader: representative_setの読み込み (Data Augmentation無しのもの)
+
+    "tflite_int8"は全演算をINT8にするpost-training quantization。(入出力はfloatのまま)
 
     """
-    assert mode in ("hdf5", "saved_model", "onnx", "tflite")
+    assert mode in ("hdf5", "saved_model", "onnx", "tflite", "tflite_int8")
     path = pathlib.Path(path)
     if tk.hvd.is_master():
         with tk.log.trace_scope(f"save({path})"):
@@ -116,11 +338,46 @@ def save(
                 path.parent.mkdir(parents=True, exist_ok=True)
                 with path.open("wb") as f:
                     f.write(tflite_model)
+            elif mode == "tflite_int8":
+                assert representative_set is not None
+                assert representative_data_loader is not None
+                converter = tf.lite.TFLiteConverter.from_keras_model(model)
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = functools.partial(
+                    _representative_dataset,
+                    model,
+                    representative_set,
+                    representative_data_loader,
+                )
+                converter.target_spec.supported_ops = [
+                    tf.lite.OpsSet.TFLITE_BUILTINS_INT8
+                ]
+                tflite_model = converter.convert()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with path.open("wb") as f:
+                    f.write(tflite_model)
             else:
                 raise ValueError(f"Invalid save format: {mode}")
     tk.hvd.barrier()
 
 
+def _representative_dataset(
+    model: tf.keras.models.Model,
+    dataset: tk.data.Dataset,
+    data_loader: tk.data.DataLoader,
+) -> typing.Iterator[typing.List[np.ndarray]]:
+    """TFLiteの量子化のキャリブレーション用に、1件ずつモデルの入力順のリストを返す。"""
+    iterator = data_loader.iter(dataset, without_label=True)
+    for X_batch in iterator.ds:
+        if isinstance(X_batch, dict):
+            X_batch = [X_batch[name] for name in model.input_names]
+        elif not isinstance(X_batch, (list, tuple)):
+            X_batch = [X_batch]
+        X_batch = [np.asarray(x, dtype=np.float32) for x in X_batch]
+        for i in range(len(X_batch[0])):
+            yield [x[i : i + 1] for x in X_batch]
+
+
 def summary(model: tf.keras.models.Model):
     """summaryを実行するだけ。"""
     model.summary(
@@ -159,9 +416,24 @@ def compile(
     loss: LossType = None,
     metrics: MetricsType = None,
     experimental_run_tf_function: bool = None,
+    jit_compile: bool = None,
+    steps_per_execution: int = None,
     **kwargs,
 ):  # pylint: disable=redefined-builtin
-    """compileするだけ。"""
+    """compileするだけ。
+
+    Args:
+        model: モデル
+        optimizer: オプティマイザ
+        loss: 損失関数
+        metrics: メトリクス
+        experimental_run_tf_function: model.compileのパラメータ (Noneなら適当に決める)
+        jit_compile: XLAでコンパイルするならTrue。(Noneなら既定のまま)
+                     TensorFlowが未対応の場合は警告して無視する。
+        steps_per_execution: 1回のtf.function呼び出しで処理するステップ数。(Noneなら既定のまま)
+                             小さいモデルでステップ毎のオーバーヘッドを減らしたい場合用。
+
+    """
     with tk.log.trace_scope("compile"):
         if tk.hvd.initialized():
             optimizer = tf.keras.optimizers.get(optimizer)
@@ -175,18 +447,32 @@ def compile(
         else:
             if experimental_run_tf_function is None:
                 experimental_run_tf_function = True
+        execution_kwargs = _execution_compile_kwargs(
+            model, jit_compile, steps_per_execution
+        )
         model.compile(
             optimizer=optimizer,
             loss=loss,
             metrics=metrics,
             experimental_run_tf_function=experimental_run_tf_function,
+            **execution_kwargs,
             **kwargs,
         )
+        # model.compileで指定できなかった分
+        _configure_execution(
+            model,
+            jit_compile if "jit_compile" not in execution_kwargs else None,
+            steps_per_execution
+            if "steps_per_execution" not in execution_kwargs
+            else None,
+        )
 
 
 def recompile(model: tf.keras.models.Model):
     """optimizerなどを再利用してコンパイル。"""
     with tk.log.trace_scope("recompile"):
+        # compileで既定値に戻ってしまうので、jit_compileとsteps_per_executionは引き継ぐ
+        jit_compile, steps_per_execution = _get_execution_config(model)
         # Horovod: Specify `experimental_run_tf_function=False` to ensure TensorFlow
         # uses hvd.DistributedOptimizer() to compute gradients.
         model.compile(
@@ -195,6 +481,76 @@ def recompile(model: tf.keras.models.Model):
             metrics=model.metrics,
             experimental_run_tf_function=False,
         )
+        _configure_execution(model, jit_compile, steps_per_execution)
+
+
+def _execution_compile_kwargs(
+    model: tf.keras.models.Model,
+    jit_compile: typing.Optional[bool],
+    steps_per_execution: typing.Optional[int],
+) -> dict:
+    """jit_compileとsteps_per_executionのうち、model.compileに渡せるもの。(TensorFlowのバージョン依存)"""
+    params = inspect.signature(model.compile).parameters
+    kwargs: dict = {}
+    if jit_compile is not None and "jit_compile" in params:
+        kwargs["jit_compile"] = jit_compile
+    if steps_per_execution is not None and "steps_per_execution" in params:
+        kwargs["steps_per_execution"] = steps_per_execution
+    return kwargs
+
+
+def _get_execution_config(
+    model: tf.keras.models.Model,
+) -> typing.Tuple[typing.Optional[bool], typing.Optional[int]]:
+    """モデルのjit_compileとsteps_per_executionの現在値。(不明ならNone)"""
+    jit_compile = getattr(model, "_jit_compile", None)
+    steps_per_execution = getattr(model, "_steps_per_execution", None)
+    if steps_per_execution is not None:
+        steps_per_execution = int(tf.keras.backend.get_value(steps_per_execution))
+    return jit_compile, steps_per_execution
+
+
+def _configure_execution(
+    model: tf.keras.models.Model,
+    jit_compile: typing.Optional[bool],
+    steps_per_execution: typing.Optional[int],
+) -> None:
+    """コンパイル済み・未コンパイルのモデルのjit_compileとsteps_per_executionを変更する。
+
+    Noneのものは変更しない。
+    TensorFlowが未対応の場合は警告して無視する。
+    (tf.config.optimizer.set_jitはプロセス全体に効いてしまうので代用しない)
+
+    """
+    if (jit_compile, steps_per_execution) == (None, None):
+        return
+    if (jit_compile, steps_per_execution) == _get_execution_config(model):
+        return
+    changed = False
+    if steps_per_execution is not None:
+        assert steps_per_execution >= 1
+        if hasattr(model, "_configure_steps_per_execution"):
+            model._configure_steps_per_execution(  # pylint: disable=protected-access
+                steps_per_execution
+            )
+            changed = True
+        elif steps_per_execution != 1:
+            tk.log.get(__name__).warning(
+                f"steps_per_execution is not supported (TensorFlow {tf.__version__})"
+            )
+    if jit_compile is not None:
+        if hasattr(model, "_jit_compile"):
+            model._jit_compile = jit_compile  # pylint: disable=protected-access
+            changed = True
+        elif jit_compile:
+            tk.log.get(__name__).warning(
+                f"jit_compile is not supported (TensorFlow {tf.__version__})"
+            )
+    if changed:
+        # 設定を反映させるためにtf.functionを作り直させる
+        model.train_function = None
+        model.test_function = None
+        model.predict_function = None
 
 
 def fit(
@@ -204,12 +560,18 @@ def fit(
     val_set: tk.data.Dataset = None,
     val_data_loader: tk.data.DataLoader = None,
     validation_freq: typing.Union[int, typing.Sequence[int], str, None] = "auto",
+    max_validation_time_ratio: float = 0.1,
+    exact_validation: bool = False,
     class_weight: dict = None,
     epochs: int = 1800,
     callbacks: list = None,
     verbose: int = 1,
     initial_epoch: int = 0,
     num_replicas_in_sync: int = 1,
+    jit_compile: bool = None,
+    steps_per_execution: int = None,
+    resume_dir: tk.typing.PathLike = None,
+    resume_freq: int = 1,
 ):
     """学習。
 
@@ -220,20 +582,35 @@ def fit(
         val_set: 検証データ。Noneなら省略。
         val_data_loader: 検証データの読み込み
         validation_freq: 検証を行うエポック数の間隔、またはエポック数のリスト。0ならvalidationしない(独自仕様)。"auto"なら適当に決める(独自仕様)。
+                         "adaptive"なら実測した時間から決める(独自仕様)。(tk.callbacks.AdaptiveValidation)
+        max_validation_time_ratio: validation_freq="adaptive"の場合の、全体の時間に対する検証の時間の割合の上限
+        exact_validation: Horovod・tf.distribute使用時に、検証データをシャッフルして3倍にオーバーサンプリングする代わりに
+                          ワーカー間で重複無く分割して厳密に検証するならTrue。(tk.models.evaluateのexact=Trueと同じ)
         class_weight: クラスごとの重みのdict
         epochs: エポック数
         callbacks: コールバック。EpochLoggerとErrorOnNaNとhorovod関連は自動追加。
         verbose: 1ならプログレスバー表示、2ならepoch毎の結果だけ表示。
         initial_epoch: 学習を開始するエポック数 - 1
         num_replicas_in_sync: tf.distribute使用時の並列数(バッチサイズに掛け算する)
+        jit_compile: XLAでコンパイルするならTrue。(Noneならcompile時の設定のまま)
+        steps_per_execution: 1回のtf.function呼び出しで処理するステップ数。(Noneならcompile時の設定のまま)
+                             ステップ数はnum_replicas_in_sync倍したバッチサイズで数えたもの。
+                             エポックの端数は最後の呼び出しで調整される。
+        resume_dir: 途中再開用の状態の保存先ディレクトリ。(Noneなら保存しない)
+                    保存されたものがあればそこから再開する。(中断時はresume_freqエポック分までの損失で済む)
+        resume_freq: 途中再開用の状態を保存するエポック数の間隔
 
     """
+    _configure_execution(model, jit_compile, steps_per_execution)
     use_horovod = tk.hvd.size() > 1
     if use_horovod:
         assert num_replicas_in_sync <= 1
     # Horovodはそれぞれのワーカーが勝手にvalidateするのでshuffleする必要がある。
     # tf.distributeも(少なくともTF 2.0では)端数が出てしまうとバグるのでshuffleすることにする。
-    shuffled_validate = use_horovod or num_replicas_in_sync > 1
+    # (exact_validation=Trueなら重複無く分割して端数は水増しした上で評価時に除外するのでshuffleしない)
+    shuffled_validate = (
+        use_horovod or num_replicas_in_sync > 1
+    ) and not exact_validation
     # shuffleするならデータ数分だけでは全体をカバーできないため3倍にオーバーサンプリングする。
     # (horovodのexamplesの真似: <https://github.com/horovod/horovod/blob/9bdd70d/examples/keras_mnist_advanced.py#L112,L115>)
     val_scale = 3 if shuffled_validate else 1
@@ -255,24 +632,68 @@ def fit(
     if val_set is not None:
         assert val_data_loader is not None
 
+    resume_kwargs: typing.Dict[str, typing.Any] = {}
+    resume_callback = None
+    if resume_dir is not None:
+        resume_callback = tk.callbacks.ResumeCheckpoint(resume_dir, freq=resume_freq)
+        resumed_epoch = resume_callback.restore(model)
+        # 中断前と同じ順番でデータを読み込むため、seedを固定して学習済みのエポック分を読み飛ばす
+        resume_kwargs["seed"] = resume_callback.seed + tk.hvd.rank()
+        resume_kwargs["initial_epoch"] = max(resumed_epoch - initial_epoch, 0)
+        initial_epoch = max(initial_epoch, resumed_epoch)
+
     train_iterator = train_data_loader.iter(
         train_set,
         shuffle=True,
         use_horovod=use_horovod,
         num_replicas_in_sync=num_replicas_in_sync,
+        **resume_kwargs,
     )
-    val_iterator = (
-        val_data_loader.iter(
-            val_set,
-            shuffle=shuffled_validate,
-            use_horovod=use_horovod,
-            num_replicas_in_sync=num_replicas_in_sync,
-        )
-        if val_set is not None and val_data_loader is not None
-        else None
-    )
-
     callbacks = make_callbacks(callbacks, training=True)
+    val_iterator = None
+    validation_callback: typing.Optional[tk.callbacks.Validation] = None
+    if val_set is not None and val_data_loader is not None:
+        if exact_validation:
+            evaluate_fn = functools.partial(
+                _evaluate_exact,
+                model,
+                val_set,
+                val_data_loader,
+                prefix="val_",
+                use_horovod=use_horovod,
+                num_replicas_in_sync=num_replicas_in_sync,
+            )
+        else:
+            val_iterator = val_data_loader.iter(
+                val_set,
+                shuffle=shuffled_validate,
+                use_horovod=use_horovod,
+                num_replicas_in_sync=num_replicas_in_sync,
+            )
+            evaluate_fn = functools.partial(
+                _evaluate_ds,
+                model,
+                val_iterator.ds,
+                val_iterator.steps * val_scale,
+                prefix="val_",
+            )
+        if validation_freq == "adaptive":
+            validation_callback = tk.callbacks.AdaptiveValidation(
+                evaluate_fn, max_time_ratio=max_validation_time_ratio
+            )
+        elif exact_validation:
+            validation_callback = tk.callbacks.Validation(
+                evaluate_fn, validation_freq=validation_freq or 1
+            )
+    if validation_callback is not None:
+        # 他のcallbackが検証結果を参照できるように先頭に置く
+        callbacks.insert(0, validation_callback)
+        val_iterator = None  # model.fitでは検証しない
+        validation_freq = None
+    elif validation_freq == "adaptive":
+        validation_freq = None
+    if resume_callback is not None:
+        callbacks.append(resume_callback)
 
     fit_kwargs = {}
     if validation_freq is not None:
@@ -339,6 +760,8 @@ def predict(
     use_horovod: bool = False,
     on_batch_fn: OnBatchFnType = None,
     num_replicas_in_sync: int = 1,
+    jit_compile: bool = None,
+    steps_per_execution: int = None,
 ) -> ModelIOType:
     """推論。
 
@@ -353,11 +776,15 @@ def predict(
         flow: 結果をgeneratorで返すならTrue
         desc: flow時のtqdmのdesc
         num_replicas_in_sync: tf.distribute使用時の並列数(バッチサイズに掛け算する)
+        jit_compile: XLAでコンパイルするならTrue。(Noneなら既定のまま)
+        steps_per_execution: 1回のtf.function呼び出しで処理するステップ数。(Noneなら既定のまま)
+                             on_batch_fnを指定した場合はミニバッチ毎の処理になるため効果無し。
 
     Returns:
         推論結果。
 
     """
+    _configure_execution(model, jit_compile, steps_per_execution)
     with tk.log.trace_scope("predict"):
         verbose = verbose if tk.hvd.is_master() else 0
         callbacks = make_callbacks(callbacks, training=False)
@@ -366,7 +793,7 @@ def predict(
             dataset, without_label=True, num_replicas_in_sync=num_replicas_in_sync
         )
         if on_batch_fn is not None:
-            gen = _predict_flow(
+            batches = _predict_batches(
                 model=model,
                 iterator=iterator,
                 callbacks=callbacks,
@@ -374,13 +801,7 @@ def predict(
                 on_batch_fn=on_batch_fn,
                 desc="predict",
             )
-            results = list(gen)
-            if isinstance(results[0], list):  # multiple output
-                values = [
-                    np.array([r[i] for r in results]) for i in range(len(results[0]))
-                ]
-            else:
-                values = np.array(results)
+            values = _predict_into_buffers(batches, iterator.data_size)
         else:
             values = model.predict(
                 iterator.ds, steps=iterator.steps, verbose=verbose, callbacks=callbacks,
@@ -414,6 +835,7 @@ def predict_flow(
 
     Returns:
         推論結果。サンプルごとのgenerator。
+        (tk.evaluations.Accumulator.update_flow()に渡せば全体をメモリに載せずに評価できる)
 
     """
     with tk.log.trace_scope("predict"):
@@ -437,6 +859,29 @@ def _predict_flow(
     on_batch_fn: OnBatchFnType = None,
     desc: str = "predict",
 ):
+    for pred_batch in _predict_batches(
+        model, iterator, callbacks, verbose, on_batch_fn, desc
+    ):
+        if isinstance(pred_batch, list):  # multiple output
+            assert len(pred_batch) >= 2
+            for b in zip(*pred_batch):
+                yield list(b)
+        elif isinstance(pred_batch, dict):  # named output
+            for i in range(len(next(iter(pred_batch.values())))):
+                yield {k: v[i] for k, v in pred_batch.items()}
+        else:
+            yield from pred_batch
+
+
+def _predict_batches(
+    model: tf.keras.models.Model,
+    iterator: tk.data.Iterator,
+    callbacks: list,
+    verbose: int,
+    on_batch_fn: OnBatchFnType = None,
+    desc: str = "predict",
+) -> typing.Iterator[ModelIOType]:
+    """ミニバッチ毎の推論結果を返すgenerator。"""
     on_batch_fn = on_batch_fn or _predict_on_batch
     for cb in callbacks:
         cb.on_predict_begin()
@@ -449,19 +894,56 @@ def _predict_flow(
         pred_batch = on_batch_fn(model, X.numpy())
         for cb in callbacks:
             cb.on_predict_batch_end(batch)
-
-        if isinstance(pred_batch, list):  # multiple output
-            assert len(pred_batch) >= 2
-            for b in zip(*pred_batch):
-                yield list(b)
-        else:
-            yield from pred_batch
-
+        yield pred_batch
         batch += 1
     for cb in callbacks:
         cb.on_predict_end()
 
 
+def _predict_into_buffers(
+    batches: typing.Iterable[ModelIOType], data_size: int
+) -> ModelIOType:
+    """ミニバッチ毎の推論結果を、最初のバッチの形から確保した配列へ順に書き込む。"""
+    values: typing.Any = None
+    offset = 0
+    for pred_batch in batches:
+        if values is None:
+            values = _map_outputs(
+                lambda b: np.empty((data_size,) + np.shape(b)[1:], np.asarray(b).dtype),
+                pred_batch,
+            )
+        batch_size = len(_first_output(pred_batch))
+        assert (
+            offset + batch_size <= data_size
+        ), f"Too many predictions: {offset + batch_size} > {data_size}"
+
+        def _write(v, b, offset=offset):
+            v[offset : offset + batch_size] = b
+
+        _map_outputs(_write, values, pred_batch)
+        offset += batch_size
+    assert offset == data_size, f"Too few predictions: {offset} < {data_size}"
+    return values
+
+
+def _map_outputs(fn, *outputs):
+    """モデルの入出力(ndarray or list/tuple or dict)の要素毎にfnを適用する。"""
+    if isinstance(outputs[0], (list, tuple)):
+        return [fn(*o) for o in zip(*outputs)]
+    elif isinstance(outputs[0], dict):
+        return {k: fn(*[o[k] for o in outputs]) for k in outputs[0]}
+    return fn(*outputs)
+
+
+def _first_output(output):
+    """モデルの出力(ndarray or list or dict)の最初の要素を返す。"""
+    if isinstance(output, list):
+        return output[0]
+    elif isinstance(output, dict):
+        return next(iter(output.values()))
+    return output
+
+
 def _predict_on_batch(model: tf.keras.models.Model, X):
     return model.predict_on_batch(X)
 
@@ -475,6 +957,9 @@ def evaluate(
     prefix: str = "",
     use_horovod: bool = False,
     num_replicas_in_sync: int = 1,
+    jit_compile: bool = None,
+    steps_per_execution: int = None,
+    exact: bool = False,
 ) -> typing.Dict[str, float]:
     """評価。
 
@@ -487,13 +972,31 @@ def evaluate(
         prefix: メトリクス名の接頭文字列
         use_horovod: MPIによる分散処理をするか否か
         num_replicas_in_sync: tf.distribute使用時の並列数(バッチサイズに掛け算する)
+        jit_compile: XLAでコンパイルするならTrue。(Noneならcompile時の設定のまま)
+        steps_per_execution: 1回のtf.function呼び出しで処理するステップ数。(Noneならcompile時の設定のまま)
+        exact: 分散処理時にワーカー毎の件数の違いや端数を考慮して厳密に評価するならTrue。
+               ワーカー間で重複無く分割し、tf.distribute使用時の端数は最初のサンプルの複製で埋めて
+               評価時に除外し、Horovod使用時はメトリクスの状態をallreduceする。
+               (AUCなども厳密な値になる。TensorFlow 2.2以降のみ)
 
     Returns:
         メトリクス名と値のdict
 
     """
+    _configure_execution(model, jit_compile, steps_per_execution)
     with tk.log.trace_scope("evaluate"):
         verbose = verbose if tk.hvd.is_master() else 0
+        if exact:
+            return _evaluate_exact(
+                model,
+                dataset,
+                data_loader,
+                prefix=prefix,
+                use_horovod=use_horovod,
+                num_replicas_in_sync=num_replicas_in_sync,
+                verbose=verbose,
+                callbacks=callbacks,
+            )
         callbacks = make_callbacks(callbacks, training=False)
         dataset = tk.hvd.split(dataset) if use_horovod else dataset
         iterator = data_loader.iter(dataset, num_replicas_in_sync=num_replicas_in_sync)
@@ -501,11 +1004,86 @@ def evaluate(
             iterator.ds, steps=iterator.steps, verbose=verbose, callbacks=callbacks,
         )
         values = tk.hvd.allreduce(values) if use_horovod else values
-        if len(model.metrics_names) == 1:
-            evals = {prefix + model.metrics_names[0]: values}
-        else:
-            evals = dict(zip([prefix + n for n in model.metrics_names], values))
-        return evals
+        return _to_evals(model, values, prefix)
+
+
+def _evaluate_ds(model, ds, steps, prefix="", verbose=0, callbacks=None):
+    """tf.data.Datasetで評価してメトリクス名と値のdictを返す。"""
+    values = model.evaluate(ds, steps=steps, verbose=verbose, callbacks=callbacks)
+    return _to_evals(model, values, prefix)
+
+
+def _evaluate_exact(
+    model,
+    dataset,
+    data_loader,
+    prefix="",
+    use_horovod=False,
+    num_replicas_in_sync=1,
+    verbose=0,
+    callbacks=None,
+):
+    """ワーカー間で重複無く分割して厳密に評価する。(evaluateのexact=True)
+
+    端数は最初のサンプルの複製で埋めてsample_weightを0にし、評価時にその分を除外する。
+    Horovod使用時はメトリクスの状態(tp・fpや合計・件数など)をallreduceしてから算出するので、
+    AUCなどのサンプル毎の平均でないメトリクスも厳密な値になる。
+
+    """
+    assert hasattr(model, "test_step"), "exact=True requires TensorFlow >= 2.2"
+    callbacks = make_callbacks(callbacks, training=False)
+    indices = np.arange(len(dataset))
+    if use_horovod:
+        indices = np.array_split(indices, tk.hvd.size())[tk.hvd.rank()]
+    count = len(indices)
+    # tf.distributeは端数があるとバグるので、最初のサンプルの複製で水増しする
+    # (DataLoader.iterは2件以上必要なので、0件や1件の場合も水増しする)
+    batch_size = data_loader.batch_size * num_replicas_in_sync
+    pad = -count % batch_size if num_replicas_in_sync > 1 else 0
+    pad = max(pad, 2 - count)
+    padded_set = dataset.slice(np.concatenate([indices, np.zeros(pad, dtype=np.int64)]))
+    padded_set.weights = np.concatenate([np.ones(count), np.zeros(pad)])
+    iterator = data_loader.iter(
+        padded_set, num_replicas_in_sync=num_replicas_in_sync, with_weights=True
+    )
+
+    def _test_step(data):
+        # 重み0(水増し分)の行を除外してから損失とメトリクスを集計する
+        X, y, sample_weight = data
+        y_pred = model(X, training=False)
+        mask = sample_weight > 0
+        y, y_pred = tf.nest.map_structure(
+            lambda t: tf.boolean_mask(t, mask), (y, y_pred)
+        )
+        model.compiled_loss(y, y_pred, regularization_losses=model.losses)
+        model.compiled_metrics.update_state(y, y_pred)
+        return {m.name: m.result() for m in model.metrics}
+
+    model.test_step = _test_step
+    model.test_function = None
+    try:
+        values = model.evaluate(
+            iterator.ds, steps=iterator.steps, verbose=verbose, callbacks=callbacks
+        )
+    finally:
+        del model.test_step
+        model.test_function = None
+
+    if use_horovod:
+        # ワーカー毎のメトリクスの状態を合計してから算出し直す
+        for m in model.metrics:
+            for v in m.variables:
+                v.assign(tk.hvd.allreduce(tf.keras.backend.get_value(v), average=False))
+        values = [tf.keras.backend.get_value(m.result()) for m in model.metrics]
+    return _to_evals(model, values, prefix)
+
+
+def _to_evals(model, values, prefix):
+    """model.evaluateの戻り値をメトリクス名と値のdictにする。"""
+    if len(model.metrics_names) == 1:
+        values = values[0] if isinstance(values, list) else values
+        return {prefix + model.metrics_names[0]: values}
+    return dict(zip([prefix + n for n in model.metrics_names], values))
 
 
 def freeze_layers(
@@ -526,7 +1104,10 @@ def predict_on_batch_augmented(
     crop_size: typing.Tuple[int, int] = (3, 3),
     padding_size: typing.Tuple[int, int] = (32, 32),
     padding_mode: str = "edge",
-) -> typing.List[np.ndarray]:
+    chunk_size: int = None,
+    reduce: str = None,
+    unflip: bool = False,
+) -> ModelIOType:
     """ミニバッチ1個分の推論処理＆TTA。
 
     Args:
@@ -536,11 +1117,16 @@ def predict_on_batch_augmented(
         crop_size: 縦横のcropのパターンの数。(v, h)
         padding_size: crop前にパディングするサイズ。(v, h)
         padding_mode: パディングの種類。(np.padのmode)
+        chunk_size: 一度にモデルへ渡すTTAのパターンの数。Noneなら全パターンまとめて渡す。
+        reduce: Noneなら全パターンの推論結果を返す。"mean"なら平均、"max"なら最大を逐次集計して返す。
+        unflip: 反転したパターンの推論結果を反転し直すならTrue。(セグメンテーションなど用)
 
     Returns:
-        推論結果のリスト。
+        推論結果。reduceがNoneならshape=(パターン数, len(X_batch), ...)、
+        そうでなければshape=(len(X_batch), ...)。
 
     """
+    assert reduce in (None, "mean", "max")
     shape = X_batch.shape
     X_batch = np.pad(
         X_batch,
@@ -552,24 +1138,78 @@ def predict_on_batch_augmented(
         ),
         mode=padding_mode,
     )
-    X_batch2: list = []
-    for y in np.linspace(0, padding_size[0] * 2, crop_size[0], dtype=np.int32):
-        for x in np.linspace(0, padding_size[1] * 2, crop_size[1], dtype=np.int32):
-            X = X_batch[:, x : x + shape[1], y : y + shape[2], :]
-            X_batch2.append(X)
-            if flip[0]:
-                X_batch2.append(X[:, ::-1, :, :])
-            if flip[1]:
-                X_batch2.append(X[:, :, ::-1, :])
-            if flip[0] and flip[1]:
-                X_batch2.append(X[:, ::-1, ::-1, :])
-    result = model.predict(
-        np.concatenate(X_batch2, axis=0), batch_size=shape[0], verbose=0
-    )
-    if isinstance(result, list):  # multiple output
-        result = [
-            r.reshape((len(X_batch2), len(X_batch)) + r.shape[1:]) for r in result
-        ]
-    else:
-        result = result.reshape((len(X_batch2), len(X_batch)) + result.shape[1:])
+
+    def _variants():
+        """TTAのパターン毎の入力と反転の有無を返す。"""
+        for y in np.linspace(0, padding_size[0] * 2, crop_size[0], dtype=np.int32):
+            for x in np.linspace(0, padding_size[1] * 2, crop_size[1], dtype=np.int32):
+                X = X_batch[:, x : x + shape[1], y : y + shape[2], :]
+                yield X, (False, False)
+                if flip[0]:
+                    yield X[:, ::-1, :, :], (True, False)
+                if flip[1]:
+                    yield X[:, :, ::-1, :], (False, True)
+                if flip[0] and flip[1]:
+                    yield X[:, ::-1, ::-1, :], (True, True)
+
+    num_variants = crop_size[0] * crop_size[1] * (1 + flip[0]) * (1 + flip[1])
+    chunk_size = chunk_size or num_variants
+    variants = _variants()
+    result: typing.Any = None
+    count = 0
+    while True:
+        chunk = list(itertools.islice(variants, chunk_size))
+        if len(chunk) <= 0:
+            break
+        pred = model.predict(
+            np.concatenate([X for X, _ in chunk], axis=0),
+            batch_size=shape[0],
+            verbose=0,
+        )
+        for i, (_, flips) in enumerate(chunk):
+            p = _slice_outputs(pred, i * shape[0], (i + 1) * shape[0])
+            if unflip and any(flips):
+                p = _map_outputs(functools.partial(_unflip, flips=flips), p)
+            if reduce is None:
+                if result is None:
+                    result = _map_outputs(
+                        lambda r: np.empty((num_variants,) + r.shape, r.dtype), p
+                    )
+                _map_outputs(functools.partial(_write_at, index=count), result, p)
+            elif result is None:
+                result = _map_outputs(np.copy, p)
+            elif reduce == "mean":
+                _map_outputs(_add_inplace, result, p)
+            else:
+                _map_outputs(_maximum_inplace, result, p)
+            count += 1
+    assert count == num_variants
+    if reduce == "mean":
+        result = _map_outputs(lambda r: r / count, result)
     return result
+
+
+def _slice_outputs(output, start: int, end: int):
+    """モデルの出力(ndarray or list or dict)の一部を返す。"""
+    return _map_outputs(lambda r: r[start:end], output)
+
+
+def _unflip(r: np.ndarray, flips: typing.Tuple[bool, bool]) -> np.ndarray:
+    """TTAで反転した推論結果(shape=(N, H, W, ...))を元に戻す。"""
+    if flips[0]:
+        r = r[:, ::-1]
+    if flips[1]:
+        r = r[:, :, ::-1]
+    return r
+
+
+def _write_at(a: np.ndarray, b: np.ndarray, index: int):
+    a[index] = b
+
+
+def _add_inplace(a: np.ndarray, b: np.ndarray):
+    a += b
+
+
+def _maximum_inplace(a: np.ndarray, b: np.ndarray):
+    np.maximum(a, b, out=a)
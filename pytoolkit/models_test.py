@@ -1,3 +1,5 @@
+import shutil
+
 import numpy as np
 import pytest
 import tensorflow as tf
@@ -5,7 +7,23 @@ import tensorflow as tf
 import pytoolkit as tk
 
 
-@pytest.mark.parametrize("mode", ["hdf5", "saved_model", "onnx", "tflite"])
+def _regression_data():
+    """学習・評価のテスト用の小さいデータ。(端数が出るように10件をバッチサイズ4で)"""
+    X = np.random.uniform(size=(10, 3)).astype(np.float32)
+    y = X.sum(axis=-1, keepdims=True)
+    return tk.data.Dataset(X, y), tk.data.DataLoader(batch_size=4)
+
+
+def _dense_model(**kwargs):
+    """_regression_data用のDense1層だけのモデル。"""
+    inputs = x = tf.keras.layers.Input((3,))
+    x = tf.keras.layers.Dense(1, **kwargs)(x)
+    return tf.keras.models.Model(inputs, x)
+
+
+@pytest.mark.parametrize(
+    "mode", ["hdf5", "saved_model", "onnx", "tflite", "tflite_int8"]
+)
 def test_save(tmpdir, mode):
     if mode == "onnx":
         pytest.skip("keras2onnxのtf2対応待ち")
@@ -18,15 +36,29 @@ def test_save(tmpdir, mode):
     x = tk.layers.Resize2D((8, 8))(x)
     x = tk.layers.GeM2D()(x)
     model = tf.keras.models.Model(inputs, x)
-    tk.models.save(model, path, mode=mode)
+    if mode == "tflite_int8":
+        representative_set = tk.data.Dataset(
+            np.random.uniform(size=(4, 32, 32, 3)).astype(np.float32)
+        )
+        tk.models.save(
+            model,
+            path,
+            mode=mode,
+            representative_set=representative_set,
+            representative_data_loader=tk.data.DataLoader(batch_size=2),
+        )
+    else:
+        tk.models.save(model, path, mode=mode)
 
 
-@pytest.mark.parametrize("output_count", [1, 2])
+@pytest.mark.parametrize("output_count", [1, 2, "dict"])
 def test_predict_flow(output_count):
     def on_batch(model, X_batch):
         assert model is None
         if output_count == 1:
             return X_batch
+        elif output_count == "dict":
+            return {"a": X_batch, "b": X_batch * 2}
         else:
             return [X_batch, X_batch]
 
@@ -39,11 +71,26 @@ def test_predict_flow(output_count):
     )
     if output_count == 1:
         assert (result == dataset.data).all()
+    elif output_count == "dict":
+        assert (result["a"] == dataset.data).all()
+        assert (result["b"] == dataset.data * 2).all()
     else:
         assert len(result) == 2
         assert (result[0] == dataset.data).all()
         assert (result[1] == dataset.data).all()
 
+    results = list(
+        tk.models.predict_flow(
+            model=None,
+            dataset=dataset,
+            data_loader=tk.data.DataLoader(batch_size=2),
+            on_batch_fn=on_batch,
+        )
+    )
+    assert len(results) == len(dataset)
+    if output_count == "dict":
+        assert results[3] == {"a": 3, "b": 6}
+
 
 @pytest.mark.parametrize("output_count", [1, 2])
 def test_predict_on_batch_augmented(output_count):
@@ -64,3 +111,157 @@ def test_predict_on_batch_augmented(output_count):
         assert len(result) == output_count
         assert result[0].shape == (2 * 3 * 3, 4, 32, 32, 3)
         assert result[1].shape == (2 * 3 * 3, 4, 32, 32, 3)
+
+
+@pytest.mark.parametrize("reduce", ["mean", "max"])
+def test_predict_on_batch_augmented_reduce(reduce):
+    inputs = tf.keras.layers.Input((32, 32, 3))
+    model = tf.keras.models.Model(inputs, [inputs, tf.reduce_mean(inputs, axis=-1)])
+    X_batch = np.random.uniform(size=(4, 32, 32, 3)).astype(np.float32)
+
+    kwargs = {"flip": (True, True), "crop_size": (3, 3), "padding_size": (0, 0)}
+    expected = tk.models.predict_on_batch_augmented(model, X_batch, **kwargs)
+    result = tk.models.predict_on_batch_augmented(
+        model, X_batch, chunk_size=5, reduce=reduce, unflip=True, **kwargs
+    )
+    assert len(result) == 2
+    assert result[0].shape == (4, 32, 32, 3)
+    assert result[1].shape == (4, 32, 32)
+    # パディング無しなので反転し直せば全パターン元の入力と一致する
+    assert result[0] == pytest.approx(X_batch, abs=1e-5)
+    assert expected[0].shape == (4 * 9, 4, 32, 32, 3)
+
+
+def test_steps_per_execution():
+    dataset, data_loader = _regression_data()
+
+    model = _dense_model()
+    tk.models.compile(model, "sgd", "mse", steps_per_execution=2)
+    tk.models.fit(model, dataset, data_loader, epochs=2, verbose=0)
+
+    # 3ステップ(端数あり)をsteps_per_execution=2で処理しても結果は変わらない
+    expected = np.asarray(model.predict_on_batch(dataset.data))
+    result = tk.models.predict(
+        model, dataset, data_loader, verbose=0, steps_per_execution=2
+    )
+    assert result == pytest.approx(expected, abs=1e-6)
+    evals = tk.models.evaluate(
+        model, dataset, data_loader, verbose=0, steps_per_execution=3
+    )
+    assert evals["loss"] == pytest.approx(
+        np.mean((expected - dataset.labels) ** 2), abs=1e-5
+    )
+
+
+def test_load_predictor(tmpdir):
+    inputs = x = tf.keras.layers.Input((8,))
+    x = tf.keras.layers.Dense(3, activation="softmax")(x)
+    model = tf.keras.models.Model(inputs, x)
+    path = str(tmpdir / "model.tflite")
+    tk.models.save(model, path, mode="tflite")
+
+    X = np.random.uniform(size=(5, 8)).astype(np.float32)
+    dataset = tk.data.Dataset(X)
+    data_loader = tk.data.DataLoader(batch_size=2)
+    expected = tk.models.predict(model, dataset, data_loader, verbose=0)
+
+    predictor = tk.models.load_predictor(path, num_threads=2)
+    # バッチサイズが変わっても動く
+    assert predictor.predict_on_batch(X[:2]) == pytest.approx(expected[:2], abs=1e-5)
+    assert predictor.predict_on_batch(X) == pytest.approx(expected, abs=1e-5)
+    result = tk.models.predict(predictor, dataset, data_loader, verbose=0)
+    assert result == pytest.approx(expected, abs=1e-5)
+    results = list(tk.models.predict_flow(predictor, dataset, data_loader, verbose=0))
+    assert np.array(results) == pytest.approx(expected, abs=1e-5)
+
+
+def test_fit_resume(tmpdir):
+    dataset, data_loader = _regression_data()
+    resume_dir = str(tmpdir / "resume")
+
+    initial_weights = _dense_model().get_weights()
+
+    def _fit(epochs):
+        model = _dense_model()
+        model.set_weights(initial_weights)
+        tk.models.compile(model, tf.keras.optimizers.SGD(momentum=0.9), "mse")
+        tk.models.fit(
+            model, dataset, data_loader, epochs=epochs, verbose=0, resume_dir=resume_dir
+        )
+        return model.get_weights()
+
+    # 2エポックで中断して再開したものと、中断せずに4エポック学習したものが一致する
+    _fit(epochs=2)
+    resumed = _fit(epochs=4)
+    shutil.rmtree(resume_dir)
+    expected = _fit(epochs=4)
+    for w1, w2 in zip(resumed, expected):
+        assert w1 == pytest.approx(w2, abs=1e-6)
+
+
+def test_fit_adaptive_validation():
+    dataset, data_loader = _regression_data()
+
+    model = _dense_model()
+    tk.models.compile(model, "sgd", "mse")
+
+    validated = []
+
+    class _Recorder(tf.keras.callbacks.Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            if "val_loss" in logs:
+                validated.append(epoch + 1)
+
+    tk.models.fit(
+        model,
+        dataset,
+        data_loader,
+        val_set=dataset,
+        val_data_loader=data_loader,
+        validation_freq="adaptive",
+        max_validation_time_ratio=0.0,
+        epochs=5,
+        callbacks=[_Recorder()],
+        verbose=0,
+    )
+    # 時間計測のための最初と、最後のエポックだけ検証する
+    assert validated == [1, 5]
+
+
+def test_evaluate_exact():
+    dataset, data_loader = _regression_data()
+
+    model = _dense_model()
+    tk.models.compile(model, "sgd", "mse", metrics=["mae"])
+
+    expected = tk.models.evaluate(model, dataset, data_loader, verbose=0)
+    # 端数(10件を4x3件ずつ)を水増ししても、その分を除外して元と一致する
+    result = tk.models.evaluate(
+        model, dataset, data_loader, verbose=0, num_replicas_in_sync=3, exact=True
+    )
+    assert result.keys() == expected.keys()
+    for k in expected:
+        assert result[k] == pytest.approx(expected[k], abs=1e-5)
+
+
+def test_evaluate_exact_non_mean():
+    # サンプル毎の平均でないメトリクス(AUC・Precision)と正則化項も厳密に一致する
+    dataset, data_loader = _regression_data()
+    dataset.labels = (dataset.labels > 1.5).astype(np.float32)
+    model = _dense_model(
+        activation="sigmoid", kernel_regularizer=tf.keras.regularizers.l2(0.1)
+    )
+    tk.models.compile(
+        model,
+        "sgd",
+        "binary_crossentropy",
+        metrics=[tf.keras.metrics.AUC(), tf.keras.metrics.Precision()],
+    )
+
+    expected = tk.models.evaluate(model, dataset, data_loader, verbose=0)
+    result = tk.models.evaluate(
+        model, dataset, data_loader, verbose=0, num_replicas_in_sync=3, exact=True
+    )
+    assert result.keys() == expected.keys()
+    for k in expected:
+        assert result[k] == pytest.approx(expected[k], abs=1e-5), k
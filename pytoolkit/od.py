@@ -1,8 +1,12 @@
 """機械学習(主にsklearn)関連。"""
+import functools
+import os
 import pathlib
 import typing
 
 import cv2
+import joblib
+import numba
 import numpy as np
 
 import pytoolkit as tk
@@ -237,21 +241,418 @@ class ObjectsPrediction:
         ]
 
 
-def search_conf_threshold(gt, pred, iou_threshold=0.5):
-    """物体検出の正解と予測結果から、F1スコアが最大になるconf_thresholdを返す。"""
-    conf_threshold_list = np.linspace(0.01, 0.99, 50)
-    scores = []
-    for conf_th in conf_threshold_list:
-        _, _, fscores, supports = compute_scores(gt, pred, conf_th, iou_threshold)
-        score = np.average(fscores, weights=supports)  # sklearnで言うaverage='weighted'
-        scores.append(score)
-    scores = np.array(scores)
+class ObjectsAnnotations:
+    """ObjectsAnnotationの集合を、全画像分の物体を連結した配列で持つクラス。
+
+    ObjectsAnnotationのndarrayだと物体数が多い場合にpickleやスライスなどのオーバーヘッドが大きいので、
+    Dataset.labelsなどに代わりに使う。
+    インデックスで1件取り出すと、配列を共有する軽量なObjectsAnnotationを返す。(in-placeに書き換えないこと)
+
+    Args:
+        paths: 画像ファイルのパスのndarray。shapeは(画像数,)
+        widths: 画像の横幅[px]のndarray。shapeは(画像数,)
+        heights: 画像の縦幅[px]のndarray。shapeは(画像数,)
+        offsets: 画像毎の物体の開始位置のndarray。shapeは(画像数 + 1,)
+        classes: クラスIDのndarray。shapeは(全物体数,)
+        bboxes: bounding box(x1, y1, x2, y2)のndarray。値は[0, 1]。shapeは(全物体数, 4)
+        difficults: difficultフラグのndarray。shapeは(全物体数,)
+        areas: 面積 (MS COCO用)。面積の無い画像の分はnan。shapeは(全物体数,)
+        crowdeds: クラウドソーシングでアノテーションされたか否か (MS COCO用)。shapeは(全物体数,)
+
+    """
+
+    def __init__(
+        self,
+        paths,
+        widths,
+        heights,
+        offsets,
+        classes,
+        bboxes,
+        difficults=None,
+        areas=None,
+        crowdeds=None,
+    ):
+        self.paths = np.asarray(paths).astype(str)
+        self.widths = np.asarray(widths, dtype=np.int64)
+        self.heights = np.asarray(heights, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.classes = np.asarray(classes, dtype=np.int32)
+        self.bboxes = np.asarray(bboxes, dtype=np.float32).reshape((-1, 4))
+        self.difficults = (
+            np.asarray(difficults, dtype=bool)
+            if difficults is not None
+            else np.zeros(len(self.classes), dtype=bool)
+        )
+        self.areas = np.asarray(areas, dtype=np.float32) if areas is not None else None
+        self.crowdeds = (
+            np.asarray(crowdeds, dtype=bool) if crowdeds is not None else None
+        )
+        num_images, num_objects = len(self.paths), len(self.classes)
+        assert self.widths.shape == (num_images,)
+        assert self.heights.shape == (num_images,)
+        assert self.offsets.shape == (num_images + 1,)
+        assert self.offsets[0] == 0 and self.offsets[-1] == num_objects
+        assert (np.diff(self.offsets) >= 0).all()
+        assert self.bboxes.shape == (num_objects, 4)
+        assert self.difficults.shape == (num_objects,)
+        assert self.areas is None or self.areas.shape == (num_objects,)
+        assert self.crowdeds is None or self.crowdeds.shape == (num_objects,)
+        assert (self.widths >= 1).all() and (self.heights >= 1).all()
+        assert (self.bboxes >= 0).all() and (self.bboxes <= 1).all()
+        assert (self.bboxes[:, :2] < self.bboxes[:, 2:]).all()
+
+    @classmethod
+    def from_list(cls, annotations) -> "ObjectsAnnotations":
+        """ObjectsAnnotationのリストから作成する。"""
+        counts = [y.num_objects for y in annotations]
+        areas = crowdeds = None
+        if any(y.areas is not None for y in annotations):
+            areas = _concat(
+                [
+                    np.full((y.num_objects,), np.nan) if y.areas is None else y.areas
+                    for y in annotations
+                ],
+                np.float32,
+            )
+        if any(y.crowdeds is not None for y in annotations):
+            crowdeds = _concat(
+                [
+                    np.zeros((y.num_objects,), dtype=bool)
+                    if y.crowdeds is None
+                    else y.crowdeds
+                    for y in annotations
+                ],
+                bool,
+            )
+        return cls(
+            paths=[str(y.path) for y in annotations],
+            widths=[y.width for y in annotations],
+            heights=[y.height for y in annotations],
+            offsets=np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]),
+            classes=_concat([y.classes for y in annotations], np.int32),
+            bboxes=_concat(
+                [np.reshape(y.bboxes, (-1, 4)) for y in annotations], np.float32
+            ).reshape((-1, 4)),
+            difficults=_concat([y.difficults for y in annotations], bool),
+            areas=areas,
+            crowdeds=crowdeds,
+        )
+
+    def to_list(self) -> typing.List[ObjectsAnnotation]:
+        """ObjectsAnnotationのリストにする。"""
+        return list(self)
+
+    @classmethod
+    def concat(cls, a, b) -> "ObjectsAnnotations":
+        """2個のObjectsAnnotationsを連結する。"""
+        return cls(
+            paths=np.concatenate([a.paths, b.paths]),
+            widths=np.concatenate([a.widths, b.widths]),
+            heights=np.concatenate([a.heights, b.heights]),
+            offsets=np.concatenate([a.offsets, b.offsets[1:] + a.offsets[-1]]),
+            classes=np.concatenate([a.classes, b.classes]),
+            bboxes=np.concatenate([a.bboxes, b.bboxes]),
+            difficults=np.concatenate([a.difficults, b.difficults]),
+            areas=_concat_optional(a, b, "areas", np.nan),
+            crowdeds=_concat_optional(a, b, "crowdeds", False),
+        )
+
+    def copy(self) -> "ObjectsAnnotations":
+        """コピーを作成して返す。"""
+        return self[np.arange(len(self))]
+
+    def save(self, path):
+        """保存。"""
+        tk.utils.dump(self, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None) -> "ObjectsAnnotations":
+        """読み込み。"""
+        result = tk.utils.load(path, mmap_mode=mmap_mode)
+        assert isinstance(result, cls)
+        return result
+
+    @property
+    def num_objects(self):
+        """全画像の物体の数を返す。"""
+        return len(self.classes)
+
+    @property
+    def image_indices(self):
+        """物体毎の画像のindexを返す。"""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    @property
+    def real_bboxes(self):
+        """実ピクセル数換算のbboxesを返す。"""
+        ix = self.image_indices
+        w, h = self.widths[ix], self.heights[ix]
+        return np.round(self.bboxes * np.stack([w, h, w, h], axis=-1)).astype(np.int32)
+
+    def __len__(self):
+        """画像数を返す。"""
+        return len(self.paths)
+
+    def __iter__(self):
+        """画像毎のObjectsAnnotationを返す。"""
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, index):
+        """intならObjectsAnnotation、スライスやインデックスの配列ならObjectsAnnotationsを返す。"""
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            index = range(len(self))[index]  # 負のindexなど
+            o1, o2 = self.offsets[index], self.offsets[index + 1]
+            y = ObjectsAnnotation.__new__(ObjectsAnnotation)
+            y.path = pathlib.Path(self.paths[index])
+            y.width = int(self.widths[index])
+            y.height = int(self.heights[index])
+            y.classes = self.classes[o1:o2]
+            y.bboxes = self.bboxes[o1:o2]
+            y.difficults = self.difficults[o1:o2]
+            y.areas = None if self.areas is None else self.areas[o1:o2]
+            y.crowdeds = None if self.crowdeds is None else self.crowdeds[o1:o2]
+            return y
+        rindex = np.arange(len(self))[index]
+        offsets, obj_index = _slice_offsets(self.offsets, rindex)
+        return self.__class__(
+            paths=self.paths[rindex],
+            widths=self.widths[rindex],
+            heights=self.heights[rindex],
+            offsets=offsets,
+            classes=self.classes[obj_index],
+            bboxes=self.bboxes[obj_index],
+            difficults=self.difficults[obj_index],
+            areas=None if self.areas is None else self.areas[obj_index],
+            crowdeds=None if self.crowdeds is None else self.crowdeds[obj_index],
+        )
+
+
+class ObjectsPredictions:
+    """ObjectsPredictionの集合を、全画像分の物体を連結した配列で持つクラス。
+
+    インデックスで1件取り出すと、配列を共有する軽量なObjectsPredictionを返す。(in-placeに書き換えないこと)
+
+    Args:
+        offsets: 画像毎の物体の開始位置のndarray。shapeは(画像数 + 1,)
+        classes: クラスIDのndarray。shapeは(全物体数,)
+        confs: 確信度のndarray。shapeは(全物体数,)
+        bboxes: bounding box(x1, y1, x2, y2)のndarray。値は[0, 1]。shapeは(全物体数, 4)
+
+    """
+
+    def __init__(self, offsets, classes, confs, bboxes):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.classes = np.asarray(classes)
+        self.confs = np.asarray(confs)
+        self.bboxes = np.asarray(bboxes).reshape((-1, 4))
+        num_objects = len(self.classes)
+        assert self.offsets.ndim == 1 and len(self.offsets) >= 1
+        assert self.offsets[0] == 0 and self.offsets[-1] == num_objects
+        assert (np.diff(self.offsets) >= 0).all()
+        assert self.classes.shape == (num_objects,)
+        assert self.confs.shape == (num_objects,)
+        assert self.bboxes.shape == (num_objects, 4)
+
+    @classmethod
+    def from_list(cls, predictions) -> "ObjectsPredictions":
+        """ObjectsPredictionのリストから作成する。"""
+        counts = [p.num_objects for p in predictions]
+        return cls(
+            offsets=np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]),
+            classes=_concat_any([p.classes for p in predictions], np.int32),
+            confs=_concat_any([p.confs for p in predictions], np.float32),
+            bboxes=_concat_any(
+                [np.reshape(p.bboxes, (-1, 4)) for p in predictions], np.float32
+            ).reshape((-1, 4)),
+        )
+
+    def to_list(self) -> typing.List[ObjectsPrediction]:
+        """ObjectsPredictionのリストにする。"""
+        return list(self)
+
+    @classmethod
+    def concat(cls, a, b) -> "ObjectsPredictions":
+        """2個のObjectsPredictionsを連結する。"""
+        return cls(
+            offsets=np.concatenate([a.offsets, b.offsets[1:] + a.offsets[-1]]),
+            classes=np.concatenate([a.classes, b.classes]),
+            confs=np.concatenate([a.confs, b.confs]),
+            bboxes=np.concatenate([a.bboxes, b.bboxes]),
+        )
+
+    def copy(self) -> "ObjectsPredictions":
+        """コピーを作成して返す。"""
+        return self[np.arange(len(self))]
+
+    def save(self, path):
+        """保存。"""
+        tk.utils.dump(self, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None) -> "ObjectsPredictions":
+        """読み込み。"""
+        result = tk.utils.load(path, mmap_mode=mmap_mode)
+        assert isinstance(result, cls)
+        return result
+
+    @property
+    def num_objects(self):
+        """全画像の物体の数を返す。"""
+        return len(self.classes)
+
+    @property
+    def image_indices(self):
+        """物体毎の画像のindexを返す。"""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def get_real_bboxes(self, widths, heights):
+        """実ピクセル数換算のbboxesを返す。(widths/heightsは画像毎の配列)"""
+        ix = self.image_indices
+        w, h = np.asarray(widths)[ix], np.asarray(heights)[ix]
+        return np.round(self.bboxes * np.stack([w, h, w, h], axis=-1)).astype(np.int32)
+
+    def __len__(self):
+        """画像数を返す。"""
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        """画像毎のObjectsPredictionを返す。"""
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, index):
+        """intならObjectsPrediction、スライスやインデックスの配列ならObjectsPredictionsを返す。"""
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            index = range(len(self))[index]  # 負のindexなど
+            o1, o2 = self.offsets[index], self.offsets[index + 1]
+            p = ObjectsPrediction.__new__(ObjectsPrediction)
+            p.classes = self.classes[o1:o2]
+            p.confs = self.confs[o1:o2]
+            p.bboxes = self.bboxes[o1:o2]
+            return p
+        rindex = np.arange(len(self))[index]
+        offsets, obj_index = _slice_offsets(self.offsets, rindex)
+        return self.__class__(
+            offsets=offsets,
+            classes=self.classes[obj_index],
+            confs=self.confs[obj_index],
+            bboxes=self.bboxes[obj_index],
+        )
+
+
+def _slice_offsets(offsets, rindex):
+    """画像のindexの配列から、新しいoffsetsと物体のindexの配列を作る。"""
+    counts = np.diff(offsets)[rindex]
+    new_offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+    obj_index = np.repeat(offsets[:-1][rindex] - new_offsets[:-1], counts) + np.arange(
+        new_offsets[-1]
+    )
+    return new_offsets, obj_index
+
+
+def _concat_optional(a, b, name, fill_value):
+    """Noneかもしれない列の連結。"""
+    va, vb = getattr(a, name), getattr(b, name)
+    if va is None and vb is None:
+        return None
+    if va is None:
+        va = np.full((a.num_objects,), fill_value)
+    if vb is None:
+        vb = np.full((b.num_objects,), fill_value)
+    return np.concatenate([va, vb])
+
+
+def _concat_any(arrays, empty_dtype):
+    """dtypeを変えずに連結する。(空の場合のみempty_dtypeを使う)"""
+    if len(arrays) == 0:
+        return np.zeros((0,), dtype=empty_dtype)
+    return np.concatenate([np.asarray(a) for a in arrays])
+
+
+def search_conf_threshold(gt, pred, iou_threshold=0.5, conf_thresholds=None):
+    """物体検出の正解と予測結果から、F1スコアが最大になるconf_thresholdを返す。
+
+    Args:
+        gt: 正解
+        pred: 予測結果
+        iou_threshold: IoUの閾値
+        conf_thresholds: 探索するconf_thresholdの候補。Noneなら0.01～0.99を50分割。
+
+    """
+    conf_threshold_list = (
+        np.linspace(0.01, 0.99, 50)
+        if conf_thresholds is None
+        else np.asarray(conf_thresholds)
+    )
+    _, _, fscores, supports = compute_scores_by_threshold(
+        gt, pred, conf_threshold_list, iou_threshold
+    )
+    # sklearnで言うaverage='weighted'
+    scores = np.sum(fscores * supports, axis=-1) / np.sum(supports, axis=-1)
     max_scores = scores >= 1
     if max_scores.any():  # 満点が1つ以上存在する場合、そのときの閾値の平均を返す(怪)
         return np.mean(conf_threshold_list[max_scores])
     return conf_threshold_list[scores.argmax()]
 
 
+def compute_scores_by_threshold(
+    gt, pred, conf_thresholds, iou_threshold=0.5, num_classes=None
+):
+    """複数のconf_thresholdについて、適合率、再現率、F値、該当回数をまとめて算出して返す。
+
+    予測結果を確信度の降順で1回だけマッチングし、閾値毎の値は累積和で求める。
+    そのため閾値の数によらずほぼ1回の評価分のコストで済む。
+
+    マッチングは確信度の高い予測結果から順に正解を割り当てる方式のため、
+    重なりが曖昧な場合は compute_scores と結果が異なることがある。
+
+    Returns:
+        適合率、再現率、F値、該当回数。それぞれshapeは(閾値の数, クラス数)
+
+    """
+    conf_thresholds = np.asarray(conf_thresholds, dtype=np.float64)
+    assert conf_thresholds.ndim == 1
+    assert len(gt) == len(pred)
+    assert 0 < iou_threshold < 1
+    if num_classes is None:
+        num_classes = np.max(_column(gt, "classes", np.int32)) + 1
+
+    status = _concat(_match_objects_by_conf(gt, pred, iou_threshold), np.int8)
+    pred_classes = _column(pred, "classes", np.int32)
+    pred_confs = _column(pred, "confs", np.float64)
+    gt_classes = _column(gt, "classes", np.int32)
+    gt_difficults = _column(gt, "difficults", bool)
+
+    # 各予測結果が「どの閾値まで有効か」を求め、閾値×クラスのヒストグラムを作って逆順に累積和
+    order = np.argsort(conf_thresholds)
+    th_index = np.searchsorted(conf_thresholds[order], pred_confs, side="right") - 1
+    num_thresholds = len(conf_thresholds)
+
+    def _count(mask):
+        m = mask & (th_index >= 0)
+        hist = np.bincount(
+            th_index[m] * num_classes + pred_classes[m],
+            minlength=num_thresholds * num_classes,
+        ).reshape((num_thresholds, num_classes))
+        counts = np.cumsum(hist[::-1], axis=0)[::-1]
+        result = np.empty_like(counts)
+        result[order] = counts
+        return result.astype(np.int32)
+
+    tp = _count(status == 1)  # true positive
+    fp = _count(status == 0)  # false positive
+    supports = np.bincount(gt_classes[~gt_difficults], minlength=num_classes).astype(
+        np.int32
+    )
+    supports = np.tile(supports, (num_thresholds, 1))
+    fn = supports - tp  # false negative
+
+    precisions = tp.astype(float) / (tp + fp + 1e-7)
+    recalls = tp.astype(float) / (tp + fn + 1e-7)
+    fscores = 2 / (1 / (precisions + 1e-7) + 1 / (recalls + 1e-7))
+    return precisions, recalls, fscores, supports
+
+
 def od_accuracy(gt, pred, conf_threshold=0, iou_threshold=0.5):
     """物体検出で過不足なく検出できた時だけ正解扱いとした正解率を算出する。"""
     assert len(gt) == len(pred)
@@ -273,41 +674,28 @@ def compute_scores(gt, pred, conf_threshold=0, iou_threshold=0.5, num_classes=No
     assert 0 < iou_threshold < 1
     assert 0 <= conf_threshold < 1
     if num_classes is None:
-        num_classes = np.max(np.concatenate([y.classes for y in gt])) + 1
+        num_classes = np.max(_column(gt, "classes", np.int32)) + 1
 
-    tp = np.zeros((num_classes,), dtype=np.int32)  # true positive
-    fp = np.zeros((num_classes,), dtype=np.int32)  # false positive
-    fn = np.zeros((num_classes,), dtype=np.int32)  # false negative
+    gt_matched_list, pred_enabled_list = _match_objects(
+        gt, pred, conf_threshold, iou_threshold
+    )
+    gt_classes = _column(gt, "classes", np.int32)
+    gt_difficults = _column(gt, "difficults", bool)
+    gt_matched = _concat(gt_matched_list, bool)
+    pred_classes = _column(pred, "classes", np.int32)
+    pred_enabled = _concat(pred_enabled_list, bool)
 
-    for y_true, y_pred in zip(gt, pred):
-        # conf_threshold以上をいったんすべて対象とする
-        pred_enabled = y_pred.confs >= conf_threshold
-        # 各正解が予測結果に含まれるか否か: true positive/negative
-        for gt_class, gt_bbox, gt_difficult in zip(
-            y_true.classes, y_true.bboxes, y_true.difficults
-        ):
-            pred_mask = np.logical_and(pred_enabled, y_pred.classes == gt_class)
-            if pred_mask.any():
-                pred_bboxes = y_pred.bboxes[pred_mask]
-                iou = compute_iou(np.expand_dims(gt_bbox, axis=0), pred_bboxes)[0, :]
-                pred_ix = iou.argmax()
-                pred_iou = iou[pred_ix]
-            else:
-                pred_ix = None
-                pred_iou = -1  # 検出失敗
-            if pred_iou >= iou_threshold:
-                # 検出成功
-                if not gt_difficult:
-                    tp[gt_class] += 1
-                assert pred_ix is not None
-                pred_enabled[np.where(pred_mask)[0][pred_ix]] = False
-            else:
-                # 検出失敗
-                if not gt_difficult:
-                    fn[gt_class] += 1
-        # 正解に含まれなかった予測結果: false positive
-        for pred_class in y_pred.classes[pred_enabled]:
-            fp[pred_class] += 1
+    # difficultは検出成功・失敗どちらにも数えない
+    # true positive
+    tp = np.bincount(
+        gt_classes[gt_matched & ~gt_difficults], minlength=num_classes
+    ).astype(np.int32)
+    # false negative
+    fn = np.bincount(
+        gt_classes[~gt_matched & ~gt_difficults], minlength=num_classes
+    ).astype(np.int32)
+    # 正解に含まれなかった予測結果: false positive
+    fp = np.bincount(pred_classes[pred_enabled], minlength=num_classes).astype(np.int32)
 
     supports = tp + fn
     precisions = tp.astype(float) / (tp + fp + 1e-7)
@@ -316,6 +704,199 @@ def compute_scores(gt, pred, conf_threshold=0, iou_threshold=0.5, num_classes=No
     return precisions, recalls, fscores, supports
 
 
+def _match_objects(gt, pred, conf_threshold, iou_threshold):
+    """画像毎に正解と予測結果をマッチングする。
+
+    正解の順に、未使用で同じクラスの予測結果のうちIoU最大のものを割り当てる。
+
+    Returns:
+        画像毎の「正解が検出できたか否か」のリストと、画像毎の「どの正解にも割り当たらなかった予測結果」のマスクのリスト
+
+    """
+
+    def _process(y_true, y_pred):
+        pred_enabled = np.asarray(y_pred.confs) >= conf_threshold
+        gt_bboxes, pred_bboxes = _as_same_float(y_true.bboxes, y_pred.bboxes)
+        offsets, indices, ious = _iou_lists(gt_bboxes, pred_bboxes, iou_threshold)
+        gt_matched = _match_image(
+            np.asarray(y_true.classes),
+            np.asarray(y_pred.classes),
+            pred_enabled,
+            offsets,
+            indices,
+            ious,
+            iou_threshold,
+        )
+        return gt_matched, pred_enabled
+
+    results = _map_images(_process, gt, pred)
+    return [r[0] for r in results], [r[1] for r in results]
+
+
+def _match_objects_by_conf(gt, pred, iou_threshold):
+    """画像毎に予測結果を確信度の降順で正解とマッチングする。
+
+    予測結果の確信度の降順に、未使用で同じクラスの正解のうちIoU最大のものを割り当てる。
+    確信度の閾値で予測結果を絞り込んだときのマッチングは、この結果の先頭部分と一致する。
+
+    Returns:
+        予測結果毎の状態(1: 検出成功、0: 誤検出、-1: difficultに割り当たったので無視)の画像毎のリスト
+
+    """
+
+    def _process(y_true, y_pred):
+        gt_bboxes, pred_bboxes = _as_same_float(y_true.bboxes, y_pred.bboxes)
+        offsets, indices, ious = _iou_lists(pred_bboxes, gt_bboxes, iou_threshold)
+        return _match_image_by_conf(
+            np.asarray(y_true.classes),
+            np.asarray(y_true.difficults, dtype=np.bool_),
+            np.asarray(y_pred.classes),
+            np.asarray(y_pred.confs),
+            offsets,
+            indices,
+            ious,
+            iou_threshold,
+        )
+
+    return _map_images(_process, gt, pred)
+
+
+def _map_images(func, gt, pred):
+    """画像毎の処理をスレッドで並列に実行する。"""
+
+    @joblib.delayed
+    def _process(indices):
+        return [func(gt[i], pred[i]) for i in indices]
+
+    # 1枚あたりの処理は軽いので、ある程度まとめてスレッドに投げる
+    num_chunks = min(len(gt), (os.cpu_count() or 1) * 4)
+    if num_chunks <= 0:
+        return []
+    chunks = np.array_split(np.arange(len(gt)), num_chunks)
+    with joblib.Parallel(n_jobs=-1, backend="threading") as parallel:
+        return [r for rs in parallel(_process(c) for c in chunks) for r in rs]
+
+
+def _iou_lists(bboxes_a, bboxes_b, iou_threshold):
+    """bboxes_a毎に、IoUを計算するbboxes_bのindexとIoUのリストをCSR形式で返す。
+
+    ペア数が多い場合はIoU>0のペアのみにする。(IoU=0のペアはiou_threshold>0ならマッチングに影響しない)
+
+    """
+    if len(bboxes_a) * len(bboxes_b) > _SPARSE_MIN_PAIRS and iou_threshold > 0:
+        rows, indices, ious = _sparse_pairs(bboxes_a, bboxes_b, _PAIR_IOU)
+        offsets = np.searchsorted(rows, np.arange(len(bboxes_a) + 1))
+    else:
+        ious = _compute_iou_nb(bboxes_a, bboxes_b).ravel()
+        indices = np.tile(np.arange(len(bboxes_b)), len(bboxes_a))
+        offsets = np.arange(len(bboxes_a) + 1) * len(bboxes_b)
+    return offsets, indices, ious
+
+
+# 従来のnumpy版と結果を一致させるため、fastmathは使わない
+@numba.njit(nogil=True)
+def _match_image(
+    gt_classes, pred_classes, pred_enabled, offsets, indices, ious, iou_threshold
+):
+    """1枚分のマッチング。pred_enabledは使用済みのものがFalseに更新される。"""
+    gt_matched = np.zeros(len(gt_classes), dtype=np.bool_)
+    for g in range(len(gt_classes)):
+        best_ix = -1
+        best_iou = -1.0
+        for k in range(offsets[g], offsets[g + 1]):
+            p = indices[k]
+            if (
+                pred_enabled[p]
+                and pred_classes[p] == gt_classes[g]
+                and ious[k] > best_iou
+            ):
+                best_ix = p
+                best_iou = ious[k]
+        if best_ix >= 0 and best_iou >= iou_threshold:
+            gt_matched[g] = True
+            pred_enabled[best_ix] = False
+    return gt_matched
+
+
+@numba.njit(nogil=True)
+def _match_image_by_conf(
+    gt_classes,
+    gt_difficults,
+    pred_classes,
+    pred_confs,
+    offsets,
+    indices,
+    ious,
+    iou_threshold,
+):
+    """1枚分の確信度順のマッチング。"""
+    gt_used = np.zeros(len(gt_classes), dtype=np.bool_)
+    status = np.zeros(len(pred_classes), dtype=np.int8)
+    for p in np.argsort(-pred_confs, kind="mergesort"):
+        best_ix = -1
+        best_iou = -1.0
+        for k in range(offsets[p], offsets[p + 1]):
+            g = indices[k]
+            if (
+                not gt_used[g]
+                and gt_classes[g] == pred_classes[p]
+                and ious[k] > best_iou
+            ):
+                best_ix = g
+                best_iou = ious[k]
+        if best_ix >= 0 and best_iou >= iou_threshold:
+            gt_used[best_ix] = True
+            status[p] = -1 if gt_difficults[best_ix] else 1
+    return status
+
+
+@numba.njit(nogil=True)
+def _compute_iou_nb(bboxes_a, bboxes_b):
+    """compute_iouのnumba版。(空の配列も可)"""
+    iou = np.zeros((len(bboxes_a), len(bboxes_b)), dtype=bboxes_a.dtype)
+    for i in range(len(bboxes_a)):
+        area_a = (bboxes_a[i, 2] - bboxes_a[i, 0]) * (bboxes_a[i, 3] - bboxes_a[i, 1])
+        for j in range(len(bboxes_b)):
+            x1 = max(bboxes_a[i, 0], bboxes_b[j, 0])
+            y1 = max(bboxes_a[i, 1], bboxes_b[j, 1])
+            x2 = min(bboxes_a[i, 2], bboxes_b[j, 2])
+            y2 = min(bboxes_a[i, 3], bboxes_b[j, 3])
+            if x1 < x2 and y1 < y2:
+                area_inter = (x2 - x1) * (y2 - y1)
+                area_b = (bboxes_b[j, 2] - bboxes_b[j, 0]) * (
+                    bboxes_b[j, 3] - bboxes_b[j, 1]
+                )
+                iou[i, j] = area_inter / (area_a + area_b - area_inter)
+    return iou
+
+
+def _as_same_float(bboxes_a, bboxes_b):
+    """numpyの型昇格に合わせた浮動小数点型に揃える。(numba関数に渡す用)"""
+    bboxes_a = np.asarray(bboxes_a)
+    bboxes_b = np.asarray(bboxes_b)
+    dtype = np.result_type(bboxes_a, bboxes_b)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    return (
+        np.ascontiguousarray(bboxes_a.reshape(-1, 4), dtype=dtype),
+        np.ascontiguousarray(bboxes_b.reshape(-1, 4), dtype=dtype),
+    )
+
+
+def _column(objs, name, dtype):
+    """全画像分の物体の値を連結したndarrayを返す。"""
+    if isinstance(objs, (ObjectsAnnotations, ObjectsPredictions)):
+        return np.asarray(getattr(objs, name), dtype=dtype)
+    return _concat([getattr(y, name) for y in objs], dtype)
+
+
+def _concat(arrays, dtype):
+    """空のリストも許容するnp.concatenate。"""
+    if len(arrays) == 0:
+        return np.zeros((0,), dtype=dtype)
+    return np.concatenate([np.asarray(a, dtype=dtype) for a in arrays])
+
+
 def confusion_matrix(gt, pred, conf_threshold=0, iou_threshold=0.5, num_classes=None):
     """物体検出用の混同行列を作る。
 
@@ -326,66 +907,66 @@ def confusion_matrix(gt, pred, conf_threshold=0, iou_threshold=0.5, num_classes=
     assert 0 < iou_threshold < 1
     assert 0 <= conf_threshold < 1
     if num_classes is None:
-        num_classes = np.max(np.concatenate([y.classes for y in gt])) + 1
-
-    cm = np.zeros((num_classes + 1, num_classes + 1), dtype=np.int32)
+        num_classes = np.max(_column(gt, "classes", np.int32)) + 1
 
+    rows, cols = [], []  # 混同行列に加算する(正解, 予測結果)のペア
     for y_true, y_pred in zip(gt, pred):
         pred_enabled = y_pred.confs >= conf_threshold
-        if y_true.num_objects > 0:
-            if y_pred.num_objects > 0:
-                iou = compute_iou(y_true.bboxes, y_pred.bboxes)
-                pred_gt = iou.argmax(axis=0)  # 一番近いboxにマッチさせる (やや怪しい)
-                pred_iou_mask = iou.max(axis=0) >= iou_threshold
-                # 正解毎にループ
-                for gt_ix, gt_class in enumerate(y_true.classes):
-                    m = np.logical_and(
-                        pred_enabled, pred_iou_mask
-                    )  # まだ使用済みでなく、IoUが大きく、
-                    m = np.logical_and(m, pred_gt == gt_ix)  # IoUの対象がgt_ixなものが対象
-                    pred_targets = y_pred.confs.argsort()[::-1][m]  # 対象のindexを確信度順で
-                    found = False
-                    # クラスもあってる検出
-                    for pred_ix in pred_targets:
-                        pc = y_pred.classes[pred_ix]
-                        if gt_class == pc:
-                            if found:
-                                cm[-1, pc] += 1  # 誤検出(重複)
-                            else:
-                                found = True
-                                cm[gt_class, pc] += 1  # 検出成功
-                            # 一度カウントしたものは次から無視
-                            pred_enabled[pred_ix] = False
-                    # クラス違い
-                    for pred_ix in pred_targets:
-                        pc = y_pred.classes[pred_ix]
-                        if pred_enabled[pred_ix] and gt_class != pc:
-                            if found:
-                                cm[-1, pc] += 1  # 誤検出(重複&クラス違い)
-                            else:
-                                # ここでFound=Trueは微妙だが、gt_classの数が合わなくなるので1個だけにする。。
-                                found = True
-                                cm[gt_class, pc] += 1  # 誤検出(クラス違い)
-                        # 一度カウントしたものは次から無視
-                        pred_enabled[pred_ix] = False
-                    if not found:
-                        cm[gt_class, -1] += 1  # 検出漏れ
-            else:
-                # 全て検出漏れ
-                for gt_class in y_true.classes:
-                    cm[gt_class, -1] += 1  # 検出漏れ
+        gt_found = np.zeros((y_true.num_objects,), dtype=bool)
+        if y_true.num_objects > 0 and y_pred.num_objects > 0:
+            iou = compute_iou(y_true.bboxes, y_pred.bboxes)
+            pred_gt = iou.argmax(axis=0)  # 一番近いboxにマッチさせる (やや怪しい)
+            # まだ使用済みでなく、IoUが大きいものが対象
+            targets = np.where(
+                np.logical_and(pred_enabled, iou.max(axis=0) >= iou_threshold)
+            )[0]
+            # 正解毎に、クラスもあってる検出 → クラス違い の順で、確信度が最大のものを検出とする
+            conf_rank = np.empty((y_pred.num_objects,), dtype=np.int64)
+            conf_rank[y_pred.confs.argsort()[::-1]] = np.arange(y_pred.num_objects)
+            class_mismatch = y_pred.classes[targets] != y_true.classes[pred_gt[targets]]
+            targets = targets[
+                np.lexsort((conf_rank[targets], class_mismatch, pred_gt[targets]))
+            ]
+            _, first = np.unique(pred_gt[targets], return_index=True)
+            found = targets[first]
+            # 検出成功 or 誤検出(クラス違い)
+            rows.append(y_true.classes[pred_gt[found]])
+            cols.append(y_pred.classes[found])
+            gt_found[pred_gt[found]] = True
+            # 残りの対象は誤検出(重複、重複&クラス違い)として下で数える
+            pred_enabled[found] = False
+        # 検出漏れ
+        rows.append(y_true.classes[~gt_found])
+        cols.append(np.full((np.sum(~gt_found),), num_classes))
         # 余った予測結果：誤検出
-        for pred_class in y_pred.classes[pred_enabled]:
-            cm[-1, pred_class] += 1
+        rows.append(np.full((np.sum(pred_enabled),), num_classes))
+        cols.append(y_pred.classes[pred_enabled])
 
-    return cm
+    rows_ = _concat(rows, np.int64)
+    cols_ = _concat(cols, np.int64)
+    cm = np.bincount(
+        rows_ * (num_classes + 1) + cols_, minlength=(num_classes + 1) ** 2
+    ).reshape((num_classes + 1, num_classes + 1))
+    return cm.astype(np.int32)
 
 
-def compute_iou(bboxes_a, bboxes_b):
+def compute_iou(bboxes_a, bboxes_b, sparse=False):
     """IoU(Intersection over union、Jaccard係数)の算出。
 
     重なり具合を示す係数。(0～1)
+
+    Args:
+        bboxes_a: shape=(N, 4)
+        bboxes_b: shape=(M, 4)
+        sparse: Trueなら重なっているペアのみをCOO形式で返す。(boxが多いときに省メモリかつ高速)
+
+    Returns:
+        sparse=Falseなら shape=(N, M) のIoU。
+        sparse=Trueなら (bboxes_aのindex, bboxes_bのindex, IoU) のタプル。(IoU>0のペアのみ、indexの昇順)
+
     """
+    if sparse:
+        return _sparse_pairs(bboxes_a, bboxes_b, _PAIR_IOU)
     assert bboxes_a.shape[0] > 0
     assert bboxes_b.shape[0] > 0
     assert bboxes_a.shape == (len(bboxes_a), 4)
@@ -401,8 +982,14 @@ def compute_iou(bboxes_a, bboxes_b):
     return iou
 
 
-def is_intersection(bboxes_a, bboxes_b):
-    """boxes_aとboxes_bでそれぞれ交差している部分が存在するか否かを返す。"""
+def is_intersection(bboxes_a, bboxes_b, sparse=False):
+    """boxes_aとboxes_bでそれぞれ交差している部分が存在するか否かを返す。
+
+    sparse=Trueなら交差しているペアのみを (bboxes_aのindex, bboxes_bのindex) のタプルで返す。
+
+    """
+    if sparse:
+        return _sparse_pairs(bboxes_a, bboxes_b, _PAIR_INTERSECTION)[:2]
     assert bboxes_a.shape[0] > 0
     assert bboxes_b.shape[0] > 0
     assert bboxes_a.shape == (len(bboxes_a), 4)
@@ -412,8 +999,15 @@ def is_intersection(bboxes_a, bboxes_b):
     return (lt < rb).all(axis=-1)
 
 
-def is_in_box(boxes_a, boxes_b):
-    """boxes_aがboxes_bの中に完全に入っているならtrue。"""
+def is_in_box(boxes_a, boxes_b, sparse=False):
+    """boxes_aがboxes_bの中に完全に入っているならtrue。
+
+    sparse=Trueなら該当するペアのみを (boxes_aのindex, boxes_bのindex) のタプルで返す。
+    (この場合はboxが x1 <= x2, y1 <= y2 であることが前提)
+
+    """
+    if sparse:
+        return _sparse_pairs(boxes_a, boxes_b, _PAIR_IN_BOX)[:2]
     assert boxes_a.shape == (len(boxes_a), 4)
     assert boxes_b.shape == (len(boxes_b), 4)
     lt = boxes_a[:, np.newaxis, :2] >= boxes_b[:, :2]
@@ -421,6 +1015,93 @@ def is_in_box(boxes_a, boxes_b):
     return np.logical_and(lt, rb).all(axis=-1)
 
 
+_PAIR_INTERSECTION = 0
+_PAIR_IOU = 1
+_PAIR_IN_BOX = 2
+
+# 正解数×予測数がこれを超える画像はsparseなIoUでマッチングする
+_SPARSE_MIN_PAIRS = 2 ** 18
+
+
+def _sparse_pairs(bboxes_a, bboxes_b, mode):
+    """x1でソートしてsweep and pruneし、条件を満たすペアをCOO形式で返す。"""
+    bboxes_a, bboxes_b = _as_same_float(bboxes_a, bboxes_b)
+    order_a = np.argsort(bboxes_a[:, 0], kind="mergesort")
+    order_b = np.argsort(bboxes_b[:, 0], kind="mergesort")
+    x1_a = bboxes_a[order_a, 0]
+    x1_b = bboxes_b[order_b, 0]
+    # x方向に重なる候補は「a.x1 <= b.x1 < a.x2」か「b.x1 < a.x1 < b.x2」のどちらか一方を満たす。
+    # (is_in_boxは境界が接するものも含むため閉区間で探す)
+    side = "right" if mode == _PAIR_IN_BOX else "left"
+    rows, cols, values = _sweep_and_prune(
+        bboxes_a,
+        bboxes_b,
+        order_a,
+        order_b,
+        np.searchsorted(x1_b, bboxes_a[:, 0], side="left"),
+        np.searchsorted(x1_b, bboxes_a[:, 2], side=side),
+        np.searchsorted(x1_a, bboxes_b[:, 0], side="right"),
+        np.searchsorted(x1_a, bboxes_b[:, 2], side=side),
+        mode,
+    )
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], values[order]
+
+
+@numba.njit(nogil=True)
+def _sweep_and_prune(
+    bboxes_a, bboxes_b, order_a, order_b, lo_ab, hi_ab, lo_ba, hi_ba, mode
+):
+    """x方向の候補ペアを判定する。1周目で数えて2周目で書き込む。"""
+    rows = np.zeros(0, dtype=np.int64)
+    cols = np.zeros(0, dtype=np.int64)
+    values = np.zeros(0, dtype=bboxes_a.dtype)
+    for fill in range(2):
+        n = 0
+        for i in range(len(bboxes_a)):
+            for k in range(lo_ab[i], hi_ab[i]):
+                j = order_b[k]
+                v = _pair_value(bboxes_a[i], bboxes_b[j], mode)
+                if v > 0:
+                    if fill:
+                        rows[n], cols[n], values[n] = i, j, v
+                    n += 1
+        for j in range(len(bboxes_b)):
+            for k in range(lo_ba[j], hi_ba[j]):
+                i = order_a[k]
+                v = _pair_value(bboxes_a[i], bboxes_b[j], mode)
+                if v > 0:
+                    if fill:
+                        rows[n], cols[n], values[n] = i, j, v
+                    n += 1
+        if not fill:
+            rows = np.empty(n, dtype=np.int64)
+            cols = np.empty(n, dtype=np.int64)
+            values = np.empty(n, dtype=bboxes_a.dtype)
+    return rows, cols, values
+
+
+@numba.njit(nogil=True)
+def _pair_value(a, b, mode):
+    """1ペア分の判定。条件を満たさなければ0、満たせばIoUまたは1を返す。"""
+    if mode == _PAIR_IN_BOX:
+        if a[0] >= b[0] and a[1] >= b[1] and a[2] <= b[2] and a[3] <= b[3]:
+            return 1.0
+        return 0.0
+    x1 = max(a[0], b[0])
+    y1 = max(a[1], b[1])
+    x2 = min(a[2], b[2])
+    y2 = min(a[3], b[3])
+    if not (x1 < x2 and y1 < y2):
+        return 0.0
+    if mode == _PAIR_INTERSECTION:
+        return 1.0
+    area_inter = (x2 - x1) * (y2 - y1)
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return area_inter / (area_a + area_b - area_inter)
+
+
 def plot_objects(
     base_image: np.ndarray,
     classes: typing.Optional[np.ndarray],
@@ -442,43 +1123,138 @@ def plot_objects(
         conf_threshold: この値以上のオブジェクトのみ描画する
 
     """
+    img = _load_image(base_image, max_long_side)
+    return _draw_objects(img, classes, confs, bboxes, class_names, conf_threshold)
+
+
+def plot_objects_batch(
+    base_images: typing.Sequence[typing.Union[np.ndarray, str, pathlib.Path]],
+    objects: typing.Sequence[typing.Union[ObjectsAnnotation, ObjectsPrediction]],
+    class_names: typing.Sequence[str] = None,
+    conf_threshold: float = 0.0,
+    max_long_side: int = None,
+    save_dir: typing.Union[str, pathlib.Path] = None,
+    jpeg_quality: int = 90,
+    n_jobs: int = -1,
+):
+    """複数画像のplot_objectsをスレッドで並列に行う。
+
+    Args:
+        base_images: 元画像ファイルのパスまたはndarrayのリスト
+        objects: 画像毎のObjectsAnnotation/ObjectsPrediction (ObjectsAnnotations/ObjectsPredictionsも可)
+        class_names: クラスID→クラス名のリスト  (None可)
+        conf_threshold: この値以上のオブジェクトのみ描画する
+        max_long_side: 長辺の最大長(ピクセル数)。超えていたら描画前に縮小する。
+                       JPEGファイルはデコード時に縮小するため、plot_objectsとは画素値が若干異なる。
+        save_dir: 指定した場合は描画した画像をJPEGで保存し、メモリには残さない。
+                  ファイル名は"{連番}_{元画像のstem}.jpg" (元画像がndarrayなら"{連番}.jpg")。
+        jpeg_quality: JPEGの品質
+        n_jobs: 並列数
+
+    Returns:
+        save_dirがNoneなら描画した画像のリスト、そうでなければ保存したファイルパスのリスト
+
+    """
+    assert len(base_images) == len(objects)
+    save_dir = pathlib.Path(save_dir) if save_dir is not None else None
+    if save_dir is not None:
+        save_dir.mkdir(parents=True, exist_ok=True)
+
+    @joblib.delayed
+    def _process(i):
+        y = objects[i]
+        img = _load_image(base_images[i], max_long_side, draft=True)
+        img = _draw_objects(
+            img,
+            y.classes,
+            getattr(y, "confs", None),
+            y.bboxes,
+            class_names,
+            conf_threshold,
+        )
+        if save_dir is None:
+            return img
+        base_image = base_images[i]
+        # 同じstemの画像が上書きし合わないように連番を付ける
+        name = (
+            f"{i:06d}_{pathlib.Path(base_image).stem}"
+            if isinstance(base_image, (str, pathlib.Path))
+            else f"{i:06d}"
+        )
+        save_path = save_dir / f"{name}.jpg"
+        tk.ndimage.save(save_path, img, jpeg_quality=jpeg_quality)
+        return save_path
+
+    with joblib.Parallel(n_jobs=n_jobs, backend="threading") as parallel:
+        return parallel(_process(i) for i in range(len(base_images)))
+
+
+def _load_image(base_image, max_long_side, draft=False):
+    """描画用に画像を読み込む。draft=TrueならJPEGの縮小はデコード時に行う。"""
+    if (
+        draft
+        and max_long_side is not None
+        and isinstance(base_image, (str, pathlib.Path))
+        and pathlib.Path(base_image).suffix.lower() in (".jpg", ".jpeg")
+    ):
+        import PIL.Image
+        import PIL.ImageOps
+
+        with PIL.Image.open(base_image) as pil_img:
+            # 回転前なので短辺基準で指定する(結果は要求サイズ以上になる)
+            pil_img.draft("RGB", (max_long_side, max_long_side))
+            try:
+                pil_img = PIL.ImageOps.exif_transpose(pil_img)
+            except Exception:
+                # tk.ndimage.loadと同様、Pillowのバグなどで失敗しても回転せずに続行する。
+                # https://github.com/python-pillow/Pillow/issues/3973
+                pass
+            pil_img = pil_img.convert("RGB")
+            img = np.array(pil_img, dtype=np.uint8)
+    else:
+        img = tk.ndimage.load(base_image, grayscale=False)
+    if max_long_side is not None and max(*img.shape[:2]) > max_long_side:
+        img = tk.ndimage.resize_long_side(img, max_long_side)
+    return img
+
+
+def _draw_objects(img, classes, confs, bboxes, class_names, conf_threshold):
+    """読み込み済みの画像にオブジェクトを描画する。"""
+    bboxes = np.asarray(bboxes).reshape((-1, 4))
     confs_ = [None] * len(bboxes) if confs is None else confs
     classes_ = [None] * len(bboxes) if classes is None else classes
     assert len(confs_) == len(bboxes)
     assert len(classes_) == len(bboxes)
-    if class_names is not None and classes is not None:
+    if class_names is not None and classes is not None and len(bboxes) > 0:
         assert 0 <= np.min(classes_) < len(class_names)
         assert 0 <= np.max(classes_) < len(class_names)
 
-    img = tk.ndimage.load(base_image, grayscale=False)
-    if max_long_side is not None and max(*img.shape[:2]) > max_long_side:
-        img = tk.ndimage.resize_long_side(img, max_long_side)
     num_classes = len(class_names) if class_names is not None else 1
-    import matplotlib.cm
-
-    colors = (
-        matplotlib.cm.get_cmap(name="hsv")(
-            np.linspace(0, 1, num_classes + 1)[:num_classes]
-        )
-        * 255
-    )
+    colors = _get_colors(num_classes)
+    # 座標はまとめて計算しておく
+    h, w = img.shape[:2]
+    real_bboxes = np.round(bboxes * [w, h, w, h]).astype(np.int64)
+    real_bboxes[:, :2] = np.maximum(real_bboxes[:, :2], 0)
+    real_bboxes[:, 2:] = np.minimum(real_bboxes[:, 2:], [w, h])
+    labels: typing.Dict[int, str] = {}
 
-    for clazz, conf, bbox in zip(classes_, confs_, bboxes):
+    for clazz, conf, bbox, real_bbox in zip(classes_, confs_, bboxes, real_bboxes):
         if conf is not None and conf < conf_threshold:
             continue  # skip
         assert bbox[0] <= bbox[2], f"bbox error: bbox={bbox} class={clazz} conf={conf}"
         assert bbox[1] <= bbox[3], f"bbox error: bbox={bbox} class={clazz} conf={conf}"
-        xmin = max(int(round(bbox[0] * img.shape[1])), 0)
-        ymin = max(int(round(bbox[1] * img.shape[0])), 0)
-        xmax = min(int(round(bbox[2] * img.shape[1])), img.shape[1])
-        ymax = min(int(round(bbox[3] * img.shape[0])), img.shape[0])
+        xmin, ymin, xmax, ymax = real_bbox.tolist()
         if clazz is None:
             color = colors[0]
         else:
             color = colors[clazz % len(colors)][-2::-1]  # RGBA → BGR
-            label = (
-                class_names[clazz] if class_names is not None else f"class{clazz:02d}"
-            )
+            label = labels.get(clazz)
+            if label is None:
+                label = labels[clazz] = (
+                    class_names[clazz]
+                    if class_names is not None
+                    else f"class{clazz:02d}"
+                )
             text = label if conf is None else f"{conf:0.2f}, {label}"
             tw = 6 * len(text)
             cv2.rectangle(img, (xmin - 1, ymin), (xmin + tw + 15, ymin + 15), color, -1)
@@ -496,6 +1272,21 @@ def plot_objects(
     return img
 
 
+@functools.lru_cache(maxsize=None)
+def _get_colors(num_classes):
+    """クラス毎の色(RGBA)を返す。"""
+    import matplotlib.cm
+
+    colors = (
+        matplotlib.cm.get_cmap(name="hsv")(
+            np.linspace(0, 1, num_classes + 1)[:num_classes]
+        )
+        * 255
+    )
+    colors.setflags(write=False)
+    return colors
+
+
 def _rbb_sortkey(bb):
     """real_bboxesのソートキーを作って返す。"""
     x1, y1, x2, y2 = bb
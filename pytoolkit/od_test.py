@@ -1,3 +1,5 @@
+import pathlib
+
 import numpy as np
 import pytest
 
@@ -30,6 +32,60 @@ def test_to_str():
     )
 
 
+def test_objects_annotations(tmpdir):
+    y_list = [
+        tk.od.ObjectsAnnotation(
+            "a.jpg", 100, 50, [1, 2], [[0.1, 0.1, 0.2, 0.2], [0.3, 0.3, 0.4, 0.4]]
+        ),
+        tk.od.ObjectsAnnotation("b.jpg", 10, 20, [], np.zeros((0, 4))),
+        tk.od.ObjectsAnnotation(
+            "c.jpg", 30, 40, [0], [[0.5, 0.5, 0.6, 0.6]], difficults=[True]
+        ),
+    ]
+    y = tk.od.ObjectsAnnotations.from_list(y_list)
+    assert len(y) == 3
+    assert y.num_objects == 3
+    for a, b in zip(y, y_list):
+        assert a.path == b.path
+        assert (a.width, a.height) == (b.width, b.height)
+        assert (a.classes == b.classes).all()
+        assert (a.real_bboxes == b.real_bboxes).all()
+        assert (a.difficults == b.difficults).all()
+    assert (y.real_bboxes == np.concatenate([a.real_bboxes for a in y_list])).all()
+
+    sliced = y[np.array([2, 0])]
+    assert len(sliced) == 2
+    assert (sliced.offsets == [0, 1, 3]).all()
+    assert (sliced.classes == [0, 1, 2]).all()
+    assert sliced[-1].path.name == "a.jpg"
+
+    dataset = tk.data.Dataset(data=y.paths, labels=y)
+    dataset = tk.data.Dataset.concat(dataset.slice([1, 2]), dataset.slice([0]))
+    assert isinstance(dataset.labels, tk.od.ObjectsAnnotations)
+    assert (dataset.labels.classes == [0, 1, 2]).all()
+    assert dataset.get_data(2)[1].num_objects == 2
+
+    y.save(str(tmpdir.join("y.pkl")))
+    loaded = tk.od.ObjectsAnnotations.load(str(tmpdir.join("y.pkl")))
+    assert (loaded.offsets == y.offsets).all()
+    assert (loaded.bboxes == y.bboxes).all()
+
+
+def test_objects_predictions():
+    p_list = [
+        tk.od.ObjectsPrediction([1], [0.5], [[0.1, 0.1, 0.2, 0.2]]),
+        tk.od.ObjectsPrediction([], [], np.zeros((0, 4))),
+        tk.od.ObjectsPrediction([0, 2], [0.1, 0.9], [[0, 0, 1, 1], [0, 0, 0.5, 0.5]]),
+    ]
+    p = tk.od.ObjectsPredictions.from_list(p_list)
+    assert len(p) == 3
+    assert (p[2].confs == [0.1, 0.9]).all()
+    assert p[1].num_objects == 0
+    p2 = tk.od.ObjectsPredictions.concat(p[1:], p[:1])
+    assert (p2.offsets == [0, 0, 2, 3]).all()
+    assert (p2.classes == [0, 2, 1]).all()
+
+
 def test_plot_objects(data_dir, check_dir):
     img_path = data_dir / "od" / "JPEGImages" / "無題.png"
     class_name_to_id = {"～": 0, "〇": 1}
@@ -50,6 +106,37 @@ def test_plot_objects(data_dir, check_dir):
     tk.ndimage.save(check_dir / "plot_objects3.png", img)
 
 
+def test_plot_objects_batch(data_dir, tmpdir):
+    img_path = data_dir / "9ab919332a1dceff9a252b43c0fb34a0_m.jpg"
+    pred = tk.od.ObjectsPrediction(
+        classes=[0, 1], confs=[0.9, 0.3], bboxes=[[0.1, 0.1, 0.5, 0.5], [0, 0, 1, 1]]
+    )
+    imgs = tk.od.plot_objects_batch(
+        [img_path] * 3, [pred] * 3, class_names=["a", "b"], max_long_side=128
+    )
+    assert len(imgs) == 3
+    assert max(imgs[0].shape[:2]) == 128
+    expected = tk.od.plot_objects(
+        img_path, pred.classes, pred.confs, pred.bboxes, ["a", "b"], max_long_side=128
+    )
+    # JPEGはデコード時に縮小するので、縮小後のサイズは丸めの分だけ異なりうる
+    assert np.abs(np.subtract(imgs[0].shape, expected.shape)).max() <= 1
+
+    save_dir = pathlib.Path(str(tmpdir))
+    paths = tk.od.plot_objects_batch(
+        [img_path, tk.ndimage.load(img_path), img_path],
+        [pred, pred, pred],
+        conf_threshold=0.5,
+        save_dir=save_dir,
+    )
+    assert paths == [
+        save_dir / f"000000_{img_path.stem}.jpg",
+        save_dir / "000001.jpg",
+        save_dir / f"000002_{img_path.stem}.jpg",
+    ]
+    assert all(p.exists() for p in paths)
+
+
 def test_iou():
     bboxes_a = np.array([[0, 0, 200, 200], [1000, 1000, 1001, 1001]])
     bboxes_b = np.array([[100, 100, 300, 300]])
@@ -59,6 +146,30 @@ def test_iou():
     assert iou[1, 0] == 0
 
 
+def test_sparse():
+    rng = np.random.RandomState(123)
+    xy = rng.randint(0, 1000, size=(2, 500, 2))
+    wh = rng.randint(0, 50, size=(2, 500, 2))
+    bboxes_a, bboxes_b = np.concatenate([xy, xy + wh], axis=-1)
+    bboxes_b[:10] = bboxes_a[:10]  # 境界が一致するケース
+
+    iou = tk.od.compute_iou(bboxes_a, bboxes_b)
+    rows, cols, values = tk.od.compute_iou(bboxes_a, bboxes_b, sparse=True)
+    np.testing.assert_array_equal(rows, np.nonzero(iou > 0)[0])
+    np.testing.assert_array_equal(cols, np.nonzero(iou > 0)[1])
+    assert values == pytest.approx(iou[iou > 0])
+
+    inter = tk.od.is_intersection(bboxes_a, bboxes_b)
+    rows, cols = tk.od.is_intersection(bboxes_a, bboxes_b, sparse=True)
+    np.testing.assert_array_equal(rows, np.nonzero(inter)[0])
+    np.testing.assert_array_equal(cols, np.nonzero(inter)[1])
+
+    is_in = tk.od.is_in_box(bboxes_a, bboxes_b)
+    rows, cols = tk.od.is_in_box(bboxes_a, bboxes_b, sparse=True)
+    np.testing.assert_array_equal(rows, np.nonzero(is_in)[0])
+    np.testing.assert_array_equal(cols, np.nonzero(is_in)[1])
+
+
 def test_is_in_box():
     boxes_a = np.array([[100, 100, 300, 300]])
     boxes_b = np.array(
@@ -140,6 +251,26 @@ def test_od_accuracy():
         assert yp.is_match(yt.classes, yt.bboxes, conf_threshold=0.5) == m
     assert tk.od.od_accuracy(y_true, y_pred, conf_threshold=0.5) == pytest.approx(2 / 6)
 
+    precisions, recalls, _, supports = tk.od.compute_scores(
+        y_true, y_pred, conf_threshold=0.5
+    )
+    assert precisions == pytest.approx([3 / 5, 6 / 7])
+    assert recalls == pytest.approx([3 / 6, 6 / 6])
+    assert (supports == [6, 6]).all()
+
+    thresholds = [0.0, 0.5, 1.0]
+    p_list, r_list, f_list, s_list = tk.od.compute_scores_by_threshold(
+        y_true, y_pred, thresholds
+    )
+    assert p_list.shape == (3, 2)
+    for i, th in enumerate(thresholds):
+        p, r, f, s = tk.od.compute_scores(y_true, y_pred, min(th, 0.99))
+        assert p_list[i] == pytest.approx(p)
+        assert r_list[i] == pytest.approx(r)
+        assert f_list[i] == pytest.approx(f)
+        assert (s_list[i] == s).all()
+    assert 0.01 <= tk.od.search_conf_threshold(y_true, y_pred) <= 0.99
+
 
 def test_confusion_matrix():
     y_true = np.array([])
@@ -180,3 +311,28 @@ def test_confusion_matrix():
         [[0, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 0], [0, 1, 2, 0]], dtype=np.int32
     )
     assert (cm_actual == cm_expected).all()
+
+
+def test_confusion_matrix_conf_order():
+    # 確信度の順とindexの順が異なる場合
+    y_true = [
+        tk.od.ObjectsAnnotation(
+            path=".", width=100, height=100, classes=[0], bboxes=[[0.1, 0.1, 0.5, 0.5]]
+        )
+    ]
+    y_pred = [
+        tk.od.ObjectsPrediction(
+            classes=[1, 0],
+            confs=[0.1, 0.9],
+            bboxes=[
+                # index順ではIoU低の方が先
+                [0.6, 0.6, 0.9, 0.9],  # IoU低
+                [0.1, 0.1, 0.5, 0.5],  # 検知
+            ],
+        )
+    ]
+    cm_actual = tk.od.confusion_matrix(y_true, y_pred, num_classes=2)
+    # 以前は対象の絞り込み(indexの順)と並び(確信度の順)が混ざっていたため、
+    # IoU低の方がクラス違いとして数えられていた ([[0, 1, 0], [0, 0, 0], [1, 0, 0]])
+    cm_expected = np.array([[1, 0, 0], [0, 0, 0], [0, 1, 0]], dtype=np.int32)
+    assert (cm_actual == cm_expected).all()
@@ -9,7 +9,7 @@ import pandas as pd
 
 import pytoolkit as tk
 
-from .core import Model
+from .core import FoldModels, Model
 
 
 class CBModel(Model):
@@ -37,7 +37,9 @@ class CBModel(Model):
         super().__init__(nfold, models_dir, preprocessors, postprocessors)
         self.params = params
         self.cv_params = cv_params
-        self.gbms_: typing.Optional[typing.List[catboost.CatBoost]] = None
+        self.gbms_: typing.Optional[
+            typing.Union[typing.List[catboost.CatBoost], FoldModels]
+        ] = None
         self.train_pool_: catboost.Pool = None
 
     def _save(self, models_dir: pathlib.Path):
@@ -61,10 +63,9 @@ class CBModel(Model):
             gbm.load_model(model_path)
             return gbm
 
-        self.gbms_ = [
-            load(str(models_dir / f"model.fold{fold}.cbm"))
-            for fold in range(self.nfold)
-        ]
+        self.gbms_ = self._lazy_folds(
+            lambda fold: load(str(models_dir / f"model.fold{fold}.cbm"))
+        )
 
     def _cv(self, dataset: tk.data.Dataset, folds: tk.validation.FoldsType) -> None:
         import catboost
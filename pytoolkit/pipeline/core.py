@@ -1,7 +1,10 @@
 """前処理＋モデル＋後処理のパイプライン。"""
 from __future__ import annotations
 
+import collections
+import concurrent.futures
 import pathlib
+import threading
 import typing
 
 import numpy as np
@@ -46,6 +49,9 @@ class Model:
             else None
         )
         self.save_on_cv = save_on_cv
+        self.max_resident_folds: typing.Optional[int] = None
+        self.prefetch_workers = 0
+        self.fold_models_: typing.Optional[FoldModels] = None
 
     def cv(self, dataset: tk.data.Dataset, folds: tk.validation.FoldsType) -> Model:
         """CVして保存。
@@ -71,6 +77,7 @@ class Model:
                 axis=-1,
             )
 
+        self.fold_models_ = None
         self._cv(dataset, folds)
         if self.save_on_cv:
             self.save()
@@ -96,16 +103,27 @@ class Model:
         self._save(models_dir)
         return self
 
-    def load(self, models_dir: tk.typing.PathLike = None) -> Model:
+    def load(
+        self,
+        models_dir: tk.typing.PathLike = None,
+        max_resident_folds: int = None,
+        prefetch_workers: int = 0,
+    ) -> Model:
         """読み込み。
 
+        fold毎のモデルは対応しているモデルでは初回使用時に読み込む。
+
         Args:
             models_dir: 保存先ディレクトリ (Noneならself.models_dir)
+            max_resident_folds: メモリ上に保持するfoldのモデルの最大数 (Noneなら無制限)
+            prefetch_workers: predict_allで次のfoldのモデルを先読みするスレッド数 (0なら先読みしない)
 
         Returns:
             self
 
         """
+        self.max_resident_folds = max_resident_folds
+        self.prefetch_workers = prefetch_workers
         models_dir = pathlib.Path(models_dir or self.models_dir)
         models_dir.mkdir(parents=True, exist_ok=True)
         self.preprocessors = tk.utils.load(
@@ -154,7 +172,12 @@ class Model:
 
     def predict_all(self, dataset: tk.data.Dataset) -> typing.List[np.ndarray]:
         """全fold分の推論結果をリストで返す。"""
-        return [self.predict(dataset, fold) for fold in range(self.nfold)]
+        pred_list = []
+        for fold in range(self.nfold):
+            if self.fold_models_ is not None:
+                self.fold_models_.prefetch(range(fold, self.nfold))
+            pred_list.append(self.predict(dataset, fold))
+        return pred_list
 
     def predict(self, dataset: tk.data.Dataset, fold: int) -> np.ndarray:
         """推論結果を返す。
@@ -186,6 +209,30 @@ class Model:
 
         return pred
 
+    def _lazy_folds(
+        self,
+        load_fn: typing.Callable[[int], typing.Any],
+        unload_fn: typing.Callable[[int, typing.Any], None] = None,
+    ) -> FoldModels:
+        """_load用。fold毎のモデルを初回使用時に読み込むFoldModelsを作成する。
+
+        Args:
+            load_fn: foldを受け取ってモデルを読み込む関数
+            unload_fn: モデルを破棄するときにfoldとモデルを受け取って呼ばれる関数
+
+        Returns:
+            FoldModels (self.fold_models_にも保持する)
+
+        """
+        self.fold_models_ = FoldModels(
+            load_fn,
+            self.nfold,
+            max_resident=self.max_resident_folds,
+            prefetch_workers=self.prefetch_workers,
+            unload_fn=unload_fn,
+        )
+        return self.fold_models_
+
     def _save(self, models_dir: pathlib.Path):
         """保存。
 
@@ -226,3 +273,150 @@ class Model:
 
         """
         raise NotImplementedError()
+
+
+class FoldModels(typing.Sequence):
+    """fold毎のモデルを初回アクセス時に読み込むリスト風のクラス。
+
+    max_residentを指定した場合は最近使われていないものから破棄し、
+    破棄したモデルは次にアクセスされたときに再度読み込む。
+
+    Args:
+        load_fn: foldを受け取ってモデルを読み込む関数
+        nfold: foldの数
+        max_resident: メモリ上に保持するモデルの最大数 (Noneなら無制限)
+        prefetch_workers: 先読み用のスレッド数 (0なら先読みしない)。
+                          load_fnがスレッドセーフでない場合は0のままにする。
+        unload_fn: モデルを破棄するときにfoldとモデルを受け取って呼ばれる関数
+
+    """
+
+    def __init__(
+        self,
+        load_fn: typing.Callable[[int], typing.Any],
+        nfold: int,
+        max_resident: int = None,
+        prefetch_workers: int = 0,
+        unload_fn: typing.Callable[[int, typing.Any], None] = None,
+    ):
+        assert max_resident is None or max_resident >= 1
+        self.load_fn = load_fn
+        self.nfold = nfold
+        self.max_resident = max_resident
+        self.prefetch_workers = prefetch_workers
+        self.unload_fn = unload_fn
+        self._lock = threading.Lock()
+        self._futures: typing.MutableMapping[
+            int, concurrent.futures.Future
+        ] = collections.OrderedDict()
+        self._executor = (
+            concurrent.futures.ThreadPoolExecutor(prefetch_workers)
+            if prefetch_workers > 0
+            else None
+        )
+
+    def __len__(self) -> int:
+        return self.nfold
+
+    def __getitem__(self, fold):
+        if not isinstance(fold, (int, np.integer)):
+            raise TypeError(f"fold must be int: {fold!r}")
+        if fold < 0:
+            fold += self.nfold
+        if not 0 <= fold < self.nfold:
+            raise IndexError(f"fold out of range: {fold}")
+
+        with self._lock:
+            future = self._futures.get(fold)
+            if future is None:
+                future = concurrent.futures.Future()
+                self._insert(fold, future)
+                load_here = True
+            else:
+                self._futures.move_to_end(fold)  # type: ignore
+                load_here = False
+        if load_here:
+            self._run_load(fold, future)
+        return future.result()
+
+    @property
+    def resident_folds(self) -> typing.List[int]:
+        """読み込み済み(読み込み中含む)のfoldのリスト。(古い順)"""
+        with self._lock:
+            return list(self._futures)
+
+    def prefetch(self, folds: typing.Sequence[int]) -> None:
+        """指定foldのモデルをバックグラウンドで読み込む。
+
+        foldsの先頭はこれから使うfoldとし、それに続くprefetch_workers個までを先読みする。
+        (ただしmax_residentを超えない範囲まで)
+        先読み対象は最近使われたものとして扱うので、先読みによって破棄されることはない。
+
+        Args:
+            folds: これから使うfold (先頭から優先)
+
+        """
+        if self._executor is None:
+            return
+        limit = self.prefetch_workers + 1
+        if self.max_resident is not None:
+            limit = min(limit, self.max_resident)
+        targets = list(folds)[:limit]
+        with self._lock:
+            for fold in targets:
+                if fold in self._futures:
+                    self._futures.move_to_end(fold)  # type: ignore
+            for fold in targets:
+                if fold not in self._futures:
+                    future: concurrent.futures.Future = concurrent.futures.Future()
+                    self._insert(fold, future)
+                    self._executor.submit(self._run_load, fold, future)
+
+    def unload(self, fold: int) -> None:
+        """指定foldのモデルを破棄する。(次回アクセス時に再度読み込む)"""
+        with self._lock:
+            future = self._futures.pop(fold, None)
+        if future is not None:
+            self._release(fold, future)
+
+    def put(self, fold: int, model: typing.Any) -> None:
+        """読み込み済みのモデルを登録する。(最近使われたものとして扱う)"""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.set_result(model)
+        with self._lock:
+            old_future = self._futures.pop(fold, None)
+            self._insert(fold, future)
+        if old_future is not None:
+            self._release(fold, old_future)
+
+    def _insert(self, fold, future):
+        """futureを登録し、上限を超えた分を破棄する。(要ロック)"""
+        self._futures[fold] = future
+        evicted = []
+        while self.max_resident is not None and len(self._futures) > self.max_resident:
+            evicted.append(self._futures.popitem(last=False))  # type: ignore
+        for old_fold, old_future in evicted:
+            self._release(old_fold, old_future)
+
+    def _run_load(self, fold, future):
+        """読み込みを実行してfutureに結果を設定する。"""
+        try:
+            future.set_result(self.load_fn(fold))
+        except BaseException as e:
+            with self._lock:
+                if self._futures.get(fold) is future:
+                    del self._futures[fold]
+            future.set_exception(e)
+
+    def _release(self, fold, future):
+        """破棄したモデルの後始末。"""
+        if self.unload_fn is None:
+            return
+        unload_fn = self.unload_fn
+
+        def _on_done(f):
+            if f.exception() is None:
+                unload_fn(fold, f.result())
+
+        # 読み込み中のものは読み込み完了後に呼ぶ
+        future.add_done_callback(_on_done)
@@ -46,3 +46,72 @@ def test_predict(output_count, tmpdir):
         assert len(result) == 2
         assert (result[0] == dataset.data).all()
         assert (result[1] == np.array([1, 2, 0])).all()
+
+
+def test_fold_models():
+    loaded = []
+    unloaded = []
+
+    def load_fn(fold):
+        loaded.append(fold)
+        return f"model{fold}"
+
+    fold_models = tk.pipeline.FoldModels(
+        load_fn, nfold=4, max_resident=2, unload_fn=lambda f, m: unloaded.append(m)
+    )
+    assert loaded == []  # 初回アクセスまで読み込まない
+    assert fold_models[1] == "model1"
+    assert fold_models[1] == "model1"
+    assert loaded == [1]
+    assert fold_models[-1] == "model3"
+    assert fold_models.resident_folds == [1, 3]
+    assert fold_models[1] == "model1"  # 1を最近使ったものにする
+    assert fold_models[0] == "model0"  # 3が破棄される
+    assert fold_models.resident_folds == [1, 0]
+    assert unloaded == ["model3"]
+    assert list(fold_models) == ["model0", "model1", "model2", "model3"]
+    assert loaded == [1, 3, 0, 2, 3]
+    with pytest.raises(IndexError):
+        fold_models[4]  # pylint: disable=pointless-statement
+
+
+def test_predict_all_prefetch(tmpdir):
+    # pylint: disable=abstract-method
+    dataset = tk.data.Dataset(data=np.arange(3))
+    loaded = []
+
+    class TestModel(tk.pipeline.Model):
+        def _load(self, models_dir):
+            def load_fn(fold):
+                loaded.append(fold)
+                return fold
+
+            self.models_ = self._lazy_folds(load_fn)
+
+        def _predict(self, dataset: tk.data.Dataset, fold: int) -> np.ndarray:
+            return dataset.data * self.models_[fold]
+
+    model = TestModel(nfold=5, models_dir=str(tmpdir))
+    model.load(max_resident_folds=2, prefetch_workers=2)
+    assert loaded == []
+    result = model.predict_all(dataset)
+    assert [r.tolist() for r in result] == [[0, fold, fold * 2] for fold in range(5)]
+    assert sorted(loaded) == [0, 1, 2, 3, 4]
+    assert len(model.fold_models_.resident_folds) <= 2
+
+
+def test_fold_models_put():
+    unloaded = []
+    fold_models = tk.pipeline.FoldModels(
+        lambda fold: f"model{fold}",
+        nfold=3,
+        max_resident=2,
+        unload_fn=lambda f, m: unloaded.append(m),
+    )
+    fold_models.put(0, "memory0")
+    fold_models.put(1, "memory1")
+    assert fold_models[0] == "memory0"  # 読み込まずにそのまま使う
+    assert fold_models[2] == "model2"  # 最近使われていないfold 1が破棄される
+    assert fold_models.resident_folds == [0, 2]
+    assert unloaded == ["memory1"]
+    assert fold_models[1] == "model1"  # 再度読み込まれる
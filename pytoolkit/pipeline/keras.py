@@ -1,8 +1,10 @@
 """Keras"""
 from __future__ import annotations
 
+import functools
 import gc
 import pathlib
+import shutil
 import typing
 
 import numpy as np
@@ -36,11 +38,29 @@ class KerasModel(Model):
         use_horovod: 推論時にMPIによる分散処理をするか否か。(学習時は常にTrue)
         num_replicas_in_sync: tf.distributeするなら指定する。
         parallel_cv: lgb.cvなどのように全foldまとめて処理するならTrue
+        runtime: 推論に使うランタイム。Noneならtf.keras。
+                 "tflite", "tflite_int8", "onnx"ならtk-convert-modelで変換済みのファイルを
+                 tk.models.load_predictorで読み込んで使う。(loadした場合のみ。evaluateは未対応)
+        runtime_threads: runtime指定時の推論に使うスレッド数 (Noneならランタイムの既定値)
+        resume_freq: 途中再開用の状態を保存するエポック数の間隔。0なら保存しない。
+                     models_dir/resume.fold{fold}に保存し、学習が中断されたらそこから再開する。
+                     (学習完了時に削除する。refineは対象外)
+        max_memory_ratio: 推論後にホストメモリの使用率がこれを超えていたらメモリが逼迫しているとみなし、
+                          最近使われていないfoldのモデルから破棄する。(Linuxのみ。Noneなら見ない)
+                          逼迫していなければモデル(と推論用のtf.function)は使い回す。
+        gpu_memory_limit: 推論後にGPUメモリの使用量(バイト数)がこれを超えていたらメモリが逼迫しているとみなす。
+                          (tf.config.experimental.get_memory_infoが使える場合のみ。Noneなら見ない)
 
     Attributes:
         training_models: 訓練用モデル
         prediction_models: 推論用モデル
 
+    load()した場合、モデルは各foldの初回の推論・評価時に読み込む(self.fold_models_で管理する)ので、
+    それまでtraining_models・prediction_modelsの要素はNoneのまま。
+    またメモリ逼迫時などに破棄されるとNoneに戻る。
+    runtimeを指定した場合、prediction_modelsの要素はtk.models.load_predictorの戻り値になり、
+    training_modelsの要素はNoneになる。
+
     model_name_formatに"{fold}"が含まれない名前を指定した場合、
     cvではなくtrainを使うモードということにする。
 
@@ -76,6 +96,11 @@ class KerasModel(Model):
         num_replicas_in_sync: int = 1,
         parallel_cv: bool = False,
         on_batch_fn: tk.models.OnBatchFnType = None,
+        runtime: str = None,
+        runtime_threads: int = None,
+        resume_freq: int = 0,
+        max_memory_ratio: float = None,
+        gpu_memory_limit: int = None,
         preprocessors: tk.pipeline.EstimatorListType = None,
         postprocessors: tk.pipeline.EstimatorListType = None,
     ):
@@ -100,20 +125,28 @@ class KerasModel(Model):
         self.num_replicas_in_sync = num_replicas_in_sync
         self.parallel_cv = parallel_cv
         self.on_batch_fn = on_batch_fn
+        self.runtime = runtime
+        self.runtime_threads = runtime_threads
+        self.resume_freq = resume_freq
+        self.max_memory_ratio = max_memory_ratio
+        self.gpu_memory_limit = gpu_memory_limit
         self.training_models: typing.List[tf.keras.models.Model] = [None] * nfold
         self.prediction_models: typing.List[tf.keras.models.Model] = [None] * nfold
         if self.parallel_cv:
             assert self.refine_data_loader is None, "NotImplemented"
         if "{fold}" not in self.model_name_format:
             assert nfold == 1
+        assert runtime in (None, "tflite", "tflite_int8", "onnx")
 
     def _save(self, models_dir: pathlib.Path):
         for fold in range(self.nfold):
             self._save_model(fold, models_dir)
 
     def _load(self, models_dir: pathlib.Path):
-        for fold in range(self.nfold):
-            self._load_model(fold, models_dir)
+        self._lazy_folds(
+            functools.partial(self._load_network, models_dir=models_dir),
+            unload_fn=self._unload_network,
+        )
 
     def _save_model(self, fold, models_dir=None):
         models_dir = models_dir or self.models_dir
@@ -126,6 +159,43 @@ class KerasModel(Model):
         model_path = models_dir / self.model_name_format.format(fold=fold + 1)
         tk.models.load_weights(self.prediction_models[fold], model_path)
 
+    def _load_network(self, fold, models_dir):
+        """遅延読み込み用。(訓練用モデル, 推論用モデル)を作成して重みを読み込む。"""
+        model_path = models_dir / self.model_name_format.format(fold=fold + 1)
+        if self.runtime is not None:
+            # 変換済みのファイルを推論専用に読み込む (tk-convert-modelの出力ファイル名に合わせる)
+            suffix = {
+                "tflite": ".tflite",
+                "tflite_int8": ".int8.tflite",
+                "onnx": ".onnx",
+            }
+            predictor = tk.models.load_predictor(
+                model_path.with_suffix(suffix[self.runtime]),
+                num_threads=self.runtime_threads,
+            )
+            return None, predictor
+        network = self._create_network_pair()
+        tk.models.load_weights(network[1], model_path)
+        return network
+
+    def _unload_network(self, fold, network):
+        """遅延読み込みしたモデルの破棄。"""
+        if self.prediction_models[fold] is network[1]:
+            self.training_models[fold] = None
+            self.prediction_models[fold] = None
+        # キャッシュされたtf.functionも明示的に破棄する (モデルとの循環参照を切る)
+        for model in network:
+            for name in ("train_function", "test_function", "predict_function"):
+                if hasattr(model, name):
+                    setattr(model, name, None)
+        gc.collect()
+
+    def _require_model(self, fold: int) -> None:
+        """遅延読み込みの場合、指定foldのモデルを読み込んでself.*_modelsに設定する。"""
+        if self.fold_models_ is not None:
+            network = self.fold_models_[fold]
+            self.training_models[fold], self.prediction_models[fold] = network
+
     def _cv(self, dataset: tk.data.Dataset, folds: tk.validation.FoldsType) -> None:
         assert len(folds) == self.nfold
         if self.parallel_cv:
@@ -260,6 +330,7 @@ class KerasModel(Model):
             tk.log.get(__name__).info(f"cv {k}: {v:,.3f}")
 
     def _predict(self, dataset: tk.data.Dataset, fold: int) -> np.ndarray:
+        self._require_model(fold)
         pred = tk.models.predict(
             self.prediction_models[fold],
             dataset,
@@ -268,8 +339,7 @@ class KerasModel(Model):
             num_replicas_in_sync=self.num_replicas_in_sync,
             on_batch_fn=self.on_batch_fn,
         )
-        # メモリを食いがちなので再構築してみる
-        self._rebuild_model(fold)
+        self._release_if_memory_pressure(fold)
         return pred
 
     def check(self) -> KerasModel:
@@ -352,6 +422,11 @@ class KerasModel(Model):
 
             # fit
             tk.hvd.barrier()
+            resume_dir = self.models_dir / f"resume.fold{fold + 1}"
+            fit_params = dict(self.fit_params or {})
+            if self.resume_freq > 0:
+                fit_params["resume_dir"] = resume_dir
+                fit_params["resume_freq"] = self.resume_freq
             if self.epochs > 0:
                 tk.models.fit(
                     self.training_models[fold],
@@ -362,7 +437,7 @@ class KerasModel(Model):
                     epochs=self.epochs,
                     callbacks=self.callbacks,
                     num_replicas_in_sync=self.num_replicas_in_sync,
-                    **(self.fit_params or {}),
+                    **fit_params,
                 )
 
             # refine
@@ -393,6 +468,8 @@ class KerasModel(Model):
 
             # 保存 TODO: preprocessorsなどが。。
             self._save_model(fold)
+            if resume_dir.exists() and tk.hvd.is_master():
+                shutil.rmtree(resume_dir)
 
         # 訓練データと検証データの評価
         tk.hvd.barrier()
@@ -428,6 +505,8 @@ class KerasModel(Model):
         assert self.preprocessors is None  # とりあえず未対応
         assert self.postprocessors is None  # とりあえず未対応
 
+        self._require_model(fold)
+        assert self.training_models[fold] is not None, "runtime is not supported"
         # 未コンパイルならmetricsが無いかもしれないのでcompile
         if self.training_models[fold].optimizer is None:
             assert self.compile_fn is not None
@@ -460,6 +539,7 @@ class KerasModel(Model):
         """
         assert self.preprocessors is None  # とりあえず未対応
         assert self.postprocessors is None  # とりあえず未対応
+        self._require_model(fold)
         return tk.models.predict_flow(
             self.prediction_models[fold],
             dataset,
@@ -473,15 +553,88 @@ class KerasModel(Model):
         if self.training_models[fold] is not None:  # 既にあればそれを使う
             assert self.prediction_models[fold] is not None
         else:
-            network = self.create_network_fn()
-            if not isinstance(network, tuple):
-                network = network, network
+            network = self._create_network_pair()
             self.training_models[fold] = network[0]
             self.prediction_models[fold] = network[1]
 
+    def _create_network_pair(
+        self,
+    ) -> typing.Tuple[tf.keras.models.Model, tf.keras.models.Model]:
+        """(訓練用モデル, 推論用モデル)の作成。"""
+        network = self.create_network_fn()
+        if not isinstance(network, tuple):
+            network = network, network
+        return network
+
+    def _release_if_memory_pressure(self, fold: int) -> None:
+        """メモリが逼迫していたら、最近使われていないfoldのモデルから順に破棄する。
+
+        破棄したモデルは次回使用時に保存済みのファイルから読み込み直す。
+        (読み込んだモデルはFoldModelsで管理されるので、Model.loadのmax_resident_foldsで常駐数も制限できる)
+
+        Args:
+            fold: 直前に使用したfold
+
+        """
+        if not _memory_pressure(self.max_memory_ratio, self.gpu_memory_limit):
+            return
+        if self.fold_models_ is None:
+            # 学習直後などでメモリ上にしか無いモデルは破棄できない
+            model_paths = [
+                self.models_dir / self.model_name_format.format(fold=f + 1)
+                for f in range(self.nfold)
+            ]
+            if not all(p.exists() for p in model_paths):
+                return
+            # 遅延読み込みに切り替えて、メモリ上のモデルを引き継ぐ (直前に使用したfoldを最新とする)
+            self._load(self.models_dir)
+            assert self.fold_models_ is not None
+            for f in sorted(range(self.nfold), key=lambda i: i == fold):
+                if self.prediction_models[f] is not None:
+                    self.fold_models_.put(
+                        f, (self.training_models[f], self.prediction_models[f])
+                    )
+        assert self.fold_models_ is not None
+        for f in self.fold_models_.resident_folds:
+            tk.log.get(__name__).info(f"Memory pressure detected: releasing fold {f}")
+            self.fold_models_.unload(f)
+            if not _memory_pressure(self.max_memory_ratio, self.gpu_memory_limit):
+                break
+
     def _rebuild_model(self, fold: int) -> None:
         """メモリ節約のための処理。"""
         self.training_models[fold] = None
         self.prediction_models[fold] = None
         gc.collect()
-        self._load_model(fold)
+        if self.fold_models_ is not None:
+            # 遅延読み込みの場合は次回使用時に読み込み直す
+            self.fold_models_.unload(fold)
+        else:
+            self._load_model(fold)
+
+
+def _memory_pressure(
+    max_memory_ratio: typing.Optional[float], gpu_memory_limit: int = None
+) -> bool:
+    """メモリが逼迫しているか否かを返す。"""
+    if max_memory_ratio is not None:
+        try:
+            meminfo = dict(
+                line.split(":", 1)
+                for line in pathlib.Path("/proc/meminfo").read_text().splitlines()
+            )
+            total = int(meminfo["MemTotal"].split()[0])
+            available = int(meminfo["MemAvailable"].split()[0])
+            if 1 - available / total > max_memory_ratio:
+                return True
+        except (OSError, KeyError, ValueError):
+            pass  # Linux以外は未対応
+    if gpu_memory_limit is not None and hasattr(
+        tf.config.experimental, "get_memory_info"
+    ):
+        gpus = tf.config.experimental.list_logical_devices("GPU")
+        for i in range(len(gpus)):
+            info = tf.config.experimental.get_memory_info(f"GPU:{i}")
+            if info["current"] > gpu_memory_limit:
+                return True
+    return False
@@ -1,6 +1,7 @@
 import pathlib
 
 import numpy as np
+import pytest
 import tensorflow as tf
 
 import pytoolkit as tk
@@ -12,6 +13,7 @@ def test_keras_xor(tmpdir):
     X = np.array([[0, 0], [0, 1], [1, 0], [1, 1]], dtype=np.float32)
     y = np.array([0, 1, 1, 0], dtype=np.int32)
     train_set = tk.data.Dataset(X.repeat(4096, axis=0), y.repeat(4096, axis=0))
+    created = []
 
     def create_network() -> tf.keras.models.Model:
         inputs = x = tf.keras.layers.Input(shape=(2,))
@@ -23,6 +25,7 @@ def test_keras_xor(tmpdir):
         tk.models.compile(
             model, "adam", "binary_crossentropy", [tk.metrics.binary_accuracy]
         )
+        created.append(model)
         return model
 
     model = tk.pipeline.KerasModel(
@@ -49,3 +52,17 @@ def test_keras_xor(tmpdir):
 
     y_pred = np.squeeze((proba > 0.5).astype(np.int32), axis=-1)
     assert (y_pred == y).all()
+
+    # メモリが逼迫していなければ推論毎にモデルを作り直さない
+    num_created = len(created)
+    proba2 = model.predict(tk.data.Dataset(X, y), fold=0)
+    assert len(created) == num_created
+    assert proba2 == pytest.approx(proba)
+
+    # メモリが逼迫していたら破棄して、次回は保存済みのファイルから読み込み直す
+    model.max_memory_ratio = -1
+    model.predict(tk.data.Dataset(X, y), fold=0)
+    assert model.prediction_models[0] is None
+    proba3 = model.predict(tk.data.Dataset(X, y), fold=0)
+    assert len(created) == num_created + 1
+    assert proba3 == pytest.approx(proba, abs=1e-5)
@@ -10,7 +10,7 @@ import sklearn.metrics
 
 import pytoolkit as tk
 
-from .core import Model
+from .core import FoldModels, Model
 
 
 class LGBModel(Model):
@@ -54,7 +54,7 @@ class LGBModel(Model):
         self.cv_params = cv_params
         self.seeds = seeds
         self.init_score = init_score
-        self.gbms_: np.ndarray = None
+        self.gbms_: typing.Union[np.ndarray, FoldModels] = None
 
     def _save(self, models_dir: pathlib.Path):
         seeds = [123] if self.seeds is None else self.seeds
@@ -75,17 +75,16 @@ class LGBModel(Model):
         import lightgbm as lgb
 
         seeds = [123] if self.seeds is None else self.seeds
-        self.gbms_ = np.array(
-            [
-                [
-                    lgb.Booster(
-                        model_file=str(models_dir / f"model.fold{fold}.seed{seed}.txt")
-                    )
-                    for seed in seeds
-                ]
-                for fold in range(self.nfold)
+
+        def load(fold):
+            return [
+                lgb.Booster(
+                    model_file=str(models_dir / f"model.fold{fold}.seed{seed}.txt")
+                )
+                for seed in seeds
             ]
-        )
+
+        self.gbms_ = self._lazy_folds(load)
 
     def _cv(self, dataset: tk.data.Dataset, folds: tk.validation.FoldsType) -> None:
         import lightgbm as lgb
@@ -161,7 +160,7 @@ class LGBModel(Model):
         pred = np.mean(
             [
                 gbm.predict(_get_data(gbm), num_iteration=gbm.best_iteration,)
-                for gbm in self.gbms_[fold, :]
+                for gbm in self.gbms_[fold]
             ],
             axis=0,
         )
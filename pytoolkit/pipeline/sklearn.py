@@ -4,6 +4,7 @@ from __future__ import annotations
 import pathlib
 import typing
 
+import joblib
 import numpy as np
 import sklearn.base
 
@@ -22,6 +23,9 @@ class SKLearnModel(Model):
         weights_arg_name: tk.data.Dataset.weightsを使う場合の引数名
                           (pipelineなどで変わるので。例: "transformedtargetregressor__sample_weight")
         predict_method: "predict" or "predict_proba"
+        n_jobs: cvで並列に学習・評価するfold数。(joblibのlokyバックエンドのプロセスプールを使う)
+                1なら並列化しない。シングルスレッドのモデル(線形モデルやkNNなど)向け。
+                データセットのndarrayはmemmapで各プロセスと共有する。
 
     """
 
@@ -32,6 +36,7 @@ class SKLearnModel(Model):
         models_dir: tk.typing.PathLike,
         weights_arg_name: str = "sample_weight",
         predict_method: str = "predict",
+        n_jobs: int = 1,
         preprocessors: tk.pipeline.EstimatorListType = None,
         postprocessors: tk.pipeline.EstimatorListType = None,
     ):
@@ -39,6 +44,7 @@ class SKLearnModel(Model):
         self.estimator = estimator
         self.weights_arg_name = weights_arg_name
         self.predict_method = predict_method
+        self.n_jobs = n_jobs
         self.estimators_: typing.Optional[
             typing.List[sklearn.base.BaseEstimator]
         ] = None
@@ -50,28 +56,37 @@ class SKLearnModel(Model):
         self.estimators_ = tk.utils.load(models_dir / "estimators.pkl")
 
     def _cv(self, dataset: tk.data.Dataset, folds: tk.validation.FoldsType) -> None:
-        scores = []
-        score_weights = []
-        self.estimators_ = []
-        for train_indices, val_indices in tk.utils.tqdm(folds, desc="cv"):
-            train_set = dataset.slice(train_indices)
-            val_set = dataset.slice(val_indices)
-
-            kwargs = {}
-            if train_set.weights is not None:
-                kwargs[self.weights_arg_name] = train_set.weights
-
-            estimator = sklearn.base.clone(self.estimator)
-            estimator.fit(train_set.data, train_set.labels, **kwargs)
-            self.estimators_.append(estimator)
-
-            kwargs = {}
-            if val_set.weights is not None:
-                kwargs[self.weights_arg_name] = val_set.weights
-
-            scores.append(estimator.score(val_set.data, val_set.labels, **kwargs))
-            score_weights.append(len(val_set))
-
+        if self.n_jobs == 1:
+            results = [
+                _cv_fold(
+                    self.estimator,
+                    dataset,
+                    train_indices,
+                    val_indices,
+                    self.weights_arg_name,
+                )
+                for train_indices, val_indices in tk.utils.tqdm(folds, desc="cv")
+            ]
+        else:
+            # max_nbytes以上のndarrayは一時ファイルにdumpされ、各プロセスでmemmapとして読み込まれる。
+            # (同じndarrayのdumpは1回だけなので、fold毎にpickleして送るよりメモリも時間も少なくて済む)
+            with joblib.Parallel(
+                n_jobs=self.n_jobs, backend="loky", max_nbytes="1M", mmap_mode="r"
+            ) as parallel:
+                results = parallel(
+                    joblib.delayed(_cv_fold)(
+                        self.estimator,
+                        dataset,
+                        train_indices,
+                        val_indices,
+                        self.weights_arg_name,
+                    )
+                    for train_indices, val_indices in folds
+                )
+
+        self.estimators_ = [estimator for estimator, _, _ in results]
+        scores = [score for _, score, _ in results]
+        score_weights = [score_weight for _, _, score_weight in results]
         tk.log.get(__name__).info(
             f"cv score: {np.average(scores, weights=score_weights):,.3f}"
         )
@@ -84,3 +99,28 @@ class SKLearnModel(Model):
             return self.estimators_[fold].predict_proba(dataset.data)
         else:
             raise ValueError(f"predict_method={self.predict_method}")
+
+
+def _cv_fold(estimator, dataset, train_indices, val_indices, weights_arg_name):
+    """1fold分の学習と評価。(プロセスプール用)
+
+    Returns:
+        学習済みのモデル、スコア、スコアの重み(検証データの件数)のtuple
+
+    """
+    train_set = dataset.slice(train_indices)
+    val_set = dataset.slice(val_indices)
+
+    kwargs = {}
+    if train_set.weights is not None:
+        kwargs[weights_arg_name] = train_set.weights
+
+    estimator = sklearn.base.clone(estimator)
+    estimator.fit(train_set.data, train_set.labels, **kwargs)
+
+    kwargs = {}
+    if val_set.weights is not None:
+        kwargs[weights_arg_name] = val_set.weights
+
+    score = estimator.score(val_set.data, val_set.labels, **kwargs)
+    return estimator, score, len(val_set)
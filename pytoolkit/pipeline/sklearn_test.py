@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+import sklearn.linear_model
+
+import pytoolkit as tk
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_cv(n_jobs, tmpdir):
+    X = np.random.uniform(size=(100, 4))
+    y = X @ np.array([1.0, 2.0, 3.0, 4.0])
+    dataset = tk.data.Dataset(data=X, labels=y)
+    folds = tk.validation.split(dataset, nfold=4, stratify=False)
+
+    model = tk.pipeline.SKLearnModel(
+        sklearn.linear_model.Ridge(alpha=1e-3),
+        nfold=len(folds),
+        models_dir=str(tmpdir),
+        n_jobs=n_jobs,
+    )
+    model.cv(dataset, folds)
+    assert model.estimators_ is not None
+    assert len(model.estimators_) == len(folds)
+    for estimator, (train_indices, _) in zip(model.estimators_, folds):
+        expected = sklearn.linear_model.Ridge(alpha=1e-3)
+        expected.fit(X[train_indices], y[train_indices])
+        assert estimator.coef_ == pytest.approx(expected.coef_)
+
+    pred = model.predict_oof(dataset, folds)
+    assert pred == pytest.approx(y, abs=0.1)
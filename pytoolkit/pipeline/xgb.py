@@ -10,7 +10,7 @@ import sklearn.metrics
 
 import pytoolkit as tk
 
-from .core import Model
+from .core import FoldModels, Model
 
 
 class XGBModel(Model):
@@ -50,19 +50,28 @@ class XGBModel(Model):
         self.verbose_eval = verbose_eval
         self.callbacks = callbacks
         self.cv_params = cv_params
-        self.gbms_: typing.Optional[typing.List[xgboost.Booster]] = None
+        self.gbms_: typing.Optional[
+            typing.Union[typing.List[xgboost.Booster], FoldModels]
+        ] = None
         self.best_ntree_limit_: typing.Optional[int] = None
 
     def _save(self, models_dir: pathlib.Path):
         assert self.gbms_ is not None
-        tk.utils.dump(self.gbms_, models_dir / f"model.pkl")
+        for fold, gbm in enumerate(self.gbms_):
+            tk.utils.dump(gbm, models_dir / f"model.fold{fold}.pkl")
         tk.utils.dump(self.best_ntree_limit_, models_dir / f"best_ntree_limit.pkl")
         # ついでにfeature_importanceも。
         df_importance = self.feature_importance()
         df_importance.to_excel(str(models_dir / "feature_importance.xlsx"))
 
     def _load(self, models_dir: pathlib.Path):
-        self.gbms_ = tk.utils.load(models_dir / f"model.pkl")
+        if (models_dir / "model.fold0.pkl").exists():
+            self.gbms_ = self._lazy_folds(
+                lambda fold: tk.utils.load(models_dir / f"model.fold{fold}.pkl")
+            )
+        else:
+            # 全foldまとめて保存していた頃の形式
+            self.gbms_ = tk.utils.load(models_dir / "model.pkl")
         self.best_ntree_limit_ = tk.utils.load(models_dir / f"best_ntree_limit.pkl")
         assert self.gbms_ is not None
         assert len(self.gbms_) == self.nfold
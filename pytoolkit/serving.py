@@ -0,0 +1,309 @@
+"""推論サーバー関連。
+
+同時に来た推論リクエストをまとめてミニバッチで推論する。
+
+使用例::
+
+    async def main():
+        model = tk.models.load("model.h5")
+        predictor = tk.serving.BatchingPredictor(model, data_loader)
+        await predictor.start()
+        stats_server = await tk.serving.serve_stats(predictor, port=8001)
+        ...
+        pred = await predictor.predict(data)  # Webフレームワークのハンドラなどから呼ぶ
+        ...
+        stats_server.close()
+        await predictor.stop()
+
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+import typing
+
+import numpy as np
+
+import pytoolkit as tk
+
+
+class BatchingPredictor:
+    """同時に来たリクエストをまとめてミニバッチで推論するクラス。(asyncio用)
+
+    最初のリクエストから最大max_wait秒だけ他のリクエストを待ち、
+    max_batch_size件までまとめてmodel.predict_on_batchする。
+    前処理(data_loader.get_data・get_sample)はスレッドプールで並列に行う。
+
+    Args:
+        model: モデル (predict_on_batchを持つもの。tk.models.loadしたものなど)
+        data_loader: 前処理に使うDataLoader
+        max_batch_size: 最大バッチサイズ (Noneならdata_loader.batch_size)
+        max_wait: 最初のリクエストから推論開始までに他のリクエストを待つ最大秒数
+        max_queue_size: キューの最大長 (0なら無制限)
+        on_batch_fn: モデルとミニバッチ分の入力データを受け取り、推論結果を返す処理。(TTA用)
+        stats_window: 統計情報(レイテンシのパーセンタイルなど)の算出に使う直近のリクエスト数
+
+    """
+
+    def __init__(
+        self,
+        model,
+        data_loader: tk.data.DataLoader,
+        max_batch_size: int = None,
+        max_wait: float = 0.005,
+        max_queue_size: int = 0,
+        on_batch_fn: tk.models.OnBatchFnType = None,
+        stats_window: int = 1000,
+    ):
+        self.model = model
+        self.data_loader = data_loader
+        self.max_batch_size = max_batch_size or data_loader.batch_size
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.on_batch_fn = on_batch_fn
+        self.stats = ServingStats(window=stats_window)
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._task: typing.Optional[asyncio.Task] = None
+        # 収集中・推論中のバッチ (停止時にキャンセルするため保持する)
+        self._batch: typing.List[typing.Tuple[typing.Any, asyncio.Future, float]] = []
+        self._model_executor: typing.Optional[
+            concurrent.futures.ThreadPoolExecutor
+        ] = None
+
+    async def start(self) -> BatchingPredictor:
+        """バッチ処理のタスクを開始する。
+
+        Returns:
+            self
+
+        """
+        assert self._task is None
+        self._queue = asyncio.Queue(self.max_queue_size)
+        # モデルは同時に1バッチずつ推論する
+        self._model_executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        """バッチ処理のタスクを停止する。(処理中・処理待ちのリクエストはキャンセルする)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        assert self._queue is not None and self._model_executor is not None
+        # 推論中のものがあれば終わるまで待つ (イベントループは止めない)
+        await asyncio.get_running_loop().run_in_executor(
+            tk.threading.get_pool(), self._model_executor.shutdown
+        )
+        for _, future, _ in self._batch:
+            future.cancel()
+        self._batch = []
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            future.cancel()
+        self._task = None
+        self._queue = None
+        self._model_executor = None
+
+    async def predict(self, data) -> tk.models.ModelIOType:
+        """1件分の推論。
+
+        Args:
+            data: 1件分の入力データ (tk.data.Datasetのdataの1要素に相当するもの)
+
+        Returns:
+            1件分の推論結果
+
+        """
+        queue = self._queue
+        assert queue is not None, "start() has not been called"
+        start_time = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        X = await loop.run_in_executor(tk.threading.get_pool(), self._preprocess, data)
+        future = loop.create_future()
+        if self._queue is queue:
+            await queue.put((X, future, start_time))
+        if self._queue is not queue:
+            future.cancel()  # 前処理中などにstop()された
+        return await future
+
+    def _preprocess(self, data):
+        """DataLoaderによる前処理。"""
+        dataset = tk.data.Dataset(data=[data])
+        sample = self.data_loader.get_sample([self.data_loader.get_data(dataset, 0)])
+        return sample[0]
+
+    async def _run(self):
+        """リクエストをまとめて推論するループ。"""
+        while True:
+            try:
+                await self._run_batch()
+            except asyncio.CancelledError:
+                raise  # 処理中のバッチはstop()でキャンセルする
+            except Exception as e:
+                # 失敗したらそのバッチのリクエストに例外を返して続行する (ループは止めない)
+                self.stats.add_error(len(self._batch))
+                for _, future, _ in self._batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self._batch = []
+
+    async def _run_batch(self):
+        """リクエストを1バッチ分まとめて推論する。"""
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        batch = self._batch
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 待っている間に溜まった分も上限まで詰める
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+        batch[:] = [item for item in batch if not item[1].cancelled()]
+        if len(batch) <= 0:
+            return
+        X_list = [X for X, _, _ in batch]
+        pred_batch = await loop.run_in_executor(
+            self._model_executor, self._predict_on_batch, X_list
+        )
+
+        end_time = time.perf_counter()
+        # pylint: disable=protected-access
+        for i, (_, future, start_time) in enumerate(batch):
+            if not future.done():
+                pred = tk.models._map_outputs(lambda r, i=i: r[i], pred_batch)
+                future.set_result(pred)
+        self.stats.add_batch([end_time - start_time for _, _, start_time in batch])
+
+    def _predict_on_batch(self, X_list):
+        """ミニバッチの推論。(モデル用スレッドで実行)"""
+        # pylint: disable=protected-access
+        X_batch = tk.models._map_outputs(lambda *x: np.stack(x), *X_list)
+        if self.on_batch_fn is not None:
+            pred = self.on_batch_fn(self.model, X_batch)
+        else:
+            pred = self.model.predict_on_batch(X_batch)
+        return tk.models._map_outputs(np.asarray, pred)
+
+
+class ServingStats:
+    """推論サーバーの統計情報。
+
+    Args:
+        window: レイテンシのパーセンタイルなどの算出に使う直近のリクエスト数
+
+    """
+
+    def __init__(self, window: int = 1000):
+        self.start_time = time.perf_counter()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.latencies: typing.Deque[float] = collections.deque(maxlen=window)
+        self.end_times: typing.Deque[float] = collections.deque(maxlen=window)
+
+    def add_batch(self, latencies: typing.Sequence[float]) -> None:
+        """推論したバッチの記録。
+
+        Args:
+            latencies: リクエスト毎のレイテンシ(秒)
+
+        """
+        now = time.perf_counter()
+        self.num_requests += len(latencies)
+        self.num_batches += 1
+        self.latencies.extend(latencies)
+        self.end_times.extend([now] * len(latencies))
+
+    def add_error(self, num_requests: int) -> None:
+        """推論に失敗したバッチの記録。"""
+        self.num_requests += num_requests
+        self.num_batches += 1
+        self.num_errors += num_requests
+
+    def to_dict(self) -> typing.Dict[str, float]:
+        """統計情報をdictで返す。
+
+        Returns:
+            - num_requests/num_batches/num_errors: 件数
+            - mean_batch_size: 平均バッチサイズ
+            - throughput: 開始からの平均スループット(リクエスト/秒)
+            - recent_throughput: 直近window件のスループット(リクエスト/秒)
+            - latency_mean/latency_p50/latency_p90/latency_p99: 直近window件のレイテンシ(秒)
+
+        """
+        now = time.perf_counter()
+        stats: typing.Dict[str, float] = {
+            "num_requests": self.num_requests,
+            "num_batches": self.num_batches,
+            "num_errors": self.num_errors,
+            "mean_batch_size": self.num_requests / max(self.num_batches, 1),
+            "throughput": self.num_requests / max(now - self.start_time, 1e-7),
+        }
+        if len(self.latencies) > 0:
+            latencies = np.array(self.latencies)
+            # 直近window件の最初のリクエストの受付時刻からの件数で算出
+            recent_start = self.end_times[0] - latencies[0]
+            stats["recent_throughput"] = len(latencies) / max(now - recent_start, 1e-7)
+            stats["latency_mean"] = float(np.mean(latencies))
+            for p, v in zip(
+                (50, 90, 99), np.percentile(latencies, [50, 90, 99]).tolist()
+            ):
+                stats[f"latency_p{p}"] = v
+        return stats
+
+
+async def serve_stats(
+    predictor: BatchingPredictor, host: str = "127.0.0.1", port: int = 8001
+) -> asyncio.AbstractServer:
+    """統計情報をJSONで返すHTTPサーバーを開始する。(GET /stats)
+
+    Args:
+        predictor: 対象のBatchingPredictor
+        host: listenするホスト
+        port: listenするポート (0なら空いているポート)
+
+    Returns:
+        サーバー (closeで停止する)
+
+    """
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while True:  # ヘッダーは読み捨てる
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/stats":
+                status = "200 OK"
+                body = json.dumps(predictor.stats.to_dict()).encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b'{"error": "not found"}'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
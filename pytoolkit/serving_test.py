@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+
+import numpy as np
+
+import pytoolkit as tk
+
+
+class _DataLoader(tk.data.DataLoader):
+    def get_data(self, dataset: tk.data.Dataset, index: int):
+        X, y = dataset.get_data(index)
+        return np.float32(X) / 2, y
+
+
+class _Model:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict_on_batch(self, X):
+        self.batch_sizes.append(len(X))
+        return [X * 10, X.sum(axis=-1)]
+
+
+def test_batching_predictor():
+    model = _Model()
+
+    async def run():
+        predictor = tk.serving.BatchingPredictor(
+            model, _DataLoader(batch_size=4), max_wait=0.1
+        )
+        await predictor.start()
+        server = await tk.serving.serve_stats(predictor, port=0)
+        try:
+            results = await asyncio.gather(
+                *[predictor.predict(np.array([i, i + 1])) for i in range(10)]
+            )
+
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /stats HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+            await predictor.stop()
+        return results, response
+
+    results, response = asyncio.run(run())
+
+    assert sum(model.batch_sizes) == 10
+    assert max(model.batch_sizes) <= 4
+    assert len(model.batch_sizes) < 10  # まとめて推論されている
+    for i, (r1, r2) in enumerate(results):
+        assert (r1 == np.array([i * 5, (i + 1) * 5])).all()
+        assert r2 == i + 0.5
+
+    header, body = response.split(b"\r\n\r\n", 1)
+    assert header.startswith(b"HTTP/1.1 200 OK")
+    stats = json.loads(body)
+    assert stats["num_requests"] == 10
+    assert stats["num_batches"] == len(model.batch_sizes)
+    assert stats["num_errors"] == 0
+    assert stats["latency_p99"] >= stats["latency_p50"] > 0
+
+
+def test_batching_predictor_stop():
+    started = threading.Event()
+    release = threading.Event()
+
+    class _SlowModel:
+        def predict_on_batch(self, X):
+            started.set()
+            release.wait()
+            return X
+
+    async def run():
+        predictor = tk.serving.BatchingPredictor(
+            _SlowModel(), _DataLoader(batch_size=2), max_wait=0
+        )
+        await predictor.start()
+        tasks = [
+            asyncio.ensure_future(predictor.predict(np.array([i, i + 1])))
+            for i in range(5)
+        ]
+        # 推論中のバッチと処理待ちのリクエストがある状態で停止する
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, started.wait)
+        stop_task = asyncio.ensure_future(predictor.stop())
+        await asyncio.sleep(0.1)
+        release.set()
+        await stop_task
+        return await asyncio.wait_for(
+            asyncio.gather(*tasks, return_exceptions=True), timeout=5
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+def test_batching_predictor_error():
+    class _BadModel:
+        def predict_on_batch(self, X):
+            return X[:1]  # 件数が合わない
+
+    async def run():
+        predictor = tk.serving.BatchingPredictor(
+            _BadModel(), _DataLoader(batch_size=4), max_wait=0.1
+        )
+        await predictor.start()
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(
+                    *[predictor.predict(np.array([i, i + 1])) for i in range(2)],
+                    return_exceptions=True,
+                ),
+                timeout=5,
+            )
+            # 失敗した後も次のリクエストを処理できる
+            predictor.model = _Model()
+            result = await asyncio.wait_for(predictor.predict(np.array([2, 3])), 5)
+        finally:
+            await predictor.stop()
+        return results, result
+
+    results, result = asyncio.run(run())
+    assert any(isinstance(r, IndexError) for r in results)
+    assert (result[0] == np.array([10, 15])).all()